@@ -23,6 +23,11 @@
 
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from PyQt5.QtCore import QFileInfo, QObject, QSize, Qt
 from PyQt5.QtDataVisualization import (Q3DSurface, Q3DTheme, QAbstract3DGraph,
         QHeightMapSurfaceDataProxy, QSurface3DSeries, QSurfaceDataItem,
@@ -42,6 +47,10 @@ class SurfaceGraph(QObject):
     heightMapGridStepZ = 6
     sampleMin = -8.0
     sampleMax = 8.0
+    heightMapMinX = 34.0
+    heightMapMaxX = 40.0
+    heightMapMinZ = 18.0
+    heightMapMaxZ = 24.0
 
     def __init__(self, surface):
         super(SurfaceGraph, self).__init__()
@@ -57,10 +66,20 @@ class SurfaceGraph(QObject):
 
         heightMapImage = QImage(
                 QFileInfo(__file__).absolutePath() + '/mountain.png')
-        self.m_heightMapProxy = QHeightMapSurfaceDataProxy(heightMapImage)
+
+        if numpy is not None:
+            # Fill an ordinary proxy the same way as the sqrt sin proxy.
+            self.m_heightMapImage = heightMapImage
+            self.m_heightMapProxy = QSurfaceDataProxy()
+            self.fillHeightMapProxy()
+        else:
+            self.m_heightMapProxy = QHeightMapSurfaceDataProxy(heightMapImage)
+            self.m_heightMapProxy.setValueRanges(self.heightMapMinX,
+                    self.heightMapMaxX, self.heightMapMinZ,
+                    self.heightMapMaxZ)
+
         self.m_heightMapSeries = QSurface3DSeries(self.m_heightMapProxy)
         self.m_heightMapSeries.setItemLabelFormat("(@xLabel, @zLabel): @yLabel")
-        self.m_heightMapProxy.setValueRanges(34.0, 40.0, 18.0, 24.0)
         self.m_heightMapWidth = heightMapImage.width()
         self.m_heightMapHeight = heightMapImage.height()
 
@@ -73,12 +92,21 @@ class SurfaceGraph(QObject):
         self.m_stepX = 0.0
         self.m_stepZ = 0.0
 
-    def fillSqrtSinProxy(self):
+    def fillSqrtSinProxy(self, firstRow=0, rowCount=None):
+        # Only the given rows are updated if the proxy already has data.
+        if rowCount is None:
+            rowCount = self.sampleCountZ - firstRow
+
+        if numpy is not None:
+            self.fillProxyRows(self.m_sqrtSinProxy, firstRow,
+                    *self.sqrtSinGrid(firstRow, rowCount))
+            return
+
         stepX = (self.sampleMax - self.sampleMin) / (self.sampleCountX - 1)
         stepZ = (self.sampleMax - self.sampleMin) / (self.sampleCountZ - 1)
 
         dataArray = []
-        for i in range(self.sampleCountZ):
+        for i in range(firstRow, firstRow + rowCount):
 
             # Keep values within range bounds, since just adding step can cause
             # minor drift due to the rounding errors.
@@ -93,7 +121,77 @@ class SurfaceGraph(QObject):
 
             dataArray.append(newRow)
 
-        self.m_sqrtSinProxy.resetArray(dataArray)
+        if firstRow == 0 and rowCount == self.sampleCountZ:
+            self.m_sqrtSinProxy.resetArray(dataArray)
+        else:
+            self.m_sqrtSinProxy.setRows(firstRow, dataArray)
+
+    def sqrtSinGrid(self, firstRow, rowCount):
+        stepX = (self.sampleMax - self.sampleMin) / (self.sampleCountX - 1)
+        stepZ = (self.sampleMax - self.sampleMin) / (self.sampleCountZ - 1)
+
+        x = numpy.minimum(self.sampleMax,
+                numpy.arange(self.sampleCountX) * stepX + self.sampleMin)
+        z = numpy.minimum(self.sampleMax,
+                numpy.arange(firstRow, firstRow + rowCount) * stepZ + self.sampleMin)
+        x, z = numpy.meshgrid(x, z)
+
+        R = numpy.sqrt(z * z + x * x) + 0.01
+        y = (numpy.sin(R) / R + 0.24) * 1.61
+
+        return x, y, z
+
+    def fillHeightMapProxy(self, firstRow=0, rowCount=None):
+        if rowCount is None:
+            rowCount = self.m_heightMapImage.height() - firstRow
+
+        self.fillProxyRows(self.m_heightMapProxy, firstRow,
+                *self.heightMapGrid(self.m_heightMapImage, firstRow,
+                        rowCount))
+
+    def heightMapGrid(self, image, firstRow, rowCount):
+        # This follows QHeightMapSurfaceDataProxy, ie. the height is the
+        # average of the red, green and blue components and the first row of
+        # the surface is the bottom row of the image.
+        image = image.convertToFormat(QImage.Format_RGB32)
+        width = image.width()
+        height = image.height()
+
+        ptr = image.constBits()
+        ptr.setsize(image.byteCount())
+        pixels = numpy.frombuffer(ptr, dtype=numpy.uint8).reshape(height,
+                image.bytesPerLine())[::-1, :width * 4].reshape(height, width, 4)
+        pixels = pixels[firstRow:firstRow + rowCount]
+
+        y = pixels[:, :, :3].sum(axis=2, dtype=numpy.float32) / 3.0
+
+        # The last row and column are explicitly set to the maximum values to
+        # avoid rounding errors.
+        mulX = (self.heightMapMaxX - self.heightMapMinX) / (width - 1)
+        mulZ = (self.heightMapMaxZ - self.heightMapMinZ) / (height - 1)
+
+        x = numpy.arange(width) * mulX + self.heightMapMinX
+        x[-1] = self.heightMapMaxX
+        z = numpy.arange(firstRow, firstRow + len(pixels)) * mulZ + self.heightMapMinZ
+        if firstRow + len(pixels) == height:
+            z[-1] = self.heightMapMaxZ
+        x, z = numpy.meshgrid(x, z)
+
+        return x, y, z
+
+    @staticmethod
+    def fillProxyRows(proxy, firstRow, x, y, z):
+        # x, y and z are arrays indexed by row and column.  Converting whole
+        # rows to lists and mapping the constructors over them keeps the work
+        # done for each item to a minimum.
+        dataArray = [list(map(QSurfaceDataItem, map(QVector3D, rowX, rowY, rowZ)))
+                for rowX, rowY, rowZ in zip(x.tolist(), y.tolist(),
+                        z.tolist())]
+
+        if firstRow == 0 and len(dataArray) >= proxy.rowCount():
+            proxy.resetArray(dataArray)
+        else:
+            proxy.setRows(firstRow, dataArray)
 
     def toggleModeNone(self):
         self.m_graph.setSelectionMode(QAbstract3DGraph.SelectionNone)
@@ -165,9 +263,9 @@ class SurfaceGraph(QObject):
 
         self.m_graph.axisX().setLabelFormat("%.1f N")
         self.m_graph.axisZ().setLabelFormat("%.1f E")
-        self.m_graph.axisX().setRange(34.0, 40.0)
+        self.m_graph.axisX().setRange(self.heightMapMinX, self.heightMapMaxX)
         self.m_graph.axisY().setAutoAdjustRange(True)
-        self.m_graph.axisZ().setRange(18.0, 24.0)
+        self.m_graph.axisZ().setRange(self.heightMapMinZ, self.heightMapMaxZ)
 
         self.m_graph.axisX().setTitle("Latitude")
         self.m_graph.axisY().setTitle("Height")
@@ -178,10 +276,10 @@ class SurfaceGraph(QObject):
 
         mapGridCountX = self.m_heightMapWidth // self.heightMapGridStepX
         mapGridCountZ = self.m_heightMapHeight // self.heightMapGridStepZ
-        self.m_rangeMinX = 34.0
-        self.m_rangeMinZ = 18.0
-        self.m_stepX = 6.0 / (mapGridCountX - 1)
-        self.m_stepZ = 6.0 / (mapGridCountZ - 1)
+        self.m_rangeMinX = self.heightMapMinX
+        self.m_rangeMinZ = self.heightMapMinZ
+        self.m_stepX = (self.heightMapMaxX - self.heightMapMinX) / (mapGridCountX - 1)
+        self.m_stepZ = (self.heightMapMaxZ - self.heightMapMinZ) / (mapGridCountZ - 1)
         self.m_axisMinSliderX.setMaximum(mapGridCountX - 2)
         self.m_axisMinSliderX.setValue(0)
         self.m_axisMaxSliderX.setMaximum(mapGridCountX - 1)
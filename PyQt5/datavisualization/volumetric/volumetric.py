@@ -21,7 +21,15 @@
 #############################################################################
 
 
-from PyQt5.QtCore import QFileInfo, QObject, QSize, Qt, QTimer
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from PyQt5.QtCore import (pyqtSignal, QElapsedTimer, QFileInfo, QObject,
+        QSize, Qt, QThread)
 from PyQt5.QtDataVisualization import (Q3DCamera, Q3DScatter, Q3DTheme,
         QAbstract3DGraph, QCustom3DLabel, QCustom3DVolume)
 from PyQt5.QtGui import (qBlue, qGreen, qRed, qRgba, QFont, QImage,
@@ -31,6 +39,72 @@ from PyQt5.QtWidgets import (QApplication, QCheckBox, QFrame, QGroupBox,
         QWidget)
 
 
+class VolumeBuilder(QObject):
+    """Generates chunks of slices and excavates the mine shafts of volume
+    textures in a pool of worker threads.  Finished work is reported to the
+    GUI thread by queued signals.
+    """
+
+    slicesReady = pyqtSignal(int, int, int)
+    shaftsReady = pyqtSignal(int)
+
+    taskFinished = pyqtSignal(int, int, int)
+
+    def __init__(self, modifier, workers=0, parent=None):
+        super(VolumeBuilder, self).__init__(parent)
+
+        self.modifier = modifier
+        self.executor = ThreadPoolExecutor(
+                workers or QThread.idealThreadCount())
+
+        # The submitted tasks keyed by texture size and start slice.  A start
+        # slice of -1 is used for the excavation of the mine shafts.
+        self.tasks = {}
+
+        self.taskFinished.connect(self.handleTaskFinished)
+
+    def build(self, textureSize, textureData, startIndexes):
+        for startIndex in startIndexes:
+            if (textureSize, startIndex) not in self.tasks:
+                self.tasks[textureSize, startIndex] = self.executor.submit(
+                        self.createSlices, textureSize, startIndex,
+                        textureData)
+
+    def excavate(self, textureSize, textureData):
+        if (textureSize, -1) not in self.tasks:
+            self.tasks[textureSize, -1] = self.executor.submit(
+                    self.excavateShafts, textureSize, textureData)
+
+    def cancel(self):
+        # Tasks that have already started are left to finish so that their
+        # work isn't lost.
+        for key, task in list(self.tasks.items()):
+            if task.cancel():
+                del self.tasks[key]
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown()
+
+    def createSlices(self, textureSize, startIndex, textureData):
+        endIndex = self.modifier.createVolume(textureSize, startIndex,
+                self.modifier.volumeChunkSlices, textureData)
+        self.taskFinished.emit(textureSize, startIndex, endIndex)
+
+    def excavateShafts(self, textureSize, textureData):
+        self.modifier.excavateMineShaft(textureSize, 0,
+                len(self.modifier.m_mineShaftArray), textureData)
+        self.taskFinished.emit(textureSize, -1, -1)
+
+    def handleTaskFinished(self, textureSize, startIndex, endIndex):
+        del self.tasks[textureSize, startIndex]
+
+        if startIndex < 0:
+            self.shaftsReady.emit(textureSize)
+        else:
+            self.slicesReady.emit(textureSize, startIndex, endIndex)
+
+
 class VolumetricModifier(QObject):
 
     lowDetailSize = 128
@@ -54,6 +128,13 @@ class VolumetricModifier(QObject):
     waterColorsMax = waterColorsMin + layerColorThickness
     terrainTransparency = 12
 
+    detailNames = {lowDetailSize: "Low", mediumDetailSize: "Medium",
+            highDetailSize: "High"}
+
+    # The number of slices generated at a time by the array implementation
+    # and by each task of the volume builder.
+    volumeChunkSlices = 16
+
     def __init__(self, scatter):
         super(VolumetricModifier, self).__init__()
 
@@ -70,11 +151,16 @@ class VolumetricModifier(QObject):
         self.m_lowDetailData = None
         self.m_mediumDetailData = None
         self.m_highDetailData = None
-        self.m_mediumDetailIndex = 0
-        self.m_timer = QTimer()
-        self.m_highDetailIndex = 0
-        self.m_mediumDetailShaftIndex = 0
-        self.m_highDetailShaftIndex = 0
+        self.m_detailData = {}
+        self.m_detailButtons = {}
+        self.m_detailSize = self.lowDetailSize
+        self.m_builder = None
+        self.m_buildOrder = [self.mediumDetailSize, self.highDetailSize]
+        self.m_buildSize = 0
+        self.m_buildBytes = 0
+        self.m_buildTime = QElapsedTimer()
+        self.m_builtChunks = {}
+        self.m_excavated = set()
         self.m_sliceSliderX = None
         self.m_sliceSliderY = None
         self.m_sliceSliderZ = None
@@ -115,10 +201,18 @@ class VolumetricModifier(QObject):
             self.m_graph.addCustomItem(warningLabel)
 
         else:
+            # Slices that haven't been generated yet are shown as air.
             self.m_lowDetailData = bytearray((self.lowDetailSize ** 3) // 2)
-            self.m_mediumDetailData = bytearray(
+            self.m_mediumDetailData = bytearray([self.airColorIndex]) * (
                     (self.mediumDetailSize ** 3) // 2)
-            self.m_highDetailData = bytearray((self.highDetailSize ** 3) // 2)
+            self.m_highDetailData = bytearray([self.airColorIndex]) * (
+                    (self.highDetailSize ** 3) // 2)
+
+            self.m_detailData = {self.lowDetailSize: self.m_lowDetailData,
+                    self.mediumDetailSize: self.m_mediumDetailData,
+                    self.highDetailSize: self.m_highDetailData}
+            self.m_builtChunks = {self.mediumDetailSize: set(),
+                    self.highDetailSize: set()}
 
             heightmaps_dir = QFileInfo(__file__).absolutePath() + '/heightmaps'
             self.m_groundLayer = self.initHeightMap(
@@ -134,6 +228,7 @@ class VolumetricModifier(QObject):
                     self.m_lowDetailData)
             self.excavateMineShaft(self.lowDetailSize, 0,
                     len(self.m_mineShaftArray), self.m_lowDetailData)
+            self.m_excavated.add(self.lowDetailSize)
 
             self.m_volumeItem = QCustom3DVolume()
 
@@ -222,19 +317,26 @@ class VolumetricModifier(QObject):
 
             self.m_graph.addCustomItem(self.m_volumeItem);
 
-            self.m_timer.start(0)
+            # Build the other detail levels in the background.
+            self.m_builder = VolumeBuilder(self)
+            self.m_builder.slicesReady.connect(self.handleSlicesReady)
+            self.m_builder.shaftsReady.connect(self.handleShaftsReady)
+            self.buildNextDetail()
 
         self.m_graph.currentFpsChanged.connect(self.handleFpsChange)
-        self.m_timer.timeout.connect(self.handleTimeout)
 
     def setFpsLabel(self, fpsLabel):
         self.m_fpsLabel = fpsLabel
 
     def setMediumDetailRB(self, button):
         self.m_mediumDetailRB = button
+        self.m_detailButtons[self.mediumDetailSize] = button
+        self.updateDetailButton(self.mediumDetailSize)
 
     def setHighDetailRB(self, button):
         self.m_highDetailRB = button
+        self.m_detailButtons[self.highDetailSize] = button
+        self.updateDetailButton(self.highDetailSize)
 
     def setSliceLabels(self, xLabel, yLabel, zLabel):
         self.m_sliceLabelX = xLabel
@@ -299,65 +401,128 @@ class VolumetricModifier(QObject):
     def handleFpsChange(self, fps):
         self.m_fpsLabel.setText("FPS: %.1f" % fps)
 
-    def handleTimeout(self):
-        if not self.m_mediumDetailRB.isEnabled():
-            if self.m_mediumDetailIndex != self.mediumDetailSize:
-                self.m_mediumDetailIndex = self.createVolume(
-                        self.mediumDetailSize, self.m_mediumDetailIndex, 4,
-                        self.m_mediumDetailData)
-            elif self.m_mediumDetailShaftIndex != len(self.m_mineShaftArray):
-                self.m_mediumDetailShaftIndex = self.excavateMineShaft(
-                        self.mediumDetailSize, self.m_mediumDetailShaftIndex,
-                        1, self.m_mediumDetailData)
-            else:
-                self.m_mediumDetailRB.setEnabled(True)
-                self.m_mediumDetailRB.setText(
-                        "Medium (%dx%dx%d)" % (self.mediumDetailSize,
-                                self.mediumDetailSize // 2,
-                                self.mediumDetailSize))
-
-        elif not self.m_highDetailRB.isEnabled():
-            if self.m_highDetailIndex != self.highDetailSize:
-                self.m_highDetailIndex = self.createVolume(
-                        self.highDetailSize, self.m_highDetailIndex, 1,
-                        self.m_highDetailData)
-            elif self.m_highDetailShaftIndex != len(self.m_mineShaftArray):
-                self.m_highDetailShaftIndex = self.excavateMineShaft(
-                        self.highDetailSize, self.m_highDetailShaftIndex, 1,
-                        self.m_highDetailData)
+    def buildNextDetail(self):
+        for textureSize in self.m_buildOrder:
+            if textureSize not in self.m_excavated:
+                break
+        else:
+            self.m_buildSize = 0
+            return
+
+        if textureSize != self.m_buildSize:
+            # Cancel the work that hasn't started on the previous level.
+            self.m_builder.cancel()
+
+            previousSize = self.m_buildSize
+            self.m_buildSize = textureSize
+            self.m_buildBytes = 0
+            self.m_buildTime.start()
+
+            self.updateDetailButton(previousSize)
+            self.updateDetailButton(textureSize)
+
+        textureData = self.m_detailData[textureSize]
+        builtChunks = self.m_builtChunks[textureSize]
+        startIndexes = [startIndex
+                for startIndex in range(0, textureSize, self.volumeChunkSlices)
+                        if startIndex not in builtChunks]
+
+        if startIndexes:
+            self.m_builder.build(textureSize, textureData, startIndexes)
+        else:
+            self.m_builder.excavate(textureSize, textureData)
+
+    def handleSlicesReady(self, textureSize, startIndex, endIndex):
+        self.m_builtChunks[textureSize].add(startIndex)
+
+        sliceSize = (textureSize * textureSize) // 2
+
+        if textureSize == self.m_buildSize:
+            self.m_buildBytes += (endIndex - startIndex) * sliceSize
+
+        if textureSize == self.m_detailSize:
+            # Only upload the slices that have just been generated.
+            textureData = self.m_detailData[textureSize]
+
+            for i in range(startIndex, endIndex):
+                self.m_volumeItem.setSubTextureData(Qt.ZAxis, i,
+                        bytes(textureData[i * sliceSize:(i + 1) * sliceSize]))
+
+            self.updateSliceLabels()
+
+        if textureSize == self.m_buildSize:
+            self.buildNextDetail()
+
+        self.updateDetailButton(textureSize)
+
+    def handleShaftsReady(self, textureSize):
+        self.m_excavated.add(textureSize)
+
+        # The shafts cross many slices so the whole texture is uploaded.
+        if textureSize == self.m_detailSize:
+            self.m_volumeItem.setTextureData(self.m_detailData[textureSize])
+            self.updateSliceLabels()
+
+        self.updateDetailButton(textureSize)
+        self.buildNextDetail()
+
+    def updateDetailButton(self, textureSize):
+        button = self.m_detailButtons.get(textureSize)
+        if button is None:
+            return
+
+        name = self.detailNames[textureSize]
+
+        if textureSize in self.m_excavated:
+            button.setText("%s (%dx%dx%d)" % (name, textureSize,
+                    textureSize // 2, textureSize))
+        else:
+            built = min(textureSize,
+                    len(self.m_builtChunks[textureSize]) * self.volumeChunkSlices)
+            progress = (100 * built) // textureSize
+
+            if textureSize == self.m_buildSize:
+                elapsed = self.m_buildTime.elapsed()
+                throughput = self.m_buildBytes / (elapsed * 1000.0) if elapsed else 0.0
+                button.setText("%s: generating %d%% (%.1f MB/s)" % (name,
+                        progress, throughput))
             else:
-                self.m_highDetailRB.setEnabled(True)
-                self.m_highDetailRB.setText(
-                        "High (%dx%dx%d)" % (self.highDetailSize,
-                                self.highDetailSize // 2, self.highDetailSize))
-                self.m_timer.stop()
+                button.setText("%s: queued %d%%" % (name, progress))
+
+    def showDetail(self, textureSize):
+        self.m_detailSize = textureSize
+        self.m_volumeItem.setTextureData(self.m_detailData[textureSize])
+        self.m_volumeItem.setTextureDimensions(textureSize, textureSize // 2,
+                textureSize)
+        self.updateSliceLabels()
+
+        # Build an unfinished level before any others so that its remaining
+        # slices stream in while it is being shown.
+        if textureSize not in self.m_excavated:
+            self.m_buildOrder.remove(textureSize)
+            self.m_buildOrder.insert(0, textureSize)
+            self.buildNextDetail()
+
+    def shutdown(self):
+        if self.m_builder is not None:
+            self.m_builder.shutdown()
+
+    def updateSliceLabels(self):
+        self.adjustSliceX(self.m_sliceSliderX.value())
+        self.adjustSliceY(self.m_sliceSliderY.value())
+        self.adjustSliceZ(self.m_sliceSliderZ.value())
 
     def toggleLowDetail(self, enabled):
         if enabled and self.m_volumeItem is not None:
-            self.m_volumeItem.setTextureData(self.m_lowDetailData)
-            self.m_volumeItem.setTextureDimensions(self.lowDetailSize,
-                    self.lowDetailSize // 2, self.lowDetailSize)
-            self.adjustSliceX(self.m_sliceSliderX.value())
-            self.adjustSliceY(self.m_sliceSliderY.value())
-            self.adjustSliceZ(self.m_sliceSliderZ.value())
+            self.showDetail(self.lowDetailSize)
 
     def toggleMediumDetail(self, enabled):
         if enabled and self.m_volumeItem is not None:
-            self.m_volumeItem.setTextureData(self.m_mediumDetailData)
-            self.m_volumeItem.setTextureDimensions(self.mediumDetailSize,
-                    self.mediumDetailSize // 2, self.mediumDetailSize)
-            self.adjustSliceX(self.m_sliceSliderX.value())
-            self.adjustSliceY(self.m_sliceSliderY.value())
-            self.adjustSliceZ(self.m_sliceSliderZ.value())
+            self.showDetail(self.mediumDetailSize)
 
     def toggleHighDetail(self, enabled):
         if enabled and self.m_volumeItem is not None:
-            self.m_volumeItem.setTextureData(self.m_highDetailData)
-            self.m_volumeItem.setTextureDimensions(self.highDetailSize,
-                    self.highDetailSize // 2, self.highDetailSize)
-            self.adjustSliceX(self.m_sliceSliderX.value())
-            self.adjustSliceY(self.m_sliceSliderY.value())
-            self.adjustSliceZ(self.m_sliceSliderZ.value())
+            self.showDetail(self.highDetailSize)
 
     def setFpsMeasurement(self, enabled):
         self.m_graph.setMeasureFps(enabled)
@@ -471,6 +636,10 @@ class VolumetricModifier(QObject):
 
     def initHeightMap(self, fileName):
         heightImage = QImage(fileName)
+
+        if numpy is not None:
+            return self.initHeightMapArray(heightImage)
+
         bits = heightImage.constBits().asarray(heightImage.byteCount())
         colorTable = heightImage.colorTable()
 
@@ -484,7 +653,22 @@ class VolumetricModifier(QObject):
 
         return layerData
 
+    def initHeightMapArray(self, heightImage):
+        # The height is the red component of each pixel's color.
+        ptr = heightImage.constBits()
+        ptr.setsize(heightImage.byteCount())
+        bits = numpy.frombuffer(ptr, dtype=numpy.uint8).reshape(
+                heightImage.height(), heightImage.bytesPerLine())
+        reds = numpy.array([qRed(color) for color in heightImage.colorTable()],
+                dtype=numpy.uint8)
+
+        return reds[bits[:self.layerDataSize, :self.layerDataSize]].ravel()
+
     def createVolume(self, textureSize, startIndex, count, textureData):
+        if numpy is not None:
+            return self.createVolumeArray(textureSize, startIndex, count,
+                    textureData)
+
         # Generate volume from layer data.
         index = (startIndex * textureSize * textureSize) // 2
         endIndex = min(startIndex + count, textureSize)
@@ -530,7 +714,66 @@ class VolumetricModifier(QObject):
 
         return endIndex
 
+    def createVolumeArray(self, textureSize, startIndex, count, textureData):
+        # Generate whole slices of the volume at once.  The texture data is
+        # viewed as an array indexed by z, y and x so that it is filled in
+        # place.
+        endIndex = min(startIndex + count, textureSize)
+        volume = self.volumeArray(textureSize, textureData)
+        multiplier = float(self.layerDataSize) / float(textureSize)
+
+        # The rows of the layers used by each slice and the columns used by
+        # each x.
+        rows = (numpy.arange(startIndex, endIndex) * multiplier).astype(int)
+        columns = (numpy.arange(textureSize) * multiplier).astype(int)
+
+        # The height of each y.
+        heights = ((self.layerDataSize -
+                (numpy.arange(textureSize // 2) * 2 * multiplier)) / 2).astype(int)
+        heights = heights[numpy.newaxis, :, numpy.newaxis]
+
+        thickness = float(self.layerColorThickness)
+        div = float(self.heightToColorDiv)
+
+        for first in range(0, len(rows), self.volumeChunkSlices):
+            chunkRows = rows[first:first + self.volumeChunkSlices, numpy.newaxis]
+            layerIndex = chunkRows * self.layerDataSize + columns
+
+            # Layer heights indexed by slice, (broadcast) y and x.
+            magmaHeights = self.m_magmaLayer[layerIndex][:, numpy.newaxis, :].astype(int)
+            waterHeights = self.m_waterLayer[layerIndex][:, numpy.newaxis, :].astype(int)
+            groundHeights = self.m_groundLayer[layerIndex][:, numpy.newaxis, :].astype(int)
+
+            belowMagma = heights < magmaHeights
+            belowWater = heights < waterHeights
+            belowGround = heights < groundHeights
+
+            colorIndex = numpy.select(
+                    [belowMagma,
+                     belowGround & belowWater,
+                     belowWater,
+                     heights <= groundHeights],
+                    [(heights / div * thickness).astype(int) + self.magmaColorsMin,
+                     ((waterHeights - heights) / div * thickness).astype(int) + self.underWaterGroundColorsMin,
+                     ((heights - magmaHeights) / div * thickness).astype(int) + self.waterColorsMin,
+                     ((heights - waterHeights) / div * thickness).astype(int) + self.aboveWaterGroundColorsMin],
+                    self.airColorIndex)
+
+            slices = startIndex + first
+            volume[slices:slices + len(chunkRows)] = colorIndex
+
+        return endIndex
+
+    @staticmethod
+    def volumeArray(textureSize, textureData):
+        return numpy.frombuffer(textureData, dtype=numpy.uint8).reshape(
+                textureSize, textureSize // 2, textureSize)
+
     def excavateMineShaft(self, textureSize, startIndex, count, textureData):
+        if numpy is not None:
+            return self.excavateMineShaftArray(textureSize, startIndex, count,
+                    textureData)
+
         endIndex = min(startIndex + count, len(self.m_mineShaftArray))
         shaftSize = (self.mineShaftDiameter * textureSize) // self.lowDetailSize
 
@@ -561,6 +804,34 @@ class VolumetricModifier(QObject):
 
         return endIndex
 
+    def excavateMineShaftArray(self, textureSize, startIndex, count,
+            textureData):
+        # Each shaft is a row of blocks so it is carved as a single box.
+        endIndex = min(startIndex + count, len(self.m_mineShaftArray))
+        shaftSize = (self.mineShaftDiameter * textureSize) // self.lowDetailSize
+        volume = self.volumeArray(textureSize, textureData)
+
+        for shaftStart, shaftEnd in self.m_mineShaftArray[startIndex:endIndex]:
+            shaftLen = int((shaftEnd - shaftStart).length() * self.lowDetailSize)
+            x = int(shaftStart.x() * textureSize - (shaftSize // 2))
+            y = int((shaftStart.y() * textureSize - (shaftSize // 2)) / 2)
+            z = int(shaftStart.z() * textureSize - (shaftSize // 2))
+            width = height = depth = shaftSize
+
+            if shaftStart.x() != shaftEnd.x():
+                width *= shaftLen + 1
+            elif shaftStart.y() != shaftEnd.y():
+                # Vertical shafts are half as long.
+                height *= shaftLen // 2 + 1
+            else:
+                depth *= shaftLen + 1
+
+            block = volume[z:z + depth, y:y + height, x:x + width]
+            numpy.copyto(block, self.mineShaftColorIndex,
+                    where=(block != self.airColorIndex))
+
+        return endIndex
+
     @classmethod
     def excavateMineBlock(cls, textureSize, dataIndex, size, textureData):
         for k in range(size):
@@ -701,12 +972,10 @@ if __name__ == '__main__':
     mediumDetailRB = QRadioButton()
     mediumDetailRB.setText("Generating...")
     mediumDetailRB.setChecked(False)
-    mediumDetailRB.setEnabled(False)
 
     highDetailRB = QRadioButton()
     highDetailRB.setText("Generating...")
     highDetailRB.setChecked(False)
-    highDetailRB.setEnabled(False)
 
     textureDetailVBox = QVBoxLayout()
     textureDetailVBox.addWidget(lowDetailRB)
@@ -834,6 +1103,8 @@ if __name__ == '__main__':
     areaMountainRB.toggled.connect(modifier.toggleAreaMountain)
     drawSliceFramesCheckBox.stateChanged.connect(modifier.setDrawSliceFrames)
 
+    app.aboutToQuit.connect(modifier.shutdown)
+
     widget.show()
 
     sys.exit(app.exec_())
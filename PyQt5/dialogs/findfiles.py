@@ -42,13 +42,203 @@
 #############################################################################
 
 
-from PyQt5.QtCore import (QDir, QIODevice, QFile, QFileInfo, Qt, QTextStream,
-        QUrl)
+import fnmatch
+import mmap
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import (pyqtSignal, QDir, QElapsedTimer, QObject, Qt,
+        QThread, QTimer, QUrl)
 from PyQt5.QtGui import QDesktopServices
 from PyQt5.QtWidgets import (QAbstractItemView, QApplication, QComboBox,
         QDialog, QFileDialog, QGridLayout, QHBoxLayout, QHeaderView, QLabel,
-        QProgressDialog, QPushButton, QSizePolicy, QTableWidget,
-        QTableWidgetItem)
+        QPushButton, QSizePolicy, QTableWidget, QTableWidgetItem)
+
+
+class FileSearcher(QObject):
+    """Walks a directory tree and searches the contents of the files whose
+    names match in a pool of worker threads.  Matching files are reported to
+    the GUI thread by queued signals as they are found.
+    """
+
+    ChunkSize = 1 << 20
+    MapSize = 1 << 24
+    BinaryCheckSize = 8192
+
+    fileFound = pyqtSignal(int, str, 'qint64')
+    searchFinished = pyqtSignal(int)
+
+    def __init__(self, workers=0, parent=None):
+        super(FileSearcher, self).__init__(parent)
+
+        self.workers = workers or QThread.idealThreadCount()
+        self.walker = ThreadPoolExecutor(1)
+        self.executor = ThreadPoolExecutor(self.workers)
+
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.generation = 0
+        self.searchedFiles = 0
+        self.searchedBytes = 0
+        self.binaryFiles = 0
+
+    def search(self, path, pattern, text):
+        """Start a search, abandoning any search that is in progress, and
+        return the generation that identifies the signals of the search.
+        """
+
+        self.cancel()
+        self.cancelled = threading.Event()
+
+        with self.lock:
+            self.generation += 1
+            self.searchedFiles = 0
+            self.searchedBytes = 0
+            self.binaryFiles = 0
+
+        self.walker.submit(self.walk, self.generation, self.cancelled, path,
+                pattern, text.encode('utf-8'))
+
+        return self.generation
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def shutdown(self):
+        self.cancel()
+        self.walker.shutdown()
+        self.executor.shutdown()
+
+    def statistics(self):
+        # Return the number of files and bytes searched so far and the number
+        # of files skipped as binary.
+        with self.lock:
+            return self.searchedFiles, self.searchedBytes, self.binaryFiles
+
+    def walk(self, generation, cancelled, path, pattern, text):
+        # Limit the number of searches waiting in the pool so that a large
+        # tree doesn't queue a task for every file.
+        maxPending = 4 * self.workers
+        pending = threading.Semaphore(maxPending)
+
+        # Match file names case-insensitively, as QDir does.
+        nameRegExp = re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+
+        directories = [(path, '')]
+        while directories and not cancelled.is_set():
+            directory, prefix = directories.pop()
+
+            try:
+                with os.scandir(directory) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name,
+                            reverse=True)
+            except OSError:
+                continue
+
+            for entry in entries:
+                if cancelled.is_set():
+                    break
+
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(
+                                (entry.path, prefix + entry.name + '/'))
+                        continue
+
+                    if (not entry.is_file(follow_symlinks=False) or
+                            not nameRegExp.match(entry.name)):
+                        continue
+
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+
+                if not text:
+                    self.fileFound.emit(generation, prefix + entry.name, size)
+                    continue
+
+                pending.acquire()
+                self.executor.submit(self.searchFile, generation, cancelled,
+                        entry.path, prefix + entry.name, size, text, pending)
+
+        # Wait for the outstanding searches.
+        for i in range(maxPending):
+            pending.acquire()
+
+        self.searchFinished.emit(generation)
+
+    def searchFile(self, generation, cancelled, filePath, fileName, size, text,
+            pending):
+        try:
+            if cancelled.is_set():
+                return
+
+            try:
+                found, searched = self.fileContains(filePath, size, text,
+                        cancelled)
+            except (OSError, ValueError):
+                return
+
+            with self.lock:
+                if generation == self.generation:
+                    self.searchedFiles += 1
+                    self.searchedBytes += searched
+                    if found is None:
+                        self.binaryFiles += 1
+
+            if found:
+                self.fileFound.emit(generation, fileName, size)
+        finally:
+            pending.release()
+
+    def fileContains(self, filePath, size, text, cancelled):
+        # Return whether a file contains the text, or None if it looks like a
+        # binary file, and the number of bytes that were read.  Large files
+        # are memory mapped.  Either way the file is searched a chunk at a
+        # time so that the search can stop at the first match or when it is
+        # cancelled.
+        overlap = len(text) - 1
+
+        with open(filePath, 'rb') as inFile:
+            if size >= self.MapSize:
+                with mmap.mmap(inFile.fileno(), 0,
+                        access=mmap.ACCESS_READ) as mapped:
+                    size = len(mapped)
+                    if b'\0' in mapped[:self.BinaryCheckSize]:
+                        return None, min(size, self.BinaryCheckSize)
+
+                    for start in range(0, size, self.ChunkSize):
+                        if cancelled.is_set():
+                            return False, start
+
+                        end = min(start + self.ChunkSize + overlap, size)
+                        if mapped.find(text, start, end) >= 0:
+                            return True, end
+
+                    return False, size
+
+            searched = 0
+            tail = b''
+
+            while not cancelled.is_set():
+                chunk = inFile.read(self.ChunkSize)
+                if not chunk:
+                    break
+
+                if searched == 0 and b'\0' in chunk[:self.BinaryCheckSize]:
+                    return None, len(chunk)
+
+                searched += len(chunk)
+
+                if text in chunk or (tail and text in tail + chunk[:overlap]):
+                    return True, searched
+
+                if overlap:
+                    tail = chunk[-overlap:]
+
+            return False, searched
 
 
 class Window(QDialog):
@@ -56,7 +246,9 @@ class Window(QDialog):
         super(Window, self).__init__(parent)
 
         browseButton = self.createButton("&Browse...", self.browse)
-        findButton = self.createButton("&Find", self.find)
+        self.findButton = self.createButton("&Find", self.find)
+        self.stopButton = self.createButton("&Stop", self.stop)
+        self.stopButton.setEnabled(False)
 
         self.fileComboBox = self.createComboBox("*")
         self.textComboBox = self.createComboBox()
@@ -66,12 +258,27 @@ class Window(QDialog):
         textLabel = QLabel("Containing text:")
         directoryLabel = QLabel("In directory:")
         self.filesFoundLabel = QLabel()
+        self.statisticsLabel = QLabel()
 
         self.createFilesTable()
 
+        self.searcher = FileSearcher(parent=self)
+        self.searcher.fileFound.connect(self.addFile)
+        self.searcher.searchFinished.connect(self.finishSearch)
+        self.generation = 0
+        self.foundFiles = []
+
+        # Found files are added to the table and the statistics updated
+        # periodically rather than for every file.
+        self.searchTime = QElapsedTimer()
+        self.updateTimer = QTimer(self)
+        self.updateTimer.setInterval(200)
+        self.updateTimer.timeout.connect(self.updateSearch)
+
         buttonsLayout = QHBoxLayout()
         buttonsLayout.addStretch()
-        buttonsLayout.addWidget(findButton)
+        buttonsLayout.addWidget(self.findButton)
+        buttonsLayout.addWidget(self.stopButton)
 
         mainLayout = QGridLayout()
         mainLayout.addWidget(fileLabel, 0, 0)
@@ -82,8 +289,9 @@ class Window(QDialog):
         mainLayout.addWidget(self.directoryComboBox, 2, 1)
         mainLayout.addWidget(browseButton, 2, 2)
         mainLayout.addWidget(self.filesTable, 3, 0, 1, 3)
-        mainLayout.addWidget(self.filesFoundLabel, 4, 0)
-        mainLayout.addLayout(buttonsLayout, 5, 0, 1, 3)
+        mainLayout.addWidget(self.filesFoundLabel, 4, 0, 1, 3)
+        mainLayout.addWidget(self.statisticsLabel, 5, 0, 1, 3)
+        mainLayout.addLayout(buttonsLayout, 6, 0, 1, 3)
         self.setLayout(mainLayout)
 
         self.setWindowTitle("Find Files")
@@ -118,63 +326,70 @@ class Window(QDialog):
         self.currentDir = QDir(path)
         if not fileName:
             fileName = "*"
-        files = self.currentDir.entryList([fileName],
-                QDir.Files | QDir.NoSymLinks)
-
-        if text:
-            files = self.findFiles(files, text)
-        self.showFiles(files)
-
-    def findFiles(self, files, text):
-        progressDialog = QProgressDialog(self)
-
-        progressDialog.setCancelButtonText("&Cancel")
-        progressDialog.setRange(0, files.count())
-        progressDialog.setWindowTitle("Find Files")
-
-        foundFiles = []
-
-        for i in range(files.count()):
-            progressDialog.setValue(i)
-            progressDialog.setLabelText("Searching file number %d of %d..." % (i, files.count()))
-            QApplication.processEvents()
-
-            if progressDialog.wasCanceled():
-                break
-
-            inFile = QFile(self.currentDir.absoluteFilePath(files[i]))
-
-            if inFile.open(QIODevice.ReadOnly):
-                stream = QTextStream(inFile)
-                while not stream.atEnd():
-                    if progressDialog.wasCanceled():
-                        break
-                    line = stream.readLine()
-                    if text in line:
-                        foundFiles.append(files[i])
-                        break
-
-        progressDialog.close()
 
-        return foundFiles
+        # The directory tree is searched recursively with the contents of
+        # the files searched in worker threads.
+        self.foundFiles = []
+        self.filesFoundLabel.clear()
+        self.statisticsLabel.clear()
+        self.generation = self.searcher.search(self.currentDir.absolutePath(),
+                fileName, text)
+
+        self.searchTime.start()
+        self.updateTimer.start()
+        self.findButton.setEnabled(False)
+        self.stopButton.setEnabled(True)
+
+    def stop(self):
+        self.searcher.cancel()
+
+    def done(self, result):
+        self.searcher.shutdown()
+        super(Window, self).done(result)
+
+    def addFile(self, generation, fileName, size):
+        if generation == self.generation:
+            self.foundFiles.append((fileName, size))
+
+    def finishSearch(self, generation):
+        if generation != self.generation:
+            return
+
+        self.updateTimer.stop()
+        self.updateSearch()
+
+        self.findButton.setEnabled(True)
+        self.stopButton.setEnabled(False)
+
+    def updateSearch(self):
+        self.showFiles(self.foundFiles)
+        self.foundFiles = []
+
+        files, size, binaryFiles = self.searcher.statistics()
+        if files:
+            seconds = max(self.searchTime.elapsed(), 1) / 1000.0
+            self.statisticsLabel.setText(
+                    "Searched %d file(s), %.1f MB, %d binary skipped "
+                    "(%.0f files/sec, %.1f MB/sec)" % (files,
+                            size / 1048576.0, binaryFiles, files / seconds,
+                            size / 1048576.0 / seconds))
 
     def showFiles(self, files):
-        for fn in files:
-            file = QFile(self.currentDir.absoluteFilePath(fn))
-            size = QFileInfo(file).size()
+        row = self.filesTable.rowCount()
+        self.filesTable.setRowCount(row + len(files))
 
+        for fn, size in files:
             fileNameItem = QTableWidgetItem(fn)
             fileNameItem.setFlags(fileNameItem.flags() ^ Qt.ItemIsEditable)
             sizeItem = QTableWidgetItem("%d KB" % (int((size + 1023) / 1024)))
             sizeItem.setTextAlignment(Qt.AlignVCenter | Qt.AlignRight)
             sizeItem.setFlags(sizeItem.flags() ^ Qt.ItemIsEditable)
 
-            row = self.filesTable.rowCount()
-            self.filesTable.insertRow(row)
             self.filesTable.setItem(row, 0, fileNameItem)
             self.filesTable.setItem(row, 1, sizeItem)
+            row += 1
 
-        self.filesFoundLabel.setText("%d file(s) found (Double click on a file to open it)" % len(files))
+        self.filesFoundLabel.setText("%d file(s) found (Double click on a file to open it)" % self.filesTable.rowCount())
 
     def createButton(self, text, member):
         button = QPushButton(text)
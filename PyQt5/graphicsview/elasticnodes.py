@@ -44,6 +44,11 @@
 
 import math
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from PyQt5.QtCore import (qAbs, QLineF, QPointF, qrand, QRectF, QSizeF, qsrand,
         Qt, QTime)
 from PyQt5.QtGui import (QBrush, QColor, QLinearGradient, QPainter,
@@ -109,6 +114,12 @@ class Edge(QGraphicsItem):
             self.sourcePoint = line.p1()
             self.destPoint = line.p1()
 
+    def setEndPoints(self, sourcePoint, destPoint):
+        self.prepareGeometryChange()
+
+        self.sourcePoint = sourcePoint
+        self.destPoint = destPoint
+
     def boundingRect(self):
         if not self.source or not self.dest:
             return QRectF()
@@ -253,8 +264,9 @@ class Node(QGraphicsItem):
 
     def itemChange(self, change, value):
         if change == QGraphicsItem.ItemPositionHasChanged:
-            for edge in self.edgeList:
-                edge.adjust()
+            if not self.graph.deferEdgeAdjustment:
+                for edge in self.edgeList:
+                    edge.adjust()
             self.graph.itemMoved()
 
         return super(Node, self).itemChange(change, value)
@@ -268,11 +280,220 @@ class Node(QGraphicsItem):
         super(Node, self).mouseReleaseEvent(event)
 
 
+class ForceLayout(object):
+    """Calculates the forces acting on every node of a graph at once using
+    arrays of node positions.
+
+    The nodes are placed in a uniform grid.  The repulsion between nodes in the
+    same or adjacent cells is calculated exactly and the repulsion from the
+    nodes of every other cell is approximated by the repulsion of their
+    centroid.  This makes a step roughly linear in the number of nodes rather
+    than quadratic.
+    """
+
+    # Smaller graphs use the forces calculated by each node.
+    MinimumNodes = 200
+
+    NodesPerCell = 16
+    MinimumCellSize = 20.0
+    BlockSize = 256
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.nodes = []
+
+    def setNodes(self, nodes):
+        self.nodes = nodes
+        self.nodeIndex = {id(node): i for i, node in enumerate(nodes)}
+
+        self.edges = []
+        sources = []
+        dests = []
+        for node in nodes:
+            for edge in node.edges():
+                if edge.sourceNode() is node:
+                    self.edges.append(edge)
+                    sources.append(self.nodeIndex[id(node)])
+                    dests.append(self.nodeIndex[id(edge.destNode())])
+
+        self.sources = numpy.array(sources, dtype=numpy.intp)
+        self.dests = numpy.array(dests, dtype=numpy.intp)
+        self.weights = numpy.array([(len(node.edges()) + 1) * 10.0
+                for node in nodes])
+
+    def advance(self, nodes):
+        """Move the nodes by one step and return True if any of them moved."""
+
+        scene = self.graph.scene()
+
+        if nodes != self.nodes:
+            self.setNodes(nodes)
+
+        positions = numpy.array([(node.x(), node.y()) for node in nodes])
+        velocities = self.repulsion(positions) + self.attraction(positions)
+
+        velocities[(numpy.abs(velocities) < 0.1).all(axis=1)] = 0.0
+
+        sceneRect = scene.sceneRect()
+        newPositions = positions + velocities
+        numpy.clip(newPositions[:, 0], sceneRect.left() + 10,
+                sceneRect.right() - 10, out=newPositions[:, 0])
+        numpy.clip(newPositions[:, 1], sceneRect.top() + 10,
+                sceneRect.bottom() - 10, out=newPositions[:, 1])
+
+        grabber = scene.mouseGrabberItem()
+        if grabber is not None and id(grabber) in self.nodeIndex:
+            i = self.nodeIndex[id(grabber)]
+            newPositions[i] = positions[i]
+
+        movedNodes = (newPositions != positions).any(axis=1)
+        moved = numpy.nonzero(movedNodes)[0]
+
+        # The edges are adjusted once all the nodes have been moved rather than
+        # every time one of their nodes moves.
+        self.graph.deferEdgeAdjustment = True
+        try:
+            for i, x, y in zip(moved.tolist(), newPositions[moved, 0].tolist(),
+                    newPositions[moved, 1].tolist()):
+                nodes[i].setPos(x, y)
+        finally:
+            self.graph.deferEdgeAdjustment = False
+
+        self.adjustEdges(newPositions,
+                movedNodes[self.sources] | movedNodes[self.dests])
+
+        return len(moved) != 0
+
+    def adjustEdges(self, positions, edgesMoved):
+        # This is Edge.adjust() applied to all the moved edges at once.  Edges
+        # are never moved themselves so node positions are also edge
+        # coordinates.
+        edges = numpy.nonzero(edgesMoved)[0]
+        sourcePoints = positions[self.sources[edges]]
+        destPoints = positions[self.dests[edges]]
+
+        delta = destPoints - sourcePoints
+        length = numpy.sqrt((delta * delta).sum(axis=1))
+        longEdges = length > 20.0
+        offset = numpy.zeros_like(delta)
+        offset[longEdges] = delta[longEdges] * 10 / length[longEdges, numpy.newaxis]
+
+        destPoints = numpy.where(longEdges[:, numpy.newaxis], destPoints - offset,
+                sourcePoints)
+        sourcePoints = sourcePoints + offset
+
+        for k, (sx, sy), (dx, dy) in zip(edges.tolist(), sourcePoints.tolist(),
+                destPoints.tolist()):
+            self.edges[k].setEndPoints(QPointF(sx, sy), QPointF(dx, dy))
+
+    def attraction(self, positions):
+        n = len(positions)
+        delta = positions[self.dests] - positions[self.sources]
+        sourceWeights = self.weights[self.sources]
+        destWeights = self.weights[self.dests]
+
+        velocities = numpy.empty((n, 2))
+        for axis in (0, 1):
+            velocities[:, axis] = (
+                    numpy.bincount(self.sources,
+                            delta[:, axis] / sourceWeights, minlength=n) -
+                    numpy.bincount(self.dests,
+                            delta[:, axis] / destWeights, minlength=n))
+
+        return velocities
+
+    def repulsion(self, positions):
+        n = len(positions)
+        origin = positions.min(axis=0)
+        extent = positions.max(axis=0) - origin
+        cellSize = max(math.sqrt(extent[0] * extent[1] * self.NodesPerCell / n),
+                self.MinimumCellSize)
+
+        cells = ((positions - origin) // cellSize).astype(numpy.intp)
+        columns = cells[:, 0].max() + 1
+        rows = cells[:, 1].max() + 1
+        keys = cells[:, 1] * columns + cells[:, 0]
+
+        # The nodes sorted by cell and the start of each cell in that order.
+        order = numpy.argsort(keys, kind='stable')
+        counts = numpy.bincount(keys, minlength=rows * columns)
+        starts = numpy.cumsum(counts) - counts
+
+        velocities = numpy.zeros((n, 2))
+
+        # Repulsion from the nodes in the same and the adjacent cells.
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                neighbourColumns = cells[:, 0] + dx
+                neighbourRows = cells[:, 1] + dy
+                nodes = numpy.nonzero((neighbourColumns >= 0) &
+                        (neighbourColumns < columns) &
+                        (neighbourRows >= 0) & (neighbourRows < rows))[0]
+                neighbourKeys = (neighbourRows[nodes] * columns +
+                        neighbourColumns[nodes])
+
+                numNeighbours = counts[neighbourKeys]
+                total = numNeighbours.sum()
+                if total == 0:
+                    continue
+
+                firsts = numpy.repeat(numpy.cumsum(numNeighbours) - numNeighbours,
+                        numNeighbours)
+                this = numpy.repeat(nodes, numNeighbours)
+                other = order[numpy.repeat(starts[neighbourKeys], numNeighbours) +
+                        numpy.arange(total) - firsts]
+
+                self.addRepulsion(velocities, this,
+                        positions[this] - positions[other])
+
+        # Repulsion from the centroids of the other cells.
+        occupied = numpy.nonzero(counts)[0]
+        masses = counts[occupied].astype(float)
+        centroids = numpy.column_stack([
+                numpy.bincount(keys, positions[:, axis],
+                        minlength=rows * columns)[occupied] / masses
+                for axis in (0, 1)])
+        cellColumns = occupied % columns
+        cellRows = occupied // columns
+
+        cellVelocities = numpy.zeros((len(occupied), 2))
+        for first in range(0, len(occupied), self.BlockSize):
+            block = slice(first, first + self.BlockSize)
+            delta = centroids[block, numpy.newaxis, :] - centroids[numpy.newaxis, :, :]
+            adjacent = ((numpy.abs(cellColumns[block, numpy.newaxis] - cellColumns) <= 1) &
+                    (numpy.abs(cellRows[block, numpy.newaxis] - cellRows) <= 1))
+            l = 2.0 * (delta * delta).sum(axis=2)
+            l[adjacent] = 1.0
+            scale = numpy.where(adjacent, 0.0, masses * 150.0 / l)
+            cellVelocities[block] = (delta * scale[:, :, numpy.newaxis]).sum(axis=1)
+
+        velocities += cellVelocities[numpy.searchsorted(occupied, keys)]
+
+        return velocities
+
+    @staticmethod
+    def addRepulsion(velocities, nodes, delta):
+        l = 2.0 * (delta * delta).sum(axis=1)
+        apart = l > 0
+        nodes = nodes[apart]
+        scale = 150.0 / l[apart]
+
+        for axis in (0, 1):
+            velocities[:, axis] += numpy.bincount(nodes,
+                    delta[apart, axis] * scale, minlength=len(velocities))
+
+
 class GraphWidget(QGraphicsView):
     def __init__(self):
         super(GraphWidget, self).__init__()
 
         self.timerId = 0
+        self.deferEdgeAdjustment = False
+
+        if numpy is not None:
+            self.forceLayout = ForceLayout(self)
+        else:
+            self.forceLayout = None
 
         scene = QGraphicsScene(self)
         scene.setItemIndexMethod(QGraphicsScene.NoIndex)
@@ -331,7 +552,7 @@ class GraphWidget(QGraphicsView):
 
     def itemMoved(self):
         if not self.timerId:
-            self.timerId = self.startTimer(1000 / 25)
+            self.timerId = self.startTimer(1000 // 25)
 
     def keyPressEvent(self, event):
         key = event.key()
@@ -358,13 +579,16 @@ class GraphWidget(QGraphicsView):
     def timerEvent(self, event):
         nodes = [item for item in self.scene().items() if isinstance(item, Node)]
 
-        for node in nodes:
-            node.calculateForces()
+        if self.forceLayout is not None and len(nodes) >= self.forceLayout.MinimumNodes:
+            itemsMoved = self.forceLayout.advance(nodes)
+        else:
+            for node in nodes:
+                node.calculateForces()
 
-        itemsMoved = False
-        for node in nodes:
-            if node.advance():
-                itemsMoved = True
+            itemsMoved = False
+            for node in nodes:
+                if node.advance():
+                    itemsMoved = True
 
         if not itemsMoved:
             self.killTimer(self.timerId)
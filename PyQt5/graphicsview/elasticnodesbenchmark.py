@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+# A headless benchmark of the elasticnodes layout.  Graphs of increasing size
+# are built offscreen and the layout is advanced by calling the timerEvent()
+# of the graph widget directly.  The results are written as JSON so that the
+# layout engines can be compared and regressions caught, for example:
+#
+#   python elasticnodesbenchmark.py --sizes 100,1000,10000 --engine array
+
+
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# The benchmark doesn't need a display.
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QCommandLineOption, QCommandLineParser
+from PyQt5.QtWidgets import QApplication
+
+from elasticnodes import Edge, ForceLayout, GraphWidget, Node
+
+
+# The area of the scene for each node (the original example has 9 nodes in a
+# 400x400 scene).
+AreaPerNode = 400 * 400 / 9.0
+
+
+def buildGraph(numNodes, edgesPerNode, engine):
+    graph = GraphWidget()
+    scene = graph.scene()
+    scene.clear()
+
+    halfSize = math.sqrt(numNodes * AreaPerNode) / 2
+    scene.setSceneRect(-halfSize, -halfSize, 2 * halfSize, 2 * halfSize)
+
+    nodes = []
+    for i in range(numNodes):
+        node = Node(graph)
+        scene.addItem(node)
+        node.setPos(random.uniform(-halfSize, halfSize),
+                random.uniform(-halfSize, halfSize))
+        nodes.append(node)
+
+    for i in range(int(numNodes * edgesPerNode)):
+        source, dest = random.sample(nodes, 2)
+        scene.addItem(Edge(source, dest))
+
+    if engine == 'nodes':
+        graph.forceLayout = None
+    elif engine == 'array':
+        if graph.forceLayout is None:
+            raise ValueError("the array engine requires numpy")
+        graph.forceLayout.MinimumNodes = 0
+
+    return graph
+
+
+def positions(graph):
+    return [(item.x(), item.y()) for item in graph.scene().items()
+            if isinstance(item, Node)]
+
+
+def tick(graph, settleDistance):
+    """Advance the layout by one step and return a tuple of the time taken,
+    the number of bytes allocated by the step (or None if allocations aren't
+    being traced) and a flag that is set if the layout has settled, ie. the
+    timer has been stopped or no node has moved by more than settleDistance.
+    """
+
+    before = positions(graph)
+
+    # The bytes allocated are the most that the traced memory grows by during
+    # the step, whether or not they are freed before it ends.
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+
+    start = time.perf_counter()
+    graph.timerEvent(None)
+    elapsed = time.perf_counter() - start
+
+    if tracing:
+        _, peak = tracemalloc.get_traced_memory()
+        allocated = peak - current
+    else:
+        allocated = None
+
+    if graph.timerId == 0:
+        return elapsed, allocated, True
+
+    after = positions(graph)
+    distance = max(abs(x1 - x0) + abs(y1 - y0)
+            for (x0, y0), (x1, y1) in zip(before, after))
+
+    return elapsed, allocated, distance <= settleDistance
+
+
+def benchmark(numNodes, edgesPerNode, engine, numTicks, numAllocationTicks,
+        maxSettleTicks, settleDistance):
+    graph = buildGraph(numNodes, edgesPerNode, engine)
+    result = {'nodes': numNodes, 'edges': int(numNodes * edgesPerNode)}
+
+    # The timer started by moving the nodes is never allowed to fire.
+    graph.itemMoved()
+
+    settled = False
+    ticks = 0
+    elapsed = 0.0
+    while ticks < numTicks and not settled:
+        tickTime, _, settled = tick(graph, settleDistance)
+        elapsed += tickTime
+        ticks += 1
+
+    result['ticks'] = ticks
+    result['msPerTick'] = elapsed * 1000.0 / ticks
+
+    # Allocations are measured separately as tracing slows everything down.
+    if not settled and numAllocationTicks > 0:
+        tracemalloc.start()
+        allocations = []
+        while len(allocations) < numAllocationTicks and not settled:
+            tickTime, allocated, settled = tick(graph, settleDistance)
+            elapsed += tickTime
+            allocations.append(allocated)
+        tracemalloc.stop()
+
+        result['bytesAllocatedPerTick'] = (sum(allocations) /
+                float(len(allocations)))
+        result['maxBytesAllocatedPerTick'] = max(allocations)
+        ticks = result['ticks'] + len(allocations)
+    else:
+        ticks = result['ticks']
+
+    while ticks < maxSettleTicks and not settled:
+        tickTime, _, settled = tick(graph, settleDistance)
+        elapsed += tickTime
+        ticks += 1
+
+    # Note that the settle time includes the ticks during which allocations
+    # were traced.
+    result['settled'] = settled
+    result['settleTicks'] = ticks if settled else None
+    result['settleMs'] = elapsed * 1000.0 if settled else None
+
+    if graph.timerId:
+        graph.killTimer(graph.timerId)
+        graph.timerId = 0
+
+    graph.scene().clear()
+
+    return result
+
+
+if __name__ == '__main__':
+
+    app = QApplication(sys.argv)
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Elastic Nodes Layout Benchmark")
+    parser.addHelpOption()
+
+    sizesOption = QCommandLineOption(['s', 'sizes'],
+            "A comma separated list of the numbers of nodes.", 'sizes',
+            '100,1000,10000,50000')
+    parser.addOption(sizesOption)
+    edgesOption = QCommandLineOption(['e', 'edges-per-node'],
+            "The number of random edges for each node.", 'edges', '1.5')
+    parser.addOption(edgesOption)
+    engineOption = QCommandLineOption(['l', 'engine'],
+            "The layout engine: nodes, array or auto.", 'engine', 'auto')
+    parser.addOption(engineOption)
+    ticksOption = QCommandLineOption(['t', 'ticks'],
+            "The number of timed ticks.", 'ticks', '20')
+    parser.addOption(ticksOption)
+    allocationTicksOption = QCommandLineOption(['a', 'allocation-ticks'],
+            "The number of ticks during which allocations are traced.",
+            'ticks', '2')
+    parser.addOption(allocationTicksOption)
+    settleOption = QCommandLineOption(['m', 'max-settle-ticks'],
+            "The number of ticks after which the layout is assumed not to "
+            "settle.", 'ticks', '500')
+    parser.addOption(settleOption)
+    settleDistanceOption = QCommandLineOption(['d', 'settle-distance'],
+            "The layout has settled when no node moves further than "
+            "<distance> in a tick.", 'distance', '1.0')
+    parser.addOption(settleDistanceOption)
+    seedOption = QCommandLineOption('seed', "The random number seed.", 'seed',
+            '1')
+    parser.addOption(seedOption)
+    outputOption = QCommandLineOption(['o', 'output'],
+            "Write the JSON report to <file> rather than stdout.", 'file')
+    parser.addOption(outputOption)
+    parser.process(app)
+
+    engine = parser.value(engineOption)
+    if engine not in ('nodes', 'array', 'auto'):
+        parser.showHelp(1)
+
+    edgesPerNode = float(parser.value(edgesOption))
+    random.seed(int(parser.value(seedOption)))
+
+    results = []
+    for size in parser.value(sizesOption).split(','):
+        results.append(benchmark(int(size), edgesPerNode, engine,
+                int(parser.value(ticksOption)),
+                int(parser.value(allocationTicksOption)),
+                int(parser.value(settleOption)),
+                float(parser.value(settleDistanceOption))))
+
+    report = {
+        'engine': engine,
+        'arrayEngineMinimumNodes': ForceLayout.MinimumNodes,
+        'edgesPerNode': edgesPerNode,
+        'settleDistance': float(parser.value(settleDistanceOption)),
+        'results': results,
+    }
+
+    if parser.isSet(outputOption):
+        with open(parser.value(outputOption), 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
@@ -42,19 +42,172 @@
 #############################################################################
 
 
+from array import array
+import bisect
 import math
 
-from PyQt5.QtCore import (QByteArray, QFile, QItemSelection,
-        QItemSelectionModel, QModelIndex, QPoint, QRect, QSize, Qt,
-        QTextStream)
+from PyQt5.QtCore import (QAbstractTableModel, QFile, QItemSelection,
+        QItemSelectionModel, QModelIndex, QPoint, QRect, QSize, Qt)
 from PyQt5.QtGui import (QBrush, QColor, QFontMetrics, QPainter, QPainterPath,
-        QPalette, QPen, QRegion, QStandardItemModel)
+        QPalette, QPen, QPixmap, QRegion)
 from PyQt5.QtWidgets import (QAbstractItemView, QApplication, QFileDialog,
         QMainWindow, QMenu, QRubberBand, QSplitter, QStyle, QTableView)
 
 import chart_rc
 
 
+class ChartModel(QAbstractTableModel):
+    # The labels, quantities and colours of the rows are held in separate
+    # arrays so that a whole file can be read into them at once.
+
+    ChunkSize = 1 << 20
+    SaveRows = 65536
+
+    def __init__(self, parent=None):
+        super(ChartModel, self).__init__(parent)
+
+        self.headers = ["Label", "Quantity"]
+        self.labels = []
+        self.values = array('d')
+        self.colors = []
+
+    def index(self, row, column, parent=QModelIndex()):
+        if (parent.isValid() or not 0 <= row < len(self.labels) or
+                not 0 <= column < len(self.headers)):
+            return QModelIndex()
+
+        return self.createIndex(row, column)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.labels)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.headers[section]
+
+        return super(ChartModel, self).headerData(section, orientation, role)
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if index.column() == 0:
+            if role in (Qt.DisplayRole, Qt.EditRole):
+                return self.labels[index.row()]
+
+            if role == Qt.DecorationRole:
+                color = self.colors[index.row()]
+                if color.isValid():
+                    return color
+
+        elif role in (Qt.DisplayRole, Qt.EditRole):
+            return self.values[index.row()]
+
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid():
+            return False
+
+        if index.column() == 0:
+            if role in (Qt.DisplayRole, Qt.EditRole):
+                self.labels[index.row()] = value
+            elif role == Qt.DecorationRole:
+                self.colors[index.row()] = QColor(value)
+            else:
+                return False
+
+        elif role in (Qt.DisplayRole, Qt.EditRole):
+            self.values[index.row()] = float(value)
+
+        else:
+            return False
+
+        self.dataChanged.emit(index, index, [role])
+
+        return True
+
+    def insertRows(self, row, count, parent=QModelIndex()):
+        if parent.isValid() or not 0 <= row <= len(self.labels):
+            return False
+
+        self.beginInsertRows(parent, row, row + count - 1)
+        self.labels[row:row] = [''] * count
+        self.values[row:row] = array('d', bytes(8 * count))
+        self.colors[row:row] = [QColor()] * count
+        self.endInsertRows()
+
+        return True
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        if parent.isValid() or row < 0 or row + count > len(self.labels):
+            return False
+
+        if count > 0:
+            self.beginRemoveRows(parent, row, row + count - 1)
+            del self.labels[row:row + count]
+            del self.values[row:row + count]
+            del self.colors[row:row + count]
+            self.endRemoveRows()
+
+        return True
+
+    def load(self, device):
+        # Read the file in large chunks and parse the complete lines of each
+        # one into the arrays, replacing the contents of the model at the end.
+        labels = []
+        values = array('d')
+        colors = []
+        colorNames = {}
+        pending = b''
+
+        while True:
+            chunk = device.read(self.ChunkSize)
+
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop() if chunk else b''
+
+            pieces = [line.rsplit(',', 2)
+                    for line in b'\n'.join(lines).decode('utf-8').split('\n')
+                            if line.strip()]
+
+            labels.extend([label for label, value, color in pieces])
+            values.extend([float(value) for label, value, color in pieces])
+
+            for label, value, name in pieces:
+                color = colorNames.get(name)
+                if color is None:
+                    color = colorNames[name] = QColor(name.strip())
+                colors.append(color)
+
+            if not chunk:
+                break
+
+        self.beginResetModel()
+        self.labels = labels
+        self.values = values
+        self.colors = colors
+        self.endResetModel()
+
+    def save(self, device):
+        for start in range(0, len(self.labels), self.SaveRows):
+            end = start + self.SaveRows
+            lines = ['%s,%g,%s\n' % row for row in zip(self.labels[start:end],
+                    self.values[start:end],
+                    [color.name() for color in self.colors[start:end]])]
+
+            device.write(''.join(lines).encode('utf-8'))
+
+
 class PieView(QAbstractItemView):
     def __init__(self, parent=None):
         super(PieView, self).__init__(parent)
@@ -70,22 +223,203 @@ class PieView(QAbstractItemView):
         self.origin = QPoint()
         self.rubberBand = None
 
+        # The value of every row (zero for rows that have no slice), the rows
+        # that have a slice in the order they are drawn, and the cumulative
+        # value at the end of each of those slices.
+        self.values = []
+        self.sliceRows = []
+        self.sliceEnds = []
+        self.piePixmap = None
+
+    def setRootIndex(self, index):
+        changed = (index != self.rootIndex())
+        super(PieView, self).setRootIndex(index)
+
+        if changed:
+            self.updateSlices()
+
+    def reset(self):
+        super(PieView, self).reset()
+        self.updateSlices()
+
+    def rowValue(self, row):
+        index = self.model().index(row, 1, self.rootIndex())
+        value = self.model().data(index)
+
+        if value is not None and value > 0.0:
+            return value
+
+        return 0.0
+
+    def updateSlices(self):
+        if self.model() is None:
+            self.values = []
+        else:
+            model = self.model()
+            index = model.index
+            data = model.data
+            root = self.rootIndex()
+
+            values = [data(index(row, 1, root))
+                    for row in range(model.rowCount(root))]
+            self.values = [value if value is not None and value > 0.0 else 0.0
+                    for value in values]
+
+        self.sliceRows = [row for row, value in enumerate(self.values)
+                if value > 0.0]
+        self.sliceEnds = []
+        self.updateSliceEnds(0)
+        self.updateGeometries()
+        self.viewport().update()
+
+    def updateSliceEnds(self, position):
+        # Only the slices from position onwards need their cumulative values
+        # recalculating.
+        total = self.sliceEnds[position - 1] if position > 0 else 0.0
+        ends = []
+        values = self.values
+
+        for row in self.sliceRows[position:]:
+            total += values[row]
+            ends.append(total)
+
+        self.sliceEnds[position:] = ends
+        self.totalValue = self.sliceEnds[-1] if self.sliceEnds else 0.0
+        self.validItems = len(self.sliceRows)
+        self.piePixmap = None
+
+    def slicePosition(self, row):
+        position = bisect.bisect_left(self.sliceRows, row)
+        if position < len(self.sliceRows) and self.sliceRows[position] == row:
+            return position
+
+        return -1
+
+    def sliceAngles(self, position):
+        end = self.sliceEnds[position]
+        start = self.sliceEnds[position - 1] if position > 0 else 0.0
+
+        return (360*start/self.totalValue, 360*(end - start)/self.totalValue)
+
+    def keyItemHeight(self):
+        return QFontMetrics(self.font()).height()
+
+    def keyRect(self, position):
+        itemHeight = self.keyItemHeight()
+
+        return QRect(self.totalSize, int(self.margin + position*itemHeight),
+                self.totalSize - self.margin, int(itemHeight))
+
+    def keyRange(self, rect):
+        # Return the range of legend positions that intersect a rectangle in
+        # contents widget coordinates.
+        if rect.right() < self.totalSize:
+            return range(0)
+
+        itemHeight = self.keyItemHeight()
+        first = max(0, (rect.top() - self.margin) // itemHeight)
+        last = min(self.validItems, (rect.bottom() - self.margin) // itemHeight + 1)
+
+        return range(first, last)
+
+    def pieRange(self, rect):
+        # Return the positions of the slices that might intersect a rectangle
+        # in contents widget coordinates.
+        pieRect = QRect(self.margin, self.margin, self.pieSize, self.pieSize)
+        if self.validItems == 0 or not rect.intersects(pieRect):
+            return []
+
+        rect = rect.adjusted(-1, -1, 1, 1)
+        centre = self.totalSize/2
+        if rect.contains(QPoint(int(centre), int(centre))):
+            return range(self.validItems)
+
+        # The rectangle does not contain the centre so it subtends less than
+        # half of the pie.
+        angles = [math.degrees(math.atan2(centre - y, x - centre))
+                for x, y in ((rect.left(), rect.top()),
+                             (rect.right() + 1, rect.top()),
+                             (rect.left(), rect.bottom() + 1),
+                             (rect.right() + 1, rect.bottom() + 1))]
+        deltas = [(angle - angles[0] + 180) % 360 - 180 for angle in angles]
+        low = (angles[0] + min(deltas)) % 360
+        high = low + max(deltas) - min(deltas)
+
+        first = self.anglePosition(low)
+        if high < 360:
+            return range(first, self.anglePosition(high) + 1)
+
+        return list(range(first, self.validItems)) + list(
+                range(0, self.anglePosition(high - 360) + 1))
+
+    def anglePosition(self, angle):
+        position = bisect.bisect_right(self.sliceEnds,
+                angle*self.totalValue/360)
+
+        return min(position, self.validItems - 1)
+
+    def updateContents(self, rect):
+        self.viewport().update(
+                rect.translated(-self.horizontalScrollBar().value(),
+                        -self.verticalScrollBar().value()))
+
+    def updatePie(self):
+        self.updateContents(QRect(0, 0, self.totalSize, self.totalSize))
+
+    def updateKey(self, position):
+        # Update the legend from a position downwards.
+        top = self.keyRect(position).top()
+        self.updateContents(
+                QRect(self.totalSize, top, self.totalSize,
+                        self.viewport().height() + self.verticalScrollBar().value() - top))
+
     def dataChanged(self, topLeft, bottomRight, roles):
         super(PieView, self).dataChanged(topLeft, bottomRight, roles)
 
-        self.validItems = 0
-        self.totalValue = 0.0
+        if topLeft.parent() != self.rootIndex():
+            return
 
-        for row in range(self.model().rowCount(self.rootIndex())):
+        first = topLeft.row()
+        last = bottomRight.row()
 
-            index = self.model().index(row, 1, self.rootIndex())
-            value = self.model().data(index)
+        if topLeft.column() <= 1 <= bottomRight.column():
+            values = [self.rowValue(row) for row in range(first, last + 1)]
 
-            if value is not None and value > 0.0:
-                self.totalValue += value
-                self.validItems += 1
+            if values != self.values[first:last + 1]:
+                self.values[first:last + 1] = values
 
-        self.viewport().update()
+                start = bisect.bisect_left(self.sliceRows, first)
+                end = bisect.bisect_right(self.sliceRows, last)
+                rows = [row for row in range(first, last + 1)
+                        if self.values[row] > 0.0]
+                validChanged = (rows != self.sliceRows[start:end])
+                self.sliceRows[start:end] = rows
+                self.updateSliceEnds(start)
+
+                # Every angle depends on the total so the whole pie has to be
+                # redrawn, but the legend only changes below a new or removed
+                # slice.
+                self.updatePie()
+
+                if validChanged:
+                    self.updateGeometries()
+                    self.updateKey(start)
+
+                return
+
+        # Only labels or colours have changed so just redraw the affected
+        # slices and legend entries.
+        start = bisect.bisect_left(self.sliceRows, first)
+        end = bisect.bisect_right(self.sliceRows, last)
+
+        if end > start:
+            if topLeft.column() == 0 and (not roles or Qt.DecorationRole in roles):
+                self.piePixmap = None
+
+            self.updateContents(self.keyRect(start).united(self.keyRect(end - 1)))
+
+            for position in range(start, end):
+                self.updateContents(self.sliceRect(position))
 
     def edit(self, index, trigger, event):
         if index.column() == 0:
@@ -117,37 +451,17 @@ class PieView(QAbstractItemView):
                 angle = 360 - angle
 
             # Find the relevant slice of the pie.
-            startAngle = 0.0
-
-            for row in range(self.model().rowCount(self.rootIndex())):
-
-                index = self.model().index(row, 1, self.rootIndex())
-                value = self.model().data(index)
-
-                if value > 0.0:
-                    sliceAngle = 360*value/self.totalValue
+            position = self.anglePosition(angle)
 
-                    if angle >= startAngle and angle < (startAngle + sliceAngle):
-                        return self.model().index(row, 1, self.rootIndex())
-
-                    startAngle += sliceAngle
+            return self.model().index(self.sliceRows[position], 1,
+                    self.rootIndex())
 
         else:
-            itemHeight = QFontMetrics(self.viewOptions().font).height()
-            listItem = int((wy - self.margin) / itemHeight)
-            validRow = 0
-
-            for row in range(self.model().rowCount(self.rootIndex())):
-
-                index = self.model().index(row, 1, self.rootIndex())
-                if self.model().data(index) > 0.0:
-
-                    if listItem == validRow:
-                        return self.model().index(row, 0, self.rootIndex())
+            listItem = int((wy - self.margin) / self.keyItemHeight())
 
-                    # Update the list index that corresponds to the next valid
-                    # row.
-                    validRow += 1
+            if 0 <= listItem < self.validItems:
+                return self.model().index(self.sliceRows[listItem], 0,
+                        self.rootIndex())
 
         return QModelIndex()
 
@@ -160,28 +474,14 @@ class PieView(QAbstractItemView):
 
         # Check whether the index's row is in the list of rows represented
         # by slices.
+        position = self.slicePosition(index.row())
+        if position < 0:
+            return QRect()
 
-        if index.column() != 1:
-            valueIndex = self.model().index(index.row(), 1, self.rootIndex())
-        else:
-            valueIndex = index
-
-        value = self.model().data(valueIndex)
-        if value is not None and value > 0.0:
-
-            listItem = 0
-            for row in range(index.row()-1, -1, -1):
-                if self.model().data(self.model().index(row, 1, self.rootIndex())) > 0.0:
-                    listItem += 1
-
-            if index.column() == 0:
-            
-                itemHeight = QFontMetrics(self.viewOptions().font).height()
-                return QRect(self.totalSize,
-                             int(self.margin + listItem*itemHeight),
-                             self.totalSize - self.margin, int(itemHeight))
-            elif index.column() == 1:
-                return self.viewport().rect()
+        if index.column() == 0:
+            return self.keyRect(position)
+        elif index.column() == 1:
+            return self.sliceRect(position)
 
         return QRect()
 
@@ -192,31 +492,30 @@ class PieView(QAbstractItemView):
         if index.column() != 1:
             return QRegion(self.itemRect(index))
 
-        if self.model().data(index) <= 0.0:
+        position = self.slicePosition(index.row())
+        if position < 0:
             return QRegion()
 
-        startAngle = 0.0
-        for row in range(self.model().rowCount(self.rootIndex())):
-
-            sliceIndex = self.model().index(row, 1, self.rootIndex())
-            value = self.model().data(sliceIndex)
+        return self.sliceRegion(position)
 
-            if value > 0.0:
-                angle = 360*value/self.totalValue
+    def slicePath(self, position):
+        startAngle, angle = self.sliceAngles(position)
 
-                if sliceIndex == index:
-                    slicePath = QPainterPath()
-                    slicePath.moveTo(self.totalSize/2, self.totalSize/2)
-                    slicePath.arcTo(self.margin, self.margin,
-                            self.margin+self.pieSize, self.margin+self.pieSize,
-                            startAngle, angle)
-                    slicePath.closeSubpath()
+        slicePath = QPainterPath()
+        slicePath.moveTo(self.totalSize/2, self.totalSize/2)
+        slicePath.arcTo(self.margin, self.margin, self.pieSize, self.pieSize,
+                startAngle, angle)
+        slicePath.closeSubpath()
 
-                    return QRegion(slicePath.toFillPolygon().toPolygon())
+        return slicePath
 
-                startAngle += angle
+    def sliceRegion(self, position):
+        return QRegion(self.slicePath(position).toFillPolygon().toPolygon())
 
-        return QRegion()
+    def sliceRect(self, position):
+        # Allow for the antialiased edges of the slice.
+        return self.slicePath(position).boundingRect().toAlignedRect().adjusted(
+                -1, -1, 1, 1)
 
     def horizontalOffset(self):
         return self.horizontalScrollBar().value()
@@ -242,8 +541,6 @@ class PieView(QAbstractItemView):
         if self.rubberBand:
             self.rubberBand.hide()
 
-        self.viewport().update()
-
     def moveCursor(self, cursorAction, modifiers):
         current = self.currentIndex()
 
@@ -265,7 +562,6 @@ class PieView(QAbstractItemView):
                 current = self.model().index(self.rows(current) - 1,
                         current.column(), self.rootIndex())
 
-        self.viewport().update()
         return current
 
     def paintEvent(self, event):
@@ -287,59 +583,108 @@ class PieView(QAbstractItemView):
         # Viewport rectangles
         pieRect = QRect(self.margin, self.margin, self.pieSize,
                 self.pieSize)
-        keyPoint = QPoint(self.totalSize - self.horizontalScrollBar().value(),
-                self.margin - self.verticalScrollBar().value())
+        contentsRect = event.rect().translated(
+                self.horizontalScrollBar().value(),
+                self.verticalScrollBar().value())
 
         if self.validItems > 0:
-            painter.save()
-            painter.translate(pieRect.x() - self.horizontalScrollBar().value(),
-                    pieRect.y() - self.verticalScrollBar().value())
-            painter.drawEllipse(0, 0, self.pieSize, self.pieSize)
-            startAngle = 0.0
-
-            for row in range(self.model().rowCount(self.rootIndex())):
-
-                index = self.model().index(row, 1, self.rootIndex())
-                value = self.model().data(index)
-
-                if value > 0.0:
-                    angle = 360*value/self.totalValue
+            if contentsRect.intersects(pieRect.adjusted(-1, -1, 1, 1)):
+                if self.piePixmap is None:
+                    self.piePixmap = self.renderPie(background, foreground)
+
+                painter.save()
+                painter.translate(pieRect.x() - self.horizontalScrollBar().value(),
+                        pieRect.y() - self.verticalScrollBar().value())
+                painter.drawPixmap(-1, -1, self.piePixmap)
+
+                # Only the current and selected slices are drawn on top of the
+                # cached pie.
+                visible = set(self.pieRange(contentsRect))
+                current = self.currentIndex()
+                highlighted = set()
+
+                for span in selections.selection():
+                    if span.parent() == self.rootIndex() and span.left() <= 1 <= span.right():
+                        highlighted.update(range(
+                                bisect.bisect_left(self.sliceRows, span.top()),
+                                bisect.bisect_right(self.sliceRows, span.bottom())))
+
+                if current.column() == 1 and current.parent() == self.rootIndex():
+                    highlighted.add(self.slicePosition(current.row()))
+
+                for position in sorted(highlighted & visible):
+                    row = self.sliceRows[position]
+                    startAngle, angle = self.sliceAngles(position)
 
                     colorIndex = self.model().index(row, 0, self.rootIndex())
                     color = self.model().data(colorIndex, Qt.DecorationRole)
 
-                    if self.currentIndex() == index:
-                        painter.setBrush(QBrush(color, Qt.Dense4Pattern))
-                    elif selections.isSelected(index):
-                        painter.setBrush(QBrush(color, Qt.Dense3Pattern))
+                    if current.row() == row and current.column() == 1:
+                        brush = QBrush(color, Qt.Dense4Pattern)
                     else:
-                        painter.setBrush(QBrush(color))
+                        brush = QBrush(color, Qt.Dense3Pattern)
+
+                    for brush in (background, brush):
+                        painter.setBrush(brush)
+                        painter.drawPie(0, 0, self.pieSize, self.pieSize,
+                                int(startAngle*16), int(angle*16))
 
-                    painter.drawPie(0, 0, self.pieSize, self.pieSize,
-                            int(startAngle*16), int(angle*16))
+                painter.restore()
 
-                    startAngle += angle
+            for position in self.keyRange(contentsRect):
+                labelIndex = self.model().index(self.sliceRows[position], 0,
+                        self.rootIndex())
 
-            painter.restore()
+                option = self.viewOptions()
+                option.rect = self.visualRect(labelIndex)
+                if selections.isSelected(labelIndex):
+                    option.state |= QStyle.State_Selected
+                if self.currentIndex() == labelIndex:
+                    option.state |= QStyle.State_HasFocus
+                self.itemDelegate().paint(painter, option, labelIndex)
+
+    def renderPie(self, background, foreground):
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(QSize(self.pieSize + 2, self.pieSize + 2) * ratio)
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(background.color())
+
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(foreground)
+        painter.translate(1, 1)
+        painter.drawEllipse(0, 0, self.pieSize, self.pieSize)
 
-            keyNumber = 0
+        # Slices that are narrower than a pixel at the edge of the pie are
+        # covered by their outline so they are drawn together as lines.  There
+        # can be no more of these than there are sixteenths of a degree.
+        radius = self.pieSize/2
+        minimumAngle = math.degrees(1/radius)
+        lines = set()
 
-            for row in range(self.model().rowCount(self.rootIndex())):
-                index = self.model().index(row, 1, self.rootIndex())
-                value = self.model().data(index)
+        for position, row in enumerate(self.sliceRows):
+            startAngle, angle = self.sliceAngles(position)
 
-                if value > 0.0:
-                    labelIndex = self.model().index(row, 0, self.rootIndex())
+            if angle < minimumAngle:
+                lines.add(int(startAngle*16))
+            else:
+                colorIndex = self.model().index(row, 0, self.rootIndex())
+                painter.setBrush(
+                        QBrush(self.model().data(colorIndex, Qt.DecorationRole)))
+                painter.drawPie(0, 0, self.pieSize, self.pieSize,
+                        int(startAngle*16), int(angle*16))
 
-                    option = self.viewOptions()
-                    option.rect = self.visualRect(labelIndex)
-                    if selections.isSelected(labelIndex):
-                        option.state |= QStyle.State_Selected
-                    if self.currentIndex() == labelIndex:
-                        option.state |= QStyle.State_HasFocus
-                    self.itemDelegate().paint(painter, option, labelIndex)
+        path = QPainterPath()
+        for line in lines:
+            theta = math.radians(line/16)
+            path.moveTo(radius, radius)
+            path.lineTo(radius*(1 + math.cos(theta)),
+                    radius*(1 - math.sin(theta)))
 
-                    keyNumber += 1
+        painter.strokePath(path, foreground)
+        painter.end()
+
+        return pixmap
 
     def resizeEvent(self, event):
         self.updateGeometries()
@@ -348,24 +693,38 @@ class PieView(QAbstractItemView):
         return self.model().rowCount(self.model().parent(index))
 
     def rowsInserted(self, parent, start, end):
-        for row in range(start, end + 1):
-            index = self.model().index(row, 1, self.rootIndex())
-            value = self.model().data(index)
-
-            if value is not None and value > 0.0:
-                self.totalValue += value
-                self.validItems += 1
+        if parent == self.rootIndex():
+            count = end - start + 1
+            values = [self.rowValue(row) for row in range(start, end + 1)]
+            self.values[start:start] = values
+
+            position = bisect.bisect_left(self.sliceRows, start)
+            self.sliceRows[position:] = [
+                    start + offset for offset, value in enumerate(values)
+                            if value > 0.0] + [
+                    row + count for row in self.sliceRows[position:]]
+            self.updateSliceEnds(position)
+
+            self.updateGeometries()
+            self.updatePie()
+            self.updateKey(position)
 
         super(PieView, self).rowsInserted(parent, start, end)
 
     def rowsAboutToBeRemoved(self, parent, start, end):
-        for row in range(start, end + 1):
-            index = self.model().index(row, 1, self.rootIndex())
-            value = self.model().data(index)
+        if parent == self.rootIndex():
+            count = end - start + 1
+            del self.values[start:end + 1]
+
+            position = bisect.bisect_left(self.sliceRows, start)
+            last = bisect.bisect_right(self.sliceRows, end)
+            self.sliceRows[position:] = [
+                    row - count for row in self.sliceRows[last:]]
+            self.updateSliceEnds(position)
 
-            if value is not None and value > 0.0:
-                self.totalValue -= value
-                self.validItems -= 1
+            self.updateGeometries()
+            self.updatePie()
+            self.updateKey(position)
 
         super(PieView, self).rowsAboutToBeRemoved(parent, start, end)
 
@@ -399,45 +758,35 @@ class PieView(QAbstractItemView):
         contentsRect = rect.translated(self.horizontalScrollBar().value(),
                 self.verticalScrollBar().value()).normalized()
 
-        rows = self.model().rowCount(self.rootIndex())
-        columns = self.model().columnCount(self.rootIndex())
-        indexes = []
-
-        for row in range(rows):
-            for column in range(columns):
-                index = self.model().index(row, column, self.rootIndex())
-                region = self.itemRegion(index)
-                if region.intersects(QRegion(contentsRect)):
-                    indexes.append(index)
-
-        if len(indexes) > 0:
-            firstRow = indexes[0].row()
-            lastRow = indexes[0].row()
-            firstColumn = indexes[0].column()
-            lastColumn = indexes[0].column()
-
-            for i in range(1, len(indexes)):
-                firstRow = min(firstRow, indexes[i].row())
-                lastRow = max(lastRow, indexes[i].row())
-                firstColumn = min(firstColumn, indexes[i].column())
-                lastColumn = max(lastColumn, indexes[i].column())
+        # Only the slices and legend entries near the rectangle need to be
+        # checked.
+        rows = [self.sliceRows[position]
+                for position in self.keyRange(contentsRect)]
+        columns = [0] * len(rows)
 
+        for position in self.pieRange(contentsRect):
+            if self.sliceRegion(position).intersects(contentsRect):
+                rows.append(self.sliceRows[position])
+                columns.append(1)
+
+        if len(rows) > 0:
             selection = QItemSelection(
-                self.model().index(firstRow, firstColumn, self.rootIndex()),
-                self.model().index(lastRow, lastColumn, self.rootIndex()))
+                self.model().index(min(rows), min(columns), self.rootIndex()),
+                self.model().index(max(rows), max(columns), self.rootIndex()))
             self.selectionModel().select(selection, command)
         else:
             noIndex = QModelIndex()
             selection = QItemSelection(noIndex, noIndex)
             self.selectionModel().select(selection, command)
 
-        self.update()
-
     def updateGeometries(self):
+        contentsHeight = max(self.totalSize,
+                self.margin + self.validItems*self.keyItemHeight())
+
         self.horizontalScrollBar().setPageStep(self.viewport().width())
         self.horizontalScrollBar().setRange(0, max(0, 2*self.totalSize - self.viewport().width()))
         self.verticalScrollBar().setPageStep(self.viewport().height())
-        self.verticalScrollBar().setRange(0, max(0, self.totalSize - self.viewport().height()))
+        self.verticalScrollBar().setRange(0, max(0, contentsHeight - self.viewport().height()))
 
     def verticalOffset(self):
         return self.verticalScrollBar().value()
@@ -453,12 +802,30 @@ class PieView(QAbstractItemView):
 
     def visualRegionForSelection(self, selection):
         region = QRegion()
+        offset = QPoint(-self.horizontalScrollBar().value(),
+                -self.verticalScrollBar().value())
 
         for span in selection:
-            for row in range(span.top(), span.bottom() + 1):
-                for col in range(span.left(), span.right() + 1):
-                    index = self.model().index(row, col, self.rootIndex())
-                    region += self.visualRect(index)
+            if span.parent() != self.rootIndex():
+                continue
+
+            # The legend entries and slices of a span are contiguous.
+            start = bisect.bisect_left(self.sliceRows, span.top())
+            end = bisect.bisect_right(self.sliceRows, span.bottom())
+            if end == start:
+                continue
+
+            if span.left() == 0:
+                region += self.keyRect(start).united(
+                        self.keyRect(end - 1)).translated(offset)
+
+            if span.right() >= 1:
+                if end - start > 16:
+                    region += QRect(0, 0, self.totalSize,
+                            self.totalSize).translated(offset)
+                else:
+                    for position in range(start, end):
+                        region += self.sliceRect(position).translated(offset)
 
         return region
 
@@ -491,9 +858,7 @@ class MainWindow(QMainWindow):
         self.resize(870, 550)
 
     def setupModel(self):
-        self.model = QStandardItemModel(8, 2, self)
-        self.model.setHeaderData(0, Qt.Horizontal, "Label")
-        self.model.setHeaderData(1, Qt.Horizontal, "Quantity")
+        self.model = ChartModel(self)
 
     def setupViews(self):
         splitter = QSplitter()
@@ -524,26 +889,7 @@ class MainWindow(QMainWindow):
             f = QFile(path)
 
             if f.open(QFile.ReadOnly | QFile.Text):
-                stream = QTextStream(f)
-
-                self.model.removeRows(0, self.model.rowCount(QModelIndex()),
-                        QModelIndex())
-
-                row = 0
-                line = stream.readLine()
-                while line:
-                    self.model.insertRows(row, 1, QModelIndex())
-
-                    pieces = line.split(',')
-                    self.model.setData(self.model.index(row, 0, QModelIndex()),
-                                pieces[0])
-                    self.model.setData(self.model.index(row, 1, QModelIndex()),
-                                float(pieces[1]))
-                    self.model.setData(self.model.index(row, 0, QModelIndex()),
-                                QColor(pieces[2]), Qt.DecorationRole)
-
-                    row += 1
-                    line = stream.readLine()
+                self.model.load(f)
 
                 f.close()
                 self.statusBar().showMessage("Loaded %s" % path, 2000)
@@ -556,24 +902,7 @@ class MainWindow(QMainWindow):
             f = QFile(fileName)
 
             if f.open(QFile.WriteOnly | QFile.Text):
-                for row in range(self.model.rowCount(QModelIndex())):
-                    pieces = []
-
-                    pieces.append(
-                            self.model.data(
-                                    self.model.index(row, 0, QModelIndex()),
-                                    Qt.DisplayRole))
-                    pieces.append(
-                            '%g' % self.model.data(
-                                    self.model.index(row, 1, QModelIndex()),
-                                    Qt.DisplayRole))
-                    pieces.append(
-                            self.model.data(
-                                    self.model.index(row, 0, QModelIndex()),
-                                    Qt.DecorationRole).name())
-
-                    f.write(b','.join([p.encode('utf-8') for p in pieces]))
-                    f.write(b'\n')
+                self.model.save(f)
 
             f.close()
             self.statusBar().showMessage("Saved %s" % fileName, 2000)
@@ -51,21 +51,29 @@ from ui_mainwindow import Ui_MainWindow
 
 
 class TreeItem(object):
-    def __init__(self, data, parent=None):
+    # Items are stored compactly as there may be millions of them.  Leaves
+    # share an empty tuple rather than each having an empty list of
+    # children, and every item remembers its own row so that finding it in
+    # its parent doesn't require a search.
+    __slots__ = ('parentItem', 'itemData', 'childItems', 'row')
+
+    def __init__(self, data, parent=None, row=0):
         self.parentItem = parent
         self.itemData = data
-        self.childItems = []
+        self.childItems = ()
+        self.row = row
 
     def child(self, row):
-        return self.childItems[row]
+        if 0 <= row < len(self.childItems):
+            return self.childItems[row]
+
+        return None
 
     def childCount(self):
         return len(self.childItems)
 
     def childNumber(self):
-        if self.parentItem != None:
-            return self.parentItem.childItems.index(self)
-        return 0
+        return self.row
 
     def columnCount(self):
         return len(self.itemData)
@@ -74,13 +82,21 @@ class TreeItem(object):
         return self.itemData[column]
 
     def insertChildren(self, position, count, columns):
+        return self.insertItems(position,
+                [TreeItem([None] * columns, self) for row in range(count)])
+
+    def insertItems(self, position, items):
         if position < 0 or position > len(self.childItems):
             return False
 
-        for row in range(count):
-            data = [None for v in range(columns)]
-            item = TreeItem(data, self)
-            self.childItems.insert(position, item)
+        for item in items:
+            item.parentItem = self
+
+        if not self.childItems:
+            self.childItems = []
+
+        self.childItems[position:position] = items
+        self.renumber(position)
 
         return True
 
@@ -88,11 +104,13 @@ class TreeItem(object):
         if position < 0 or position > len(self.itemData):
             return False
 
-        for column in range(columns):
-            self.itemData.insert(position, None)
-
-        for child in self.childItems:
-            child.insertColumns(position, columns)
+        # Walk the tree iteratively as it may be too deep to recurse.
+        empty = [None] * columns
+        items = [self]
+        while items:
+            item = items.pop()
+            item.itemData[position:position] = empty
+            items.extend(item.childItems)
 
         return True
 
@@ -103,8 +121,9 @@ class TreeItem(object):
         if position < 0 or position + count > len(self.childItems):
             return False
 
-        for row in range(count):
-            self.childItems.pop(position)
+        if count > 0:
+            del self.childItems[position:position + count]
+            self.renumber(position)
 
         return True
 
@@ -112,14 +131,20 @@ class TreeItem(object):
         if position < 0 or position + columns > len(self.itemData):
             return False
 
-        for column in range(columns):
-            self.itemData.pop(position)
-
-        for child in self.childItems:
-            child.removeColumns(position, columns)
+        items = [self]
+        while items:
+            item = items.pop()
+            del item.itemData[position:position + columns]
+            items.extend(item.childItems)
 
         return True
 
+    def renumber(self, position):
+        # Update the stored rows of the children from the given position.
+        childItems = self.childItems
+        for row in range(position, len(childItems)):
+            childItems[row].row = row
+
     def setData(self, column, value):
         if column < 0 or column >= len(self.itemData):
             return False
@@ -135,7 +160,25 @@ class TreeModel(QAbstractItemModel):
 
         rootData = [header for header in headers]
         self.rootItem = TreeItem(rootData)
-        self.setupModelData(data.split("\n"), self.rootItem)
+        self.setupModelData(self.decode(data).split("\n"), self.rootItem)
+
+    def appendModelData(self, data, parent=QModelIndex()):
+        # Append the items of some indented text to the children of an item
+        # reporting them to the views as a single insertion.
+        holder = TreeItem([])
+        self.setupModelData(self.decode(data).split("\n"), holder)
+        if not holder.childItems:
+            return False
+
+        parentItem = self.getItem(parent)
+        position = parentItem.childCount()
+
+        self.beginInsertRows(parent, position,
+                position + holder.childCount() - 1)
+        parentItem.insertItems(position, holder.childItems)
+        self.endInsertRows()
+
+        return True
 
     def columnCount(self, parent=QModelIndex()):
         return self.rootItem.columnCount()
@@ -150,9 +193,16 @@ class TreeModel(QAbstractItemModel):
         item = self.getItem(index)
         return item.data(index.column())
 
+    @staticmethod
+    def decode(data):
+        if isinstance(data, str):
+            return data
+
+        return bytes(data).decode('utf-8', 'replace')
+
     def flags(self, index):
         if not index.isValid():
-            return 0
+            return Qt.NoItemFlags
 
         return Qt.ItemIsEditable | super(TreeModel, self).flags(index)
 
@@ -188,6 +238,26 @@ class TreeModel(QAbstractItemModel):
 
         return success
 
+    def insertRowData(self, position, rows, parent=QModelIndex()):
+        # Insert a batch of rows, each given as a sequence of column values,
+        # reporting them to the views as a single insertion.
+        parentItem = self.getItem(parent)
+        if position < 0 or position > parentItem.childCount() or not rows:
+            return False
+
+        columns = self.rootItem.columnCount()
+        items = []
+        for values in rows:
+            data = list(values[:columns])
+            data.extend([None] * (columns - len(data)))
+            items.append(TreeItem(data))
+
+        self.beginInsertRows(parent, position, position + len(items) - 1)
+        parentItem.insertItems(position, items)
+        self.endInsertRows()
+
+        return True
+
     def insertRows(self, position, rows, parent=QModelIndex()):
         parentItem = self.getItem(parent)
         self.beginInsertRows(parent, position, position + rows - 1)
@@ -204,7 +274,7 @@ class TreeModel(QAbstractItemModel):
         childItem = self.getItem(index)
         parentItem = childItem.parent()
 
-        if parentItem == self.rootItem:
+        if parentItem is self.rootItem:
             return QModelIndex()
 
         return self.createIndex(parentItem.childNumber(), 0, parentItem)
@@ -219,6 +289,49 @@ class TreeModel(QAbstractItemModel):
 
         return success
 
+    def removeRowList(self, rows, parent=QModelIndex()):
+        # Remove any rows of an item.  Rather than reporting each run of
+        # consecutive rows as a separate removal, which would have the views
+        # lay themselves out again for each run, the whole batch is reported
+        # as a single change to the layout.
+        parentItem = self.getItem(parent)
+        rows = sorted(set(rows))
+        if not rows or rows[0] < 0 or rows[-1] >= parentItem.childCount():
+            return False
+
+        if rows[-1] - rows[0] + 1 == len(rows):
+            return self.removeRows(rows[0], len(rows), parent)
+
+        self.layoutAboutToBeChanged.emit()
+
+        childItems = parentItem.childItems
+        for row in rows:
+            childItems[row].row = -1
+
+        parentItem.childItems = [item for item in childItems if item.row >= 0]
+        parentItem.renumber(0)
+
+        # Indexes of the removed items and their descendants become invalid
+        # and the others move to the new rows of their items.
+        fromIndexes = self.persistentIndexList()
+        toIndexes = []
+        for index in fromIndexes:
+            item = ancestor = index.internalPointer()
+            while ancestor is not None and ancestor.row >= 0:
+                ancestor = ancestor.parentItem
+
+            if ancestor is None:
+                toIndexes.append(
+                        self.createIndex(item.row, index.column(), item))
+            else:
+                toIndexes.append(QModelIndex())
+
+        self.changePersistentIndexList(fromIndexes, toIndexes)
+
+        self.layoutChanged.emit()
+
+        return True
+
     def removeRows(self, position, rows, parent=QModelIndex()):
         parentItem = self.getItem(parent)
 
@@ -229,6 +342,9 @@ class TreeModel(QAbstractItemModel):
         return success
 
     def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() and parent.column() != 0:
+            return 0
+
         parentItem = self.getItem(parent)
 
         return parentItem.childCount()
@@ -256,56 +372,56 @@ class TreeModel(QAbstractItemModel):
         return result
 
     def setupModelData(self, lines, parent):
+        # The items are created directly rather than through
+        # insertChildren() and setData() so that large files load quickly.
         parents = [parent]
         indentations = [0]
+        siblings = parent.childItems = list(parent.childItems)
+        columns = self.rootItem.columnCount()
 
-        number = 0
-
-        while number < len(lines):
-            position = 0
-            while position < len(lines[number]):
-                if lines[number][position] != " ":
-                    break
-                position += 1
-
-            lineData = lines[number][position:].trimmed()
+        for line in lines:
+            lineData = line.lstrip(" ")
+            position = len(line) - len(lineData)
+            lineData = lineData.strip()
 
             if lineData:
                 # Read the column data from the rest of the line.
-                columnData = [s for s in lineData.split('\t') if s]
+                columnData = [s for s in lineData.split('\t') if s][:columns]
+                columnData.extend([None] * (columns - len(columnData)))
 
                 if position > indentations[-1]:
                     # The last child of the current parent is now the new
                     # parent unless the current parent has no children.
 
-                    if parents[-1].childCount() > 0:
-                        parents.append(parents[-1].child(parents[-1].childCount() - 1))
+                    if siblings:
+                        parents.append(siblings[-1])
                         indentations.append(position)
+                        siblings[-1].childItems = []
+                        siblings = siblings[-1].childItems
 
                 else:
                     while position < indentations[-1] and len(parents) > 0:
                         parents.pop()
                         indentations.pop()
+                        siblings = parents[-1].childItems
 
                 # Append a new item to the current parent's list of children.
-                parent = parents[-1]
-                parent.insertChildren(parent.childCount(), 1,
-                        self.rootItem.columnCount())
-                for column in range(len(columnData)):
-                    parent.child(parent.childCount() -1).setData(column, columnData[column])
+                siblings.append(TreeItem(columnData, parents[-1],
+                        len(siblings)))
 
-            number += 1
+        if not parent.childItems:
+            parent.childItems = ()
 
 
 class MainWindow(QMainWindow, Ui_MainWindow):
-    def __init__(self, parent=None):
+    def __init__(self, fileName=':/default.txt', parent=None):
         super(MainWindow, self).__init__(parent)
 
         self.setupUi(self)
 
         headers = ("Title", "Description")
 
-        file = QFile(':/default.txt')
+        file = QFile(fileName)
         file.open(QIODevice.ReadOnly)
         model = TreeModel(headers, file.readAll())
         file.close()
@@ -417,6 +533,7 @@ if __name__ == '__main__':
     import sys
 
     app = QApplication(sys.argv)
-    window = MainWindow()
+    # An indented text file to display may be given on the command line.
+    window = MainWindow(*sys.argv[1:2])
     window.show()
     sys.exit(app.exec_())
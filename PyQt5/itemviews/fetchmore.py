@@ -43,14 +43,113 @@
 #############################################################################
 
 
-from PyQt5.QtCore import (pyqtSignal, QAbstractListModel, QDir, QLibraryInfo,
-        QModelIndex, Qt)
+import os
+import time
+
+from PyQt5.QtCore import (pyqtSignal, QAbstractListModel, QElapsedTimer,
+        QLibraryInfo, QModelIndex, QMutex, QMutexLocker, Qt, QThread,
+        QWaitCondition)
 from PyQt5.QtWidgets import (QApplication, QGridLayout, QLabel, QLineEdit,
         QListView, QSizePolicy, QTextBrowser, QWidget)
 
 
+class DirectoryScanner(QThread):
+    """Reads the entries of a directory and reports them in batches.  A new
+    scan abandons any scan that is in progress.
+    """
+
+    BatchSize = 1000
+    BatchInterval = 0.1
+
+    entriesFound = pyqtSignal(int, list)
+    scanFinished = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super(DirectoryScanner, self).__init__(parent)
+
+        self.mutex = QMutex()
+        self.condition = QWaitCondition()
+        self.path = ''
+        self.generation = 0
+
+        self.restart = False
+        self.abort = False
+
+    def __del__(self):
+        self.mutex.lock()
+        self.abort = True
+        self.condition.wakeOne()
+        self.mutex.unlock()
+
+        self.wait()
+
+    def scan(self, path):
+        """Start scanning a directory and return the generation that
+        identifies the batches of the scan.
+        """
+
+        locker = QMutexLocker(self.mutex)
+
+        self.path = path
+        self.generation += 1
+
+        if not self.isRunning():
+            self.start(QThread.LowPriority)
+        else:
+            self.restart = True
+            self.condition.wakeOne()
+
+        return self.generation
+
+    def run(self):
+        while True:
+            self.mutex.lock()
+            path = self.path
+            generation = self.generation
+            self.restart = False
+            self.mutex.unlock()
+
+            self.scanDirectory(path, generation)
+
+            self.mutex.lock()
+            if not self.restart and not self.abort:
+                self.condition.wait(self.mutex)
+            abort = self.abort
+            self.mutex.unlock()
+
+            if abort:
+                return
+
+    def scanDirectory(self, path, generation):
+        batch = []
+        lastBatch = time.perf_counter()
+
+        try:
+            # An empty path is the current directory, as with QDir.
+            with os.scandir(path or '.') as entries:
+                for entry in entries:
+                    if self.restart or self.abort:
+                        return
+
+                    batch.append(entry.name)
+
+                    if (len(batch) >= self.BatchSize or
+                            time.perf_counter() - lastBatch >= self.BatchInterval):
+                        self.entriesFound.emit(generation, batch)
+                        batch = []
+                        lastBatch = time.perf_counter()
+        except OSError:
+            pass
+
+        if batch:
+            self.entriesFound.emit(generation, batch)
+
+        self.scanFinished.emit(generation)
+
+
 class FileListModel(QAbstractListModel):
     numberPopulated = pyqtSignal(int)
+    scanProgress = pyqtSignal(int, float, bool)
 
     def __init__(self, parent=None):
         super(FileListModel, self).__init__(parent)
@@ -58,6 +157,12 @@ class FileListModel(QAbstractListModel):
         self.fileCount = 0    
         self.fileList = []
 
+        self.generation = 0
+        self.scanTime = QElapsedTimer()
+        self.scanner = DirectoryScanner()
+        self.scanner.entriesFound.connect(self.addEntries)
+        self.scanner.scanFinished.connect(self.finishScan)
+
     def rowCount(self, parent=QModelIndex()):
         return self.fileCount
 
@@ -88,7 +193,7 @@ class FileListModel(QAbstractListModel):
         itemsToFetch = min(100, remainder)
 
         self.beginInsertRows(QModelIndex(), self.fileCount,
-                self.fileCount + itemsToFetch)
+                self.fileCount + itemsToFetch - 1)
 
         self.fileCount += itemsToFetch
 
@@ -97,20 +202,44 @@ class FileListModel(QAbstractListModel):
         self.numberPopulated.emit(itemsToFetch)
 
     def setDirPath(self, path):
-        dir = QDir(path)
-
         self.beginResetModel()
-        self.fileList = dir.entryList()
+        self.fileList = []
         self.fileCount = 0
         self.endResetModel()
 
+        self.scanTime.start()
+        self.generation = self.scanner.scan(path)
+
+    def addEntries(self, generation, entries):
+        # Ignore what is left of an abandoned scan.
+        if generation != self.generation:
+            return
+
+        waiting = self.fileCount == len(self.fileList)
+        self.fileList.extend(entries)
+
+        # The view only asks for more rows when it needs them, so give it the
+        # first rows of any that arrive after it has run out.
+        if waiting:
+            self.fetchMore(QModelIndex())
+
+        self.reportProgress(False)
+
+    def finishScan(self, generation):
+        if generation == self.generation:
+            self.reportProgress(True)
+
+    def reportProgress(self, finished):
+        elapsed = self.scanTime.elapsed()
+        rate = len(self.fileList) * 1000.0 / elapsed if elapsed else 0.0
+        self.scanProgress.emit(len(self.fileList), rate, finished)
+
 
 class Window(QWidget):
     def __init__(self, parent=None):
         super(Window, self).__init__(parent)
 
         model = FileListModel(self)
-        model.setDirPath(QLibraryInfo.location(QLibraryInfo.PrefixPath))
 
         label = QLabel("Directory")
         lineEdit = QLineEdit()
@@ -122,15 +251,21 @@ class Window(QWidget):
         self.logViewer = QTextBrowser()
         self.logViewer.setSizePolicy(QSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred))
 
+        self.scanLabel = QLabel()
+
         lineEdit.textChanged.connect(model.setDirPath)
         lineEdit.textChanged.connect(self.logViewer.clear)
         model.numberPopulated.connect(self.updateLog)
+        model.scanProgress.connect(self.updateScanLabel)
+
+        model.setDirPath(QLibraryInfo.location(QLibraryInfo.PrefixPath))
 
         layout = QGridLayout()
         layout.addWidget(label, 0, 0)
         layout.addWidget(lineEdit, 0, 1)
         layout.addWidget(view, 1, 0, 1, 2)
         layout.addWidget(self.logViewer, 2, 0, 1, 2)
+        layout.addWidget(self.scanLabel, 3, 0, 1, 2)
 
         self.setLayout(layout)
         self.setWindowTitle("Fetch More Example")
@@ -138,6 +273,10 @@ class Window(QWidget):
     def updateLog(self, number):
         self.logViewer.append("%d items added." % number)
 
+    def updateScanLabel(self, number, rate, finished):
+        self.scanLabel.setText("%s %d entries (%.0f entries/sec)" % (
+                "Found" if finished else "Scanning...", number, rate))
+
 
 if __name__ == '__main__':
 
@@ -42,9 +42,14 @@
 #############################################################################
 
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from PyQt5.QtCore import (QAbstractTableModel, QDir, QModelIndex, QRect,
         QRectF, QSize, Qt)
-from PyQt5.QtGui import QBrush, qGray, QImage, QPainter
+from PyQt5.QtGui import QBrush, QColor, qGray, QImage, QPainter, QPixmap
 from PyQt5.QtPrintSupport import QPrintDialog, QPrinter
 from PyQt5.QtWidgets import (QAbstractItemDelegate, QApplication, QDialog,
         QFileDialog, QHBoxLayout, QLabel, QMainWindow, QMessageBox, QMenu,
@@ -63,37 +68,61 @@ class PixelDelegate(QAbstractItemDelegate):
 
         self.pixelSize = 12
 
+        # The rendered discs keyed by item size, brightness, color and scale.
+        self.sprites = {}
+
     def paint(self, painter, option, index):
         if option.state & QStyle.State_Selected:
             painter.fillRect(option.rect, option.palette.highlight())
 
-        size = min(option.rect.width(), option.rect.height())
         brightness = index.model().data(index, Qt.DisplayRole)
-        radius = (size/2.0) - (brightness/255.0 * size/2.0)
-        if radius == 0.0:
+        if brightness == 255:
             return
 
-        painter.save()
-        painter.setRenderHint(QPainter.Antialiasing)
-        painter.setPen(Qt.NoPen)
-
         if option.state & QStyle.State_Selected:
-            painter.setBrush(option.palette.highlightedText())
+            color = option.palette.highlightedText().color()
         else:
-            painter.setBrush(QBrush(Qt.black))
+            color = QColor(Qt.black)
 
-        painter.drawEllipse(QRectF(
-                            option.rect.x() + option.rect.width()/2 - radius,
-                            option.rect.y() + option.rect.height()/2 - radius,
-                            2*radius, 2*radius))
+        # Render at the resolution of the device, eg. when printing.
+        scale = painter.transform().m11() * painter.device().devicePixelRatioF()
 
-        painter.restore()
+        painter.drawPixmap(option.rect,
+                self.sprite(option.rect.width(), option.rect.height(),
+                        brightness, color, scale))
+
+    def sprite(self, width, height, brightness, color, scale):
+        key = (width, height, brightness, color.rgba(), scale)
+        sprite = self.sprites.get(key)
+
+        if sprite is None:
+            size = min(width, height)
+            radius = (size/2.0) - (brightness/255.0 * size/2.0)
+
+            sprite = QPixmap(max(1, round(width * scale)),
+                    max(1, round(height * scale)))
+            sprite.fill(Qt.transparent)
+
+            painter = QPainter(sprite)
+            painter.scale(sprite.width() / float(width),
+                    sprite.height() / float(height))
+            painter.setRenderHint(QPainter.Antialiasing)
+            painter.setPen(Qt.NoPen)
+            painter.setBrush(QBrush(color))
+            painter.drawEllipse(QRectF(width/2 - radius, height/2 - radius,
+                    2*radius, 2*radius))
+            painter.end()
+
+            self.sprites[key] = sprite
+
+        return sprite
 
     def sizeHint(self, option, index):
         return QSize(self.pixelSize, self.pixelSize)
 
     def setPixelSize(self, size):
         self.pixelSize = size
+        self.sprites = {}
 
 
 class ImageModel(QAbstractTableModel):
@@ -101,12 +130,38 @@ class ImageModel(QAbstractTableModel):
         super(ImageModel, self).__init__(parent)
 
         self.modelImage = QImage()
+        self.grays = []
 
     def setImage(self, image):
         self.beginResetModel()
         self.modelImage = QImage(image)
+        self.grays = self.grayLevels(self.modelImage)
         self.endResetModel()
 
+    @staticmethod
+    def grayLevels(image):
+        # Return the gray level of each pixel as a list of rows.
+        if numpy is None:
+            return [[qGray(image.pixel(column, row))
+                    for column in range(image.width())]
+                            for row in range(image.height())]
+
+        if image.format() not in (QImage.Format_RGB32, QImage.Format_ARGB32,
+                QImage.Format_ARGB32_Premultiplied):
+            image = image.convertToFormat(QImage.Format_ARGB32)
+
+        ptr = image.constBits()
+        ptr.setsize(image.byteCount())
+        pixels = numpy.frombuffer(ptr, dtype=numpy.uint32).reshape(
+                image.height(), image.bytesPerLine() // 4)[:, :image.width()]
+
+        # This is the same calculation as qGray().
+        red = (pixels >> 16) & 0xff
+        green = (pixels >> 8) & 0xff
+        blue = pixels & 0xff
+
+        return ((red * 11 + green * 16 + blue * 5) // 32).tolist()
+
     def rowCount(self, parent):
         return self.modelImage.height()
 
@@ -117,7 +172,7 @@ class ImageModel(QAbstractTableModel):
         if not index.isValid() or role != Qt.DisplayRole:
             return None
 
-        return qGray(self.modelImage.pixel(index.column(), index.row()))
+        return self.grays[index.row()][index.column()]
 
     def headerData(self, section, orientation, role):
         if role == Qt.SizeHintRole:
@@ -253,7 +308,7 @@ class MainWindow(QMainWindow):
 
         progress = QProgressDialog("Printing...", "Cancel", 0, rows, self)
         progress.setWindowModality(Qt.ApplicationModal)
-        y = ItemSize / 2.0
+        y = ItemSize // 2
 
         for row in range(rows):
             progress.setValue(row)
@@ -261,7 +316,7 @@ class MainWindow(QMainWindow):
             if progress.wasCanceled():
                 break
 
-            x = ItemSize / 2.0
+            x = ItemSize // 2
 
             for column in range(columns):
                 option.rect = QRect(x, y, ItemSize, ItemSize)
@@ -42,7 +42,14 @@
 #############################################################################
 
 
-from PyQt5.QtCore import QAbstractItemModel, QFile, QIODevice, QModelIndex, Qt
+from array import array
+from collections import OrderedDict
+import codecs
+import os
+import re
+
+from PyQt5.QtCore import (pyqtSignal, QAbstractItemModel, QFile, QIODevice,
+        QModelIndex, Qt, QThread, QXmlStreamReader)
 from PyQt5.QtWidgets import QApplication, QFileDialog, QMainWindow, QTreeView
 from PyQt5.QtXml import QDomDocument
 
@@ -54,10 +61,25 @@ class DomItem(object):
         self.rowNumber = row
         self.parentItem = parent
         self.childItems = {}
+        self.attributeText = None
 
     def node(self):
         return self.domNode
 
+    def attributes(self):
+        if self.attributeText is None:
+            attributes = []
+            attributeMap = self.domNode.attributes()
+
+            for i in range(0, attributeMap.count()):
+                attribute = attributeMap.item(i)
+                attributes.append(attribute.nodeName() + '="' +
+                                  attribute.nodeValue() + '"')
+
+            self.attributeText = " ".join(attributes)
+
+        return self.attributeText
+
     def parent(self):
         return self.parentItem
 
@@ -98,19 +120,12 @@ class DomModel(QAbstractItemModel):
         item = index.internalPointer()
 
         node = item.node()
-        attributes = []
-        attributeMap = node.attributes()
 
         if index.column() == 0:
             return node.nodeName()
         
         elif index.column() == 1:
-            for i in range(0, attributeMap.count()):
-                attribute = attributeMap.item(i)
-                attributes.append(attribute.nodeName() + '="' +
-                                  attribute.nodeValue() + '"')
-
-            return " ".join(attributes)
+            return item.attributes()
 
         if index.column() == 2:
             value = node.nodeValue()
@@ -179,7 +194,589 @@ class DomModel(QAbstractItemModel):
         return parentItem.node().childNodes().count()
 
 
+class XmlStream(object):
+    # Reads the tokens of an XML file starting at any byte offset and reports
+    # the byte offset at which each token starts.  When reading from inside
+    # the document the data is preceded by the start tag of a wrapper element
+    # so that it can be parsed as a fragment.
+
+    ChunkSize = 1 << 16
+
+    def __init__(self, fileName, encoding):
+        self.fileName = fileName
+        self.encoding = encoding
+        self.width = len('<'.encode(encoding))
+        self.file = None
+        self.reader = None
+
+    def open(self, offset, wrapper=None):
+        self.close()
+
+        self.file = open(self.fileName, 'rb')
+        self.file.seek(offset)
+        self.decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+        self.reader = QXmlStreamReader()
+        self.reader.setNamespaceProcessing(False)
+
+        # Each chunk is [first character, first byte, text, is ASCII, is in
+        # the BMP, characters and bytes of the conversion cursor, is the
+        # wrapper].
+        self.chunks = []
+        self.chars = 0
+        self.bytes = offset
+        self.start = 0
+        self.end = 0
+        self.undeclared = False
+        self.startsDocument = False
+        self.atEnd = False
+        self.errorString = ''
+
+        if wrapper is not None:
+            self.addText('<%s>' % wrapper, synthetic=True)
+
+            # Skip the start of the document and the wrapper.
+            self.next()
+            self.next()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def addText(self, text, synthetic=False):
+        # Forget the chunks before the one holding the start of the next token.
+        chunks = self.chunks
+        while len(chunks) > 1 and chunks[1][0] < self.end:
+            del chunks[0]
+
+        ascii = synthetic or text.isascii()
+        bmp = ascii or len(text.encode('utf-16-le')) == 2 * len(text)
+        units = len(text) if bmp else len(text.encode('utf-16-le')) // 2
+
+        chunks.append([self.chars, self.bytes, text, ascii, bmp, 0, 0,
+                synthetic])
+        self.chars += units
+        self.reader.addData(text)
+
+        if not synthetic:
+            self.bytes = self.file.tell() - len(self.decoder.getstate()[0])
+
+    def next(self):
+        # Return the type of the next token, or None when there are no more
+        # tokens or the XML is not well-formed.
+        reader = self.reader
+
+        while True:
+            tokenType = reader.readNext()
+            if tokenType != QXmlStreamReader.Invalid:
+                break
+
+            if reader.error() != QXmlStreamReader.PrematureEndOfDocumentError:
+                self.errorString = reader.errorString()
+                return None
+
+            if self.atEnd:
+                return None
+
+            data = self.file.read(self.ChunkSize)
+            self.atEnd = not data
+            text = self.decoder.decode(data, self.atEnd)
+            if text:
+                self.addText(text)
+
+        self.undeclared = self.startsDocument
+        self.startsDocument = (tokenType == QXmlStreamReader.StartDocument and
+                not reader.documentVersion())
+        self.start = self.end
+        self.end = reader.characterOffset()
+
+        return tokenType
+
+    def startOffset(self):
+        # The byte offset of the start of the current token.  A token that
+        # follows text starts with the '<' read with the text, and the start
+        # of a document without a declaration is read with the first token.
+        start = self.start
+        if self.undeclared:
+            start = 0
+        elif start > 0 and self.charAt(start - 1) == '<':
+            start -= 1
+
+        return self.byteOffset(start)
+
+    def endOffset(self):
+        # The byte offset after the current token.
+        return self.byteOffset(self.end)
+
+    def chunk(self, char):
+        for chunk in reversed(self.chunks):
+            if chunk[0] <= char:
+                return chunk
+
+        return self.chunks[0]
+
+    def charAt(self, char):
+        chunk = self.chunk(char)
+        units = char - chunk[0]
+
+        if chunk[4]:
+            return chunk[2][units:units + 1]
+
+        return chunk[2].encode('utf-16-le')[2 * units:2 * units + 2].decode(
+                'utf-16-le', 'replace')
+
+    def byteOffset(self, char):
+        chunk = self.chunk(char)
+        units = char - chunk[0]
+
+        if chunk[7]:
+            return chunk[1]
+
+        if chunk[3]:
+            return chunk[1] + units * self.width
+
+        text = chunk[2]
+        if chunk[4]:
+            chars = units
+        else:
+            chars = len(text.encode('utf-16-le')[:2 * units].decode(
+                    'utf-16-le', 'ignore'))
+
+        # Offsets are usually asked for in increasing order so the encoded
+        # length is found incrementally.
+        if chars < chunk[5]:
+            chunk[5] = chunk[6] = 0
+
+        chunk[6] += len(text[chunk[5]:chars].encode(self.encoding))
+        chunk[5] = chars
+
+        return chunk[1] + chunk[6]
+
+    @staticmethod
+    def sniff(fileName):
+        # Return the encoding of a file and the length of any byte order mark.
+        with open(fileName, 'rb') as f:
+            head = f.read(1024)
+
+        if head.startswith(codecs.BOM_UTF8):
+            return 'utf-8', len(codecs.BOM_UTF8)
+
+        if head.startswith(codecs.BOM_UTF16_LE):
+            return 'utf-16-le', len(codecs.BOM_UTF16_LE)
+
+        if head.startswith(codecs.BOM_UTF16_BE):
+            return 'utf-16-be', len(codecs.BOM_UTF16_BE)
+
+        match = re.match(br'<\?xml[^>]*encoding\s*=\s*["\']([A-Za-z0-9._-]+)',
+                head)
+        if match:
+            try:
+                return codecs.lookup(match.group(1).decode('ascii')).name, 0
+            except LookupError:
+                pass
+
+        return 'utf-8', 0
+
+
+class XmlIndexer(QThread):
+    # Reads a file in one pass, checking that it is well-formed and recording
+    # the byte offsets of the start and end of every element that is big
+    # enough to be worth skipping over when its siblings are read.
+
+    SkipSize = 1 << 16
+
+    progress = pyqtSignal(int)
+    indexed = pyqtSignal(str, str, int, object)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, fileName, parent=None):
+        super(XmlIndexer, self).__init__(parent)
+
+        self.fileName = fileName
+
+    def run(self):
+        encoding, start = XmlStream.sniff(self.fileName)
+        size = max(1, os.path.getsize(self.fileName))
+        stream = XmlStream(self.fileName, encoding)
+        stream.open(start)
+
+        skips = {}
+        stack = []
+        tokens = 0
+
+        skipChars = self.SkipSize // stream.width
+        isWhitespace = stream.reader.isWhitespace
+        StartElement = QXmlStreamReader.StartElement
+        EndElement = QXmlStreamReader.EndElement
+        Characters = QXmlStreamReader.Characters
+
+        while True:
+            tokenType = stream.next()
+
+            if tokenType == EndElement:
+                offset, char, content = stack.pop()
+                if content and stream.end - char >= skipChars:
+                    skips[offset] = stream.endOffset()
+
+            elif tokenType is None:
+                break
+
+            else:
+                # Only elements that have children are recorded.
+                if stack and not stack[-1][2] and not (
+                        tokenType == Characters and isWhitespace()):
+                    stack[-1][2] = True
+
+                if tokenType == StartElement:
+                    stack.append([stream.startOffset(), stream.end, False])
+
+            tokens += 1
+            if tokens & 0xffff == 0:
+                if self.isInterruptionRequested():
+                    break
+
+                self.progress.emit(100 * stream.bytes // size)
+
+        stream.close()
+
+        if self.isInterruptionRequested():
+            return
+
+        if stream.errorString or stack:
+            self.failed.emit(self.fileName,
+                    stream.errorString or "Unexpected end of document")
+        else:
+            self.indexed.emit(self.fileName, encoding, start, skips)
+
+
+class StreamItem(object):
+    __slots__ = ('name', 'attributes', 'value', 'hasChildren')
+
+    def __init__(self, name, attributes='', value='', hasChildren=False):
+        self.name = name
+        self.attributes = attributes
+        self.value = value
+        self.hasChildren = hasChildren
+
+
+class StreamDomModel(QAbstractItemModel):
+    # A read-only model of the nodes of an XML file that is too big to load
+    # into a QDomDocument.  The children of a node are read from the file
+    # when it is expanded and only the most recently used nodes are kept.
+    # Each node is identified by a number that is used as the internal id
+    # of its indexes.
+
+    CacheSize = 4096
+    FetchSize = 256
+
+    def __init__(self, fileName, encoding, start, skips, parent=None):
+        super(StreamDomModel, self).__init__(parent)
+
+        self.fileName = fileName
+        self.encoding = encoding
+        self.skips = skips
+
+        # The offset, parent and row of each node that has been read and the
+        # children of each node that has been expanded.  Node 0 is the
+        # document.
+        self.offsets = array('q', [start])
+        self.parents = array('q', [0])
+        self.rows = array('q', [0])
+        self.children = {}
+        self.resume = {}
+
+        self.items = OrderedDict()
+        self.documentItems = {0: StreamItem('#document', hasChildren=True)}
+
+        self.stream = XmlStream(fileName, encoding)
+        self.readChildren(0, None)
+
+    def columnCount(self, parent):
+        return 3
+
+    def data(self, index, role):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+
+        item = self.item(index.internalId())
+
+        if index.column() == 0:
+            return item.name
+
+        if index.column() == 1:
+            return item.attributes
+
+        if index.column() == 2:
+            return ' '.join(item.value.split('\n'))
+
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def headerData(self, section, orientation, role):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return ("Name", "Attributes", "Value")[section]
+
+        return None
+
+    def index(self, row, column, parent):
+        if column < 0 or column >= 3:
+            return QModelIndex()
+
+        children = self.children.get(self.nodeId(parent), ())
+        if row < 0 or row >= len(children):
+            return QModelIndex()
+
+        return self.createIndex(row, column, children[row])
+
+    def parent(self, child):
+        if not child.isValid():
+            return QModelIndex()
+
+        parentId = self.parents[child.internalId()]
+        if parentId == 0:
+            return QModelIndex()
+
+        return self.createIndex(self.rows[parentId], 0, parentId)
+
+    def rowCount(self, parent):
+        if parent.column() > 0:
+            return 0
+
+        return len(self.children.get(self.nodeId(parent), ()))
+
+    def hasChildren(self, parent):
+        if parent.column() > 0:
+            return False
+
+        nodeId = self.nodeId(parent)
+        if self.children.get(nodeId):
+            return True
+
+        return self.item(nodeId).hasChildren
+
+    def canFetchMore(self, parent):
+        nodeId = self.nodeId(parent)
+        if nodeId in self.children:
+            return nodeId in self.resume
+
+        return parent.column() <= 0 and self.item(nodeId).hasChildren
+
+    def fetchMore(self, parent):
+        self.readChildren(self.nodeId(parent), self.FetchSize, parent)
+
+    @staticmethod
+    def nodeId(index):
+        return index.internalId() if index.isValid() else 0
+
+    def item(self, nodeId):
+        item = self.documentItems.get(nodeId)
+        if item is not None:
+            return item
+
+        item = self.items.get(nodeId)
+        if item is None:
+            item = self.readItem(nodeId)
+            self.cacheItem(nodeId, item)
+        else:
+            self.items.move_to_end(nodeId)
+
+        return item
+
+    def cacheItem(self, nodeId, item):
+        if self.parents[nodeId] == 0:
+            self.documentItems[nodeId] = item
+            return
+
+        self.items[nodeId] = item
+        while len(self.items) > self.CacheSize:
+            self.items.popitem(last=False)
+
+    def readItem(self, nodeId):
+        # Read a node that has been evicted from the cache.
+        offset = self.offsets[nodeId]
+        stream = self.stream
+        stream.open(offset, '_')
+
+        item = None
+        tokenType = stream.next()
+        if tokenType is not None:
+            item = self.streamItem(stream.reader)
+
+        if item is None:
+            pass
+        elif item.name == '#text':
+            # Text may be reported as several tokens.
+            while (stream.next() == QXmlStreamReader.Characters and
+                    not stream.reader.isCDATA()):
+                item.value += stream.reader.text()
+        elif tokenType == QXmlStreamReader.StartElement:
+            if offset in self.skips:
+                item.hasChildren = True
+            else:
+                tokenType = stream.next()
+                if (tokenType == QXmlStreamReader.Characters and
+                        stream.reader.isWhitespace()):
+                    tokenType = stream.next()
+
+                item.hasChildren = tokenType not in (None,
+                        QXmlStreamReader.EndElement)
+
+        stream.close()
+
+        return item or StreamItem('#error', value=stream.errorString)
+
+    def declaration(self):
+        # Show the XML declaration as the DOM does.
+        with open(self.fileName, 'rb') as f:
+            f.seek(self.offsets[0])
+            head = f.read(1024).decode(self.encoding, 'replace')
+
+        match = re.match(r'<\?xml\s(.*?)\?>', head, re.DOTALL)
+        if match is None:
+            return ''
+
+        return ' '.join(["%s='%s'" % pseudo for pseudo in re.findall(
+                r'([A-Za-z]+)\s*=\s*["\']([^"\']*)["\']', match.group(1))])
+
+    @staticmethod
+    def streamItem(reader):
+        # Return an item for the node at the reader's current token.
+        tokenType = reader.tokenType()
+
+        if tokenType == QXmlStreamReader.StartElement:
+            attributes = reader.attributes()
+            return StreamItem(reader.qualifiedName(), ' '.join(
+                    ['%s="%s"' % (attributes[i].qualifiedName(), attributes[i].value())
+                            for i in range(attributes.size())]))
+
+        if tokenType == QXmlStreamReader.Characters:
+            if reader.isWhitespace():
+                return None
+
+            if reader.isCDATA():
+                return StreamItem('#cdata-section', value=reader.text())
+
+            return StreamItem('#text', value=reader.text())
+
+        if tokenType == QXmlStreamReader.Comment:
+            return StreamItem('#comment', value=reader.text())
+
+        if tokenType == QXmlStreamReader.ProcessingInstruction:
+            return StreamItem(reader.processingInstructionTarget(),
+                    value=reader.processingInstructionData())
+
+        return None
+
+    def readChildren(self, nodeId, limit, parent=QModelIndex()):
+        # Read up to limit children of a node, continuing from where the last
+        # call left off, and add them to the model.
+        stream = self.stream
+        offset = self.resume.pop(nodeId, None)
+        wrapper = self.item(nodeId).name if nodeId else '_'
+
+        # The depth includes the wrapper when reading from inside the
+        # document.
+        depth = 1
+
+        if nodeId == 0:
+            stream.open(self.offsets[0])
+            depth = contentDepth = 0
+        elif offset is None:
+            stream.open(self.offsets[nodeId], '_')
+            contentDepth = 2
+        else:
+            stream.open(offset, wrapper)
+            contentDepth = 1
+
+        found = []
+        text = None
+
+        while True:
+            tokenType = stream.next()
+            if tokenType is None:
+                break
+
+            reader = stream.reader
+
+            if depth == contentDepth:
+                item = None
+
+                if tokenType == QXmlStreamReader.Characters and text is not None and not reader.isCDATA():
+                    text.value += reader.text()
+                    continue
+
+                if tokenType == QXmlStreamReader.StartDocument:
+                    if reader.documentVersion():
+                        item = StreamItem('xml', value=self.declaration())
+                elif tokenType != QXmlStreamReader.EndElement:
+                    item = self.streamItem(reader)
+
+                text = None
+
+                if item is not None:
+                    offset = stream.startOffset()
+
+                    if limit is not None and len(found) == limit:
+                        self.resume[nodeId] = offset
+                        break
+
+                    found.append((offset, item))
+
+                    if item.name == '#text':
+                        text = item
+
+                    if tokenType == QXmlStreamReader.StartElement:
+                        end = self.skips.get(offset)
+                        if end is not None:
+                            # Jump over a big element using the index.
+                            item.hasChildren = True
+                            stream.open(end, wrapper)
+                            depth = contentDepth = 1
+                            continue
+
+            elif depth == contentDepth + 1 and found:
+                if tokenType in (QXmlStreamReader.StartElement,
+                        QXmlStreamReader.Comment,
+                        QXmlStreamReader.ProcessingInstruction) or (
+                                tokenType == QXmlStreamReader.Characters and
+                                        not reader.isWhitespace()):
+                    found[-1][1].hasChildren = True
+
+            if tokenType == QXmlStreamReader.StartElement:
+                depth += 1
+            elif tokenType == QXmlStreamReader.EndElement:
+                depth -= 1
+                if depth < contentDepth:
+                    break
+
+        stream.close()
+
+        children = self.children.setdefault(nodeId, array('q'))
+
+        if found:
+            first = len(children)
+            self.beginInsertRows(parent, first, first + len(found) - 1)
+
+            for offset, item in found:
+                childId = len(self.offsets)
+                self.offsets.append(offset)
+                self.parents.append(nodeId)
+                self.rows.append(len(children))
+                children.append(childId)
+                self.cacheItem(childId, item)
+
+            self.endInsertRows()
+
+
 class MainWindow(QMainWindow):
+    # Files at least this big are read by a StreamDomModel.
+    StreamSize = 1 << 24
+
     def __init__(self):
         super(MainWindow, self).__init__()
 
@@ -188,6 +785,7 @@ class MainWindow(QMainWindow):
         self.fileMenu.addAction("E&xit", self.close, "Ctrl+Q")
 
         self.xmlPath = ""
+        self.indexer = None
         self.model = DomModel(QDomDocument(), self)
         self.view = QTreeView(self)
         self.view.setModel(self.model)
@@ -201,6 +799,16 @@ class MainWindow(QMainWindow):
                 "SVG files (*.svg);;User Interface files (*.ui)")
 
         if filePath:
+            self.stopIndexer()
+
+            if os.path.getsize(filePath) >= self.StreamSize:
+                self.indexer = XmlIndexer(filePath, self)
+                self.indexer.progress.connect(self.showIndexProgress)
+                self.indexer.indexed.connect(self.openStream)
+                self.indexer.failed.connect(self.showIndexError)
+                self.indexer.start()
+                return
+
             f = QFile(filePath)
             if f.open(QIODevice.ReadOnly):
                 document = QDomDocument()
@@ -212,6 +820,42 @@ class MainWindow(QMainWindow):
 
                 f.close()
 
+    def openStream(self, filePath, encoding, start, skips):
+        if self.sender() is not self.indexer:
+            return
+
+        self.indexer = None
+
+        newModel = StreamDomModel(filePath, encoding, start, skips, self)
+        self.view.setModel(newModel)
+        self.model = newModel
+        self.xmlPath = filePath
+        self.statusBar().showMessage("Indexed %s" % filePath, 2000)
+
+    def showIndexProgress(self, percent):
+        if self.sender() is not self.indexer:
+            return
+
+        self.statusBar().showMessage(
+                "Indexing %s: %d%%" % (self.indexer.fileName, percent))
+
+    def showIndexError(self, filePath, message):
+        if self.sender() is not self.indexer:
+            return
+
+        self.indexer = None
+        self.statusBar().showMessage("%s: %s" % (filePath, message))
+
+    def stopIndexer(self):
+        if self.indexer is not None:
+            self.indexer.requestInterruption()
+            self.indexer.wait()
+            self.indexer = None
+
+    def closeEvent(self, event):
+        self.stopIndexer()
+        super(MainWindow, self).closeEvent(event)
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,307 @@
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+from collections import deque
+
+from util import decode_pos
+
+
+# The value shown by cells that are part of, or depend on, a circular
+# reference.
+CYCLE = "#CYCLE"
+
+
+def parse_formula(formula):
+    """Parse the text of a cell, ie. one of "sum A1 B2", "+ A1 B2",
+    "- A1 B2", "* A1 B2", "/ A1 B2", "= A1" or any other text, into a tuple
+    of the operator and the positions it uses.  None is returned if the text
+    isn't a formula.
+    """
+
+    slist = formula.split(' ')
+    op = slist[0].lower()
+    if op not in ("sum", "+", "-", "*", "/", "="):
+        return None
+
+    first = decode_pos(slist[1]) if len(slist) > 1 else (-1, -1)
+    second = decode_pos(slist[2]) if len(slist) > 2 else (-1, -1)
+
+    return op, first, second
+
+
+def text(value):
+    """Return the text of a cell's value as shown by the view."""
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    return str(value)
+
+
+def number(value):
+    """Return the integer value of a cell or 0 if it doesn't have one."""
+
+    if isinstance(value, int):
+        return value
+
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else 0
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class FormulaEngine(object):
+    """The formulas and cached values of the cells of a spreadsheet.
+
+    Formulas are parsed once when a cell is set and the cells they refer to
+    are recorded in a dependency graph.  Setting a cell recalculates the
+    cells that depend on it, directly or indirectly, in topological order.
+
+    By default the engine also keeps the text of cells that aren't formulas.
+    Alternatively plainValue is called with a (row, column) tuple to get the
+    value of such a cell from wherever the cells are stored.
+    """
+
+    # The number of rows in each block of the index of the sum formulas.
+    RangeBlockSize = 64
+
+    def __init__(self, plainValue=None):
+        self.texts = {}
+        self.formulas = {}
+        self.values = {}
+
+        self.keepsTexts = plainValue is None
+        self.plainValue = self.texts.get if self.keepsTexts else plainValue
+
+        # The formula cells that refer to each single cell, and the sum
+        # formula cells, with their row ranges, that refer to each block of
+        # rows of each column.
+        self.dependents = {}
+        self.rangeDependents = {}
+
+    def formula(self, row, col):
+        return self.texts.get((row, col))
+
+    def value(self, row, col):
+        return self.cellValue((row, col))
+
+    def cellValue(self, cell):
+        if cell in self.formulas:
+            return self.values.get(cell)
+
+        return self.plainValue(cell)
+
+    def setFormula(self, row, col, text):
+        return self.setFormulas({(row, col): text})
+
+    def setFormulas(self, texts):
+        """Set the text of a number of cells, given as a dict keyed by
+        position, recalculate the cells affected by them and return the
+        affected cells.
+        """
+
+        dirty = []
+
+        for cell, text in texts.items():
+            if text is None:
+                text = ""
+
+            if self.keepsTexts and self.texts.get(cell, "") == text:
+                continue
+
+            self.removeFormula(cell)
+
+            formula = parse_formula(text) if text else None
+            if formula is not None:
+                self.addFormula(cell, formula)
+
+            if formula is not None or (text and self.keepsTexts):
+                self.texts[cell] = text
+            else:
+                self.texts.pop(cell, None)
+
+            dirty.append(cell)
+
+        if not dirty:
+            return set()
+
+        return self.recalculate(dirty)
+
+    def addFormula(self, cell, formula):
+        self.formulas[cell] = formula
+
+        op, first, second = formula
+        if op == "sum":
+            for block in self.rangeBlocks(first, second):
+                self.rangeDependents.setdefault(block, {})[cell] = (first[0],
+                        second[0])
+        else:
+            for precedent in (first, second):
+                self.dependents.setdefault(precedent, set()).add(cell)
+
+    def removeFormula(self, cell):
+        formula = self.formulas.pop(cell, None)
+        if formula is None:
+            return
+
+        op, first, second = formula
+        if op == "sum":
+            for block in self.rangeBlocks(first, second):
+                del self.rangeDependents[block][cell]
+        else:
+            for precedent in (first, second):
+                self.dependents[precedent].discard(cell)
+
+    def rangeBlocks(self, first, second):
+        size = self.RangeBlockSize
+        rowBlocks = range(max(first[0], 0) // size, second[0] // size + 1)
+
+        return [(col, rowBlock)
+                for col in range(max(first[1], 0), second[1] + 1)
+                        for rowBlock in rowBlocks]
+
+    def dependentsOf(self, cell):
+        row, col = cell
+
+        dependents = set(self.dependents.get(cell, ()))
+
+        block = (col, row // self.RangeBlockSize)
+        for dependent, (firstRow, lastRow) in self.rangeDependents.get(block, {}).items():
+            # A sum doesn't include the cell containing it.
+            if firstRow <= row <= lastRow and dependent != cell:
+                dependents.add(dependent)
+
+        return dependents
+
+    def recalculate(self, dirty):
+        """Recalculate the dirty cells and everything that depends on them and
+        return the cells whose values have been updated.
+        """
+
+        # Find the affected cells and the number of affected cells each one
+        # depends on.
+        affected = set(dirty)
+        edges = {}
+        pending = deque(dirty)
+
+        while pending:
+            cell = pending.popleft()
+            edges[cell] = self.dependentsOf(cell)
+
+            for dependent in edges[cell]:
+                if dependent not in affected:
+                    affected.add(dependent)
+                    pending.append(dependent)
+
+        inDegree = dict.fromkeys(affected, 0)
+        for dependents in edges.values():
+            for dependent in dependents:
+                inDegree[dependent] += 1
+
+        # Evaluate the cells in topological order.
+        ready = deque(cell for cell, degree in inDegree.items() if degree == 0)
+
+        while ready:
+            cell = ready.popleft()
+            self.evaluate(cell)
+
+            for dependent in edges[cell]:
+                inDegree[dependent] -= 1
+                if inDegree[dependent] == 0:
+                    ready.append(dependent)
+
+        # Anything left over is part of a cycle or depends on one.
+        for cell, degree in inDegree.items():
+            if degree != 0:
+                self.values[cell] = CYCLE
+
+        return affected
+
+    def evaluate(self, cell):
+        formula = self.formulas.get(cell)
+
+        # Only the values of formulas are cached.
+        if formula is None:
+            self.values.pop(cell, None)
+            return
+
+        op, (firstRow, firstCol), (secondRow, secondCol) = formula
+        cellValue = self.cellValue
+
+        if op == "sum":
+            formulas = self.formulas
+            values = self.values
+            plainValue = self.plainValue
+
+            value = 0
+            for r in range(firstRow, secondRow + 1):
+                for c in range(firstCol, secondCol + 1):
+                    precedent = (r, c)
+                    if precedent in formulas:
+                        if precedent != cell:
+                            value += number(values.get(precedent))
+                    else:
+                        value += number(plainValue(precedent))
+        elif op == "=":
+            value = cellValue((firstRow, firstCol))
+            if value is not None:
+                value = text(value)
+        else:
+            firstVal = number(cellValue((firstRow, firstCol)))
+            secondVal = number(cellValue((secondRow, secondCol)))
+
+            if op == "+":
+                value = firstVal + secondVal
+            elif op == "-":
+                value = firstVal - secondVal
+            elif op == "*":
+                value = firstVal * secondVal
+            elif secondVal == 0:
+                value = "nan"
+            else:
+                value = firstVal / secondVal
+
+        if value is None:
+            self.values.pop(cell, None)
+        else:
+            self.values[cell] = value
@@ -40,20 +40,24 @@
 #############################################################################
 
 
-from PyQt5.QtCore import QDate, QPoint, Qt
-from PyQt5.QtGui import QColor, QIcon, QKeySequence, QPainter, QPixmap
+from PyQt5.QtCore import (QCommandLineOption, QCommandLineParser, QDate,
+        QModelIndex, QPoint, Qt)
+from PyQt5.QtGui import (QBrush, QColor, QIcon, QKeySequence, QPainter,
+        QPixmap)
 from PyQt5.QtWidgets import (QAction, QActionGroup, QApplication, QColorDialog,
-        QComboBox, QDialog, QFontDialog, QGroupBox, QHBoxLayout, QLabel,
-        QLineEdit, QMainWindow, QMessageBox, QPushButton, QTableWidget,
-        QTableWidgetItem, QToolBar, QVBoxLayout)
+        QComboBox, QDialog, QFileDialog, QFontDialog, QGroupBox, QHBoxLayout,
+        QLabel, QLineEdit, QMainWindow, QMessageBox, QPushButton, QSpinBox,
+        QTableView, QTableWidget, QTableWidgetItem, QToolBar, QVBoxLayout)
 from PyQt5.QtPrintSupport import QPrinter, QPrintPreviewDialog
 
 import spreadsheet_rc
 
+from formulaengine import FormulaEngine
 from spreadsheetdelegate import SpreadSheetDelegate
 from spreadsheetitem import SpreadSheetItem
+from spreadsheetmodel import SpreadSheetModel
 from printview import PrintView
-from util import decode_pos, encode_pos
+from util import decode_pos, encode_col, encode_pos
 
 
 class SpreadSheet(QMainWindow):
@@ -62,7 +66,7 @@ class SpreadSheet(QMainWindow):
 
     currentDateFormat = dateFormats[0]
 
-    def __init__(self, rows, cols, parent = None):
+    def __init__(self, rows, cols, parent = None, model = None):
         super(SpreadSheet, self).__init__(parent)
 
         self.toolBar = QToolBar()
@@ -72,26 +76,35 @@ class SpreadSheet(QMainWindow):
         self.cellLabel.setMinimumSize(80, 0)
         self.toolBar.addWidget(self.cellLabel)
         self.toolBar.addWidget(self.formulaInput)
-        self.table = QTableWidget(rows, cols, self)
-        for c in range(cols):
-            character = chr(ord('A') + c)
-            self.table.setHorizontalHeaderItem(c, QTableWidgetItem(character))
+        if model is None:
+            # Use a table widget with an item for each cell.
+            self.table = QTableWidget(rows, cols, self)
+            self.table.formulaEngine = FormulaEngine()
+            self.table.itemChanged.connect(self.updateFormula)
+            for c in range(cols):
+                character = encode_col(c)
+                self.table.setHorizontalHeaderItem(c, QTableWidgetItem(character))
+
+            self.table.setItemPrototype(SpreadSheetItem())
+        else:
+            # Use a view of a model that stores the cells by column.
+            self.table = QTableView(self)
+            self.table.setModel(model)
 
-        self.table.setItemPrototype(self.table.item(rows - 1, cols - 1))
         self.table.setItemDelegate(SpreadSheetDelegate(self))
         self.createActions()
-        self.updateColor(0)
+        self.updateColor(QModelIndex())
         self.setupMenuBar()
-        self.setupContents()
+        if model is None:
+            self.setupContents()
         self.setupContextMenu()
         self.setCentralWidget(self.table)
         self.statusBar()
-        self.table.currentItemChanged.connect(self.updateStatus)
-        self.table.currentItemChanged.connect(self.updateColor)
-        self.table.currentItemChanged.connect(self.updateLineEdit)
-        self.table.itemChanged.connect(self.updateStatus)
+        self.table.selectionModel().currentChanged.connect(self.updateStatus)
+        self.table.selectionModel().currentChanged.connect(self.updateColor)
+        self.table.selectionModel().currentChanged.connect(self.updateLineEdit)
+        self.table.model().dataChanged.connect(self.updateCurrent)
         self.formulaInput.returnPressed.connect(self.returnPressed)
-        self.table.itemChanged.connect(self.updateLineEdit)
         self.setWindowTitle("Spreadsheet")
 
     def createActions(self):
@@ -132,6 +145,14 @@ class SpreadSheet(QMainWindow):
         self.exitAction.setShortcut(QKeySequence.Quit)
         self.exitAction.triggered.connect(QApplication.instance().quit)
 
+        self.openAction = QAction("&Open CSV...", self)
+        self.openAction.setShortcut(QKeySequence.Open)
+        self.openAction.triggered.connect(self.openCsv)
+
+        self.saveAction = QAction("&Save CSV...", self)
+        self.saveAction.setShortcut(QKeySequence.Save)
+        self.saveAction.triggered.connect(self.saveCsv)
+
         self.printAction = QAction("&Print", self)
         self.printAction.setShortcut(QKeySequence.Print)
         self.printAction.triggered.connect(self.print_)
@@ -154,6 +175,9 @@ class SpreadSheet(QMainWindow):
             if f == self.currentDateFormat:
                 action.setChecked(True)
                 
+        if isinstance(self.table.model(), SpreadSheetModel):
+            self.fileMenu.addAction(self.openAction)
+            self.fileMenu.addAction(self.saveAction)
         self.fileMenu.addAction(self.printAction)
         self.fileMenu.addAction(self.exitAction)
         self.cellMenu = self.menuBar().addMenu("&Cell")
@@ -173,22 +197,35 @@ class SpreadSheet(QMainWindow):
         action = self.sender()
         oldFormat = self.currentDateFormat
         newFormat = self.currentDateFormat = action.text()
-        for row in range(self.table.rowCount()):
-            item = self.table.item(row, 1)
-            date = QDate.fromString(item.text(), oldFormat)
-            item.setText(date.toString(newFormat))
-
-    def updateStatus(self, item):
-        if item and item == self.table.currentItem():
-            self.statusBar().showMessage(item.data(Qt.StatusTipRole), 1000)
-            self.cellLabel.setText("Cell: (%s)" % encode_pos(self.table.row(item),
-                                                                     self.table.column(item)))
-
-    def updateColor(self, item):
+        model = self.table.model()
+        for row in range(model.rowCount()):
+            index = model.index(row, 1)
+            date = QDate.fromString(index.data(Qt.EditRole) or '', oldFormat)
+            if date.isValid():
+                model.setData(index, date.toString(newFormat))
+
+    def updateCurrent(self, topLeft, bottomRight):
+        current = self.table.currentIndex()
+        if (topLeft.row() <= current.row() <= bottomRight.row() and
+                topLeft.column() <= current.column() <= bottomRight.column()):
+            self.updateStatus(current)
+            self.updateLineEdit(current)
+
+    def updateStatus(self, index):
+        if index.isValid() and index == self.table.currentIndex():
+            self.statusBar().showMessage(index.data(Qt.StatusTipRole), 1000)
+            self.cellLabel.setText("Cell: (%s)" % encode_pos(index.row(),
+                                                                     index.column()))
+
+    def updateFormula(self, item):
+        self.table.formulaEngine.setFormula(self.table.row(item),
+                self.table.column(item), item.data(Qt.EditRole))
+
+    def updateColor(self, index):
         pixmap = QPixmap(16, 16)
         color = QColor()
-        if item:
-            color = item.backgroundColor()
+        if index.isValid() and index.data(Qt.BackgroundRole) is not None:
+            color = QBrush(index.data(Qt.BackgroundRole)).color()
         if not color.isValid():
             color = self.palette().base().color()
         painter = QPainter(pixmap)
@@ -203,85 +240,80 @@ class SpreadSheet(QMainWindow):
         painter.end()
         self.colorAction.setIcon(QIcon(pixmap))
 
-    def updateLineEdit(self, item):
-        if item != self.table.currentItem():
+    def updateLineEdit(self, index):
+        if index != self.table.currentIndex():
             return
-        if item:
-            self.formulaInput.setText(item.data(Qt.EditRole))
+        if index.isValid():
+            self.formulaInput.setText(index.data(Qt.EditRole) or '')
         else:
             self.formulaInput.clear()
 
     def returnPressed(self):
         text = self.formulaInput.text()
-        row = self.table.currentRow()
-        col = self.table.currentColumn()
-        item = self.table.item(row, col)
-        if not item:
-            self.table.setItem(row, col, SpreadSheetItem(text))
-        else:
-            item.setData(Qt.EditRole, text)
+        self.table.model().setData(self.table.currentIndex(), text)
         self.table.viewport().update()
 
     def selectColor(self):
-        item = self.table.currentItem()
-        color = item and QColor(item.background()) or self.table.palette().base().color()
+        index = self.table.currentIndex()
+        background = index.data(Qt.BackgroundRole)
+        color = background is not None and QBrush(background).color() or self.table.palette().base().color()
         color = QColorDialog.getColor(color, self)
         if not color.isValid():
             return
-        selected = self.table.selectedItems()
+        selected = self.table.selectionModel().selectedIndexes()
         if not selected:
             return
         for i in selected:
-            i and i.setBackground(color)
-        self.updateColor(self.table.currentItem())
+            self.table.model().setData(i, QBrush(color), Qt.BackgroundRole)
+        self.updateColor(self.table.currentIndex())
 
     def selectFont(self):
-        selected = self.table.selectedItems()
+        selected = self.table.selectionModel().selectedIndexes()
         if not selected:
             return
         font, ok = QFontDialog.getFont(self.font(), self)
         if not ok:
             return
         for i in selected:
-            i and i.setFont(font)
+            self.table.model().setData(i, font, Qt.FontRole)
 
     def runInputDialog(self, title, c1Text, c2Text, opText,
                        outText, cell1, cell2, outCell):
-        rows = []
+        # A model may have too many rows to list them so they are entered
+        # with spin boxes.
+        rowCount = self.table.model().rowCount()
         cols = []
-        for r in range(self.table.rowCount()):
-            rows.append(str(r + 1))
-        for c in range(self.table.columnCount()):
-            cols.append(chr(ord('A') + c))
+        for c in range(self.table.model().columnCount()):
+            cols.append(encode_col(c))
         addDialog = QDialog(self)
         addDialog.setWindowTitle(title)
         group = QGroupBox(title, addDialog)
         group.setMinimumSize(250, 100)
         cell1Label = QLabel(c1Text, group)
-        cell1RowInput = QComboBox(group)
+        cell1RowInput = QSpinBox(group)
         c1Row, c1Col = decode_pos(cell1)
-        cell1RowInput.addItems(rows)
-        cell1RowInput.setCurrentIndex(c1Row)
+        cell1RowInput.setRange(1, rowCount)
+        cell1RowInput.setValue(c1Row + 1)
         cell1ColInput = QComboBox(group)
         cell1ColInput.addItems(cols)
         cell1ColInput.setCurrentIndex(c1Col)
         operatorLabel = QLabel(opText, group)
         operatorLabel.setAlignment(Qt.AlignHCenter)
         cell2Label = QLabel(c2Text, group)
-        cell2RowInput = QComboBox(group)
+        cell2RowInput = QSpinBox(group)
         c2Row, c2Col = decode_pos(cell2)
-        cell2RowInput.addItems(rows)
-        cell2RowInput.setCurrentIndex(c2Row)
+        cell2RowInput.setRange(1, rowCount)
+        cell2RowInput.setValue(c2Row + 1)
         cell2ColInput = QComboBox(group)
         cell2ColInput.addItems(cols)
         cell2ColInput.setCurrentIndex(c2Col)
         equalsLabel = QLabel("=", group)
         equalsLabel.setAlignment(Qt.AlignHCenter)
         outLabel = QLabel(outText, group)
-        outRowInput = QComboBox(group)
+        outRowInput = QSpinBox(group)
         outRow, outCol = decode_pos(outCell)
-        outRowInput.addItems(rows)
-        outRowInput.setCurrentIndex(outRow)
+        outRowInput.setRange(1, rowCount)
+        outRowInput.setValue(outRow + 1)
         outColInput = QComboBox(group)
         outColInput.addItems(cols)
         outColInput.setCurrentIndex(outCol)
@@ -329,9 +361,9 @@ class SpreadSheet(QMainWindow):
         vLayout.addStretch(1)
         vLayout.addItem(outLayout)
         if addDialog.exec_():
-            cell1 = cell1ColInput.currentText() + cell1RowInput.currentText()
-            cell2 = cell2ColInput.currentText() + cell2RowInput.currentText()
-            outCell = outColInput.currentText() + outRowInput.currentText()
+            cell1 = cell1ColInput.currentText() + str(cell1RowInput.value())
+            cell2 = cell2ColInput.currentText() + str(cell2RowInput.value())
+            outCell = outColInput.currentText() + str(outRowInput.value())
             return True, cell1, cell2, outCell
 
         return False, None, None, None
@@ -343,19 +375,19 @@ class SpreadSheet(QMainWindow):
         col_first = 0
         col_last = 0
         col_cur = 0
-        selected = self.table.selectedItems()
+        selected = self.table.selectionModel().selectedIndexes()
         if selected:
             first = selected[0]
             last = selected[-1]
-            row_first = self.table.row(first)
-            row_last = self.table.row(last)
-            col_first = self.table.column(first)
-            col_last = self.table.column(last)
+            row_first = first.row()
+            row_last = last.row()
+            col_first = first.column()
+            col_last = last.column()
 
-        current = self.table.currentItem()
-        if current:
-            row_cur = self.table.row(current)
-            col_cur = self.table.column(current)
+        current = self.table.currentIndex()
+        if current.isValid():
+            row_cur = current.row()
+            col_cur = current.column()
 
         cell1 = encode_pos(row_first, col_first)
         cell2 = encode_pos(row_last, col_last)
@@ -364,21 +396,24 @@ class SpreadSheet(QMainWindow):
                 "Last cell:", u"\N{GREEK CAPITAL LETTER SIGMA}", "Output to:",
                 cell1, cell2, out)
         if ok:
-            row, col = decode_pos(out)
-            self.table.item(row, col).setText("sum %s %s" % (cell1, cell2))
+            self.setCellText(out, "sum %s %s" % (cell1, cell2))
 
     def actionMath_helper(self, title, op):
         cell1 = "C1"
         cell2 = "C2"
         out = "C3"
-        current = self.table.currentItem()
-        if current:
-            out = encode_pos(self.table.currentRow(), self.table.currentColumn())
+        current = self.table.currentIndex()
+        if current.isValid():
+            out = encode_pos(current.row(), current.column())
         ok, cell1, cell2, out = self.runInputDialog(title, "Cell 1", "Cell 2",
                 op, "Output to:", cell1, cell2, out)
         if ok:
-            row, col = decode_pos(out)
-            self.table.item(row, col).setText("%s %s %s" % (op, cell1, cell2))
+            self.setCellText(out, "%s %s %s" % (op, cell1, cell2))
+
+    def setCellText(self, pos, text):
+        row, col = decode_pos(pos)
+        model = self.table.model()
+        model.setData(model.index(row, col), text)
 
     def actionAdd(self):
         self.actionMath_helper("Addition", "+")
@@ -393,8 +428,21 @@ class SpreadSheet(QMainWindow):
         self.actionMath_helper("Division", "/")
 
     def clear(self):
-        for i in self.table.selectedItems():
-            i.setText("")
+        for i in self.table.selectionModel().selectedIndexes():
+            if i.data(Qt.EditRole):
+                self.table.model().setData(i, "")
+
+    def openCsv(self):
+        fileName, _ = QFileDialog.getOpenFileName(self, "Open CSV", '',
+                "CSV files (*.csv);;All files (*)")
+        if fileName:
+            self.table.model().loadCsv(fileName)
+
+    def saveCsv(self):
+        fileName, _ = QFileDialog.getSaveFileName(self, "Save CSV", '',
+                "CSV files (*.csv);;All files (*)")
+        if fileName:
+            self.table.model().saveCsv(fileName)
 
     def setupContextMenu(self):
         self.addAction(self.cell_addAction)
@@ -461,7 +509,7 @@ class SpreadSheet(QMainWindow):
         self.table.item(9, 2).setBackground(Qt.lightGray)
         # column 3
         self.table.setItem(0, 3, SpreadSheetItem("Currency"))
-        self.table.item(0, 3).setBackgroundColor(titleBackground)
+        self.table.item(0, 3).setBackground(titleBackground)
         self.table.item(0, 3).setToolTip("This column shows the currency")
         self.table.item(0, 3).setFont(titleFont)
         self.table.setItem(1, 3, SpreadSheetItem("NOK"))
@@ -536,7 +584,28 @@ if __name__ == '__main__':
     import sys
 
     app = QApplication(sys.argv)
-    sheet = SpreadSheet(10, 6)
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Spreadsheet Example")
+    parser.addHelpOption()
+    parser.addPositionalArgument('file',
+            "A CSV file to load (implies --model).", "[file]")
+    modelOption = QCommandLineOption(['m', 'model'],
+            "Store the cells in a model rather than as table items.")
+    parser.addOption(modelOption)
+    rowsOption = QCommandLineOption(['r', 'rows'],
+            "The number of rows of an empty model [default: 1000].", 'rows',
+            '1000')
+    parser.addOption(rowsOption)
+    parser.process(app)
+
+    if parser.isSet(modelOption) or parser.positionalArguments():
+        model = SpreadSheetModel(int(parser.value(rowsOption)), 26)
+        if parser.positionalArguments():
+            model.loadCsv(parser.positionalArguments()[0])
+        sheet = SpreadSheet(model.rowCount(), model.columnCount(), model=model)
+    else:
+        sheet = SpreadSheet(10, 6)
     sheet.setWindowIcon(QIcon(QPixmap(":/images/interview.png")))
     sheet.resize(640, 420)
     sheet.show()
@@ -43,6 +43,9 @@ from PyQt5.QtWidgets import QCompleter, QDateTimeEdit, QItemDelegate, QLineEdit
 
 class SpreadSheetDelegate(QItemDelegate):
 
+    MaxCompletions = 1000
+    MaxCompletionRows = 10000
+
     def __init__(self, parent = None):
         super(SpreadSheetDelegate, self).__init__(parent)
 
@@ -54,14 +57,19 @@ class SpreadSheetDelegate(QItemDelegate):
             return editor
 
         editor = QLineEdit(parent)
-        # create a completer with the strings in the column as model
-        allStrings = []
-        for i in range(1, index.model().rowCount()):
-            strItem = index.model().data(index.sibling(i, index.column()), Qt.EditRole)
-            if strItem not in allStrings:
-                allStrings.append(strItem)
+        # create a completer with the strings in the column as model, only
+        # reading as far into a large column as is needed to find enough
+        model = index.model()
+        rowCount = min(model.rowCount(), self.MaxCompletionRows)
+        allStrings = {}
+        for i in range(1, rowCount):
+            strItem = model.data(index.sibling(i, index.column()), Qt.EditRole)
+            if strItem:
+                allStrings[strItem] = None
+                if len(allStrings) == self.MaxCompletions:
+                    break
 
-        autoComplete = QCompleter(allStrings)
+        autoComplete = QCompleter(list(allStrings))
         editor.setCompleter(autoComplete)
         editor.editingFinished.connect(self.commitAndCloseEditor)
         return editor
@@ -91,6 +91,12 @@ class SpreadSheetItem(QTableWidgetItem):
             self.tableWidget().viewport().update()
 
     def display(self):
+        # Use the cached value if the table has a formula engine.
+        widget = self.tableWidget()
+        engine = getattr(widget, 'formulaEngine', None)
+        if engine is not None:
+            return engine.value(widget.row(self), widget.column(self))
+
         # avoid circular dependencies
         if self.isResolving:
             return None
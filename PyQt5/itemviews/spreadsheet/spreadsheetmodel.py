@@ -0,0 +1,273 @@
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+import csv
+from array import array
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+from PyQt5.QtGui import QColor
+
+from formulaengine import FormulaEngine, parse_formula
+from util import encode_col
+
+
+class SpreadSheetColumn(object):
+    """The cells of a column.  Integers are kept in a typed array and any
+    other text in a dict.  The array is allocated in blocks of rows when a
+    cell in the block is set so that empty parts of a column take no space.
+    """
+
+    BlockSize = 4096
+
+    Empty, Integer, Text = range(3)
+
+    def __init__(self):
+        self.blocks = {}
+        self.texts = {}
+
+    def value(self, row):
+        block = self.blocks.get(row // self.BlockSize)
+        if block is None:
+            return None
+
+        kinds, integers = block
+        i = row % self.BlockSize
+        kind = kinds[i]
+
+        if kind == self.Integer:
+            return integers[i]
+
+        if kind == self.Text:
+            return self.texts[row]
+
+        return None
+
+    def text(self, row):
+        value = self.value(row)
+
+        return None if value is None else str(value)
+
+    def setText(self, row, text):
+        """Set the text of a cell and return True if it isn't empty and isn't
+        an integer.
+        """
+
+        blockIndex, i = divmod(row, self.BlockSize)
+        block = self.blocks.get(blockIndex)
+
+        if block is None:
+            if not text:
+                return False
+
+            block = self.blocks[blockIndex] = (bytearray(self.BlockSize),
+                    array('q', bytes(8 * self.BlockSize)))
+
+        kinds, integers = block
+
+        if kinds[i] == self.Text:
+            del self.texts[row]
+
+        integer = self.integer(text)
+        if integer is not None:
+            kinds[i] = self.Integer
+            integers[i] = integer
+            return False
+
+        if text:
+            kinds[i] = self.Text
+            self.texts[row] = text
+            return True
+
+        kinds[i] = self.Empty
+        if kinds.count(self.Empty) == self.BlockSize:
+            del self.blocks[blockIndex]
+
+        return False
+
+    @staticmethod
+    def integer(text):
+        # Only text that converts back to the same text is stored as an
+        # integer.
+        try:
+            integer = int(text)
+        except (TypeError, ValueError):
+            return None
+
+        if str(integer) != text or not -2 ** 63 <= integer < 2 ** 63:
+            return None
+
+        return integer
+
+
+class SpreadSheetModel(QAbstractTableModel):
+    """A model of the cells of a spreadsheet stored by column.  Formulas are
+    handled by a formula engine that reads other cells from the columns.
+    """
+
+    def __init__(self, rows, cols, parent=None):
+        super(SpreadSheetModel, self).__init__(parent)
+
+        self.rows = rows
+        self.columns = [SpreadSheetColumn() for c in range(cols)]
+        self.formats = {}
+        self.engine = FormulaEngine(self.plainValue)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.rows
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.columns)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+
+        if orientation == Qt.Horizontal:
+            return encode_col(section)
+
+        return section + 1
+
+    def flags(self, index):
+        return Qt.ItemIsSelectable | Qt.ItemIsEnabled | Qt.ItemIsEditable
+
+    def plainValue(self, cell):
+        row, col = cell
+        if row < 0 or col < 0:
+            return None
+
+        try:
+            return self.columns[col].value(row)
+        except IndexError:
+            return None
+
+    def text(self, row, col):
+        return self.columns[col].text(row)
+
+    def data(self, index, role=Qt.DisplayRole):
+        row = index.row()
+        col = index.column()
+
+        if role in (Qt.EditRole, Qt.StatusTipRole):
+            return self.text(row, col)
+
+        if role == Qt.DisplayRole:
+            return self.engine.value(row, col)
+
+        if role in (Qt.TextColorRole, Qt.TextAlignmentRole):
+            value = self.engine.value(row, col)
+            t = '' if value is None else str(value)
+
+            if role == Qt.TextColorRole:
+                if not isinstance(value, int):
+                    try:
+                        value = int(t)
+                    except ValueError:
+                        return QColor(Qt.black)
+
+                return QColor(Qt.red) if value < 0 else QColor(Qt.blue)
+
+            if t and (t[0].isdigit() or t[0] == '-'):
+                return Qt.AlignRight | Qt.AlignVCenter
+
+            return None
+
+        return self.formats.get((row, col), {}).get(role)
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid():
+            return False
+
+        if role in (Qt.EditRole, Qt.DisplayRole):
+            self.setText(index.row(), index.column(), value)
+        else:
+            self.formats.setdefault((index.row(), index.column()), {})[role] = value
+            self.dataChanged.emit(index, index, [role])
+
+        return True
+
+    def setText(self, row, col, text):
+        self.columns[col].setText(row, text)
+        affected = self.engine.setFormula(row, col, text)
+        affected.add((row, col))
+
+        # Report the cells whose values may have changed as a single block.
+        rows = [r for r, c in affected]
+        cols = [c for r, c in affected]
+        self.dataChanged.emit(self.index(min(rows), min(cols)),
+                self.index(max(rows), max(cols)))
+
+    def loadCsv(self, fileName):
+        """Replace the cells with those read a row at a time from a CSV file.
+        The formulas are then calculated together.
+        """
+
+        self.beginResetModel()
+
+        self.columns = []
+        self.formats = {}
+        self.engine = FormulaEngine(self.plainValue)
+        self.rows = 0
+        formulas = {}
+
+        with open(fileName, newline='', encoding='utf-8') as csvFile:
+            for row, fields in enumerate(csv.reader(csvFile)):
+                while len(self.columns) < len(fields):
+                    self.columns.append(SpreadSheetColumn())
+
+                for col, text in enumerate(fields):
+                    if (text and self.columns[col].setText(row, text) and
+                            parse_formula(text) is not None):
+                        formulas[row, col] = text
+
+                self.rows = row + 1
+
+        self.engine.setFormulas(formulas)
+
+        self.endResetModel()
+
+    def saveCsv(self, fileName):
+        """Write the cells to a CSV file a row at a time."""
+
+        with open(fileName, 'w', newline='', encoding='utf-8') as csvFile:
+            csv.writer(csvFile).writerows(self.rowTexts())
+
+    def rowTexts(self):
+        for row in range(self.rows):
+            yield [column.text(row) or '' for column in self.columns]
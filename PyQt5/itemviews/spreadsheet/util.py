@@ -37,15 +37,34 @@
 
 
 def decode_pos(pos):
+    # Columns are named A to Z, then AA to AZ, BA and so on.
+    letters = pos.rstrip('0123456789')
+
     try:
-        row = int(pos[1:]) - 1
-        col = ord(pos[0]) - ord('A')
+        row = int(pos[len(letters):]) - 1
     except ValueError:
-        row = -1
-        col = -1
+        return -1, -1
+
+    if not letters or not all('A' <= letter <= 'Z' for letter in letters):
+        return -1, -1
+
+    col = 0
+    for letter in letters:
+        col = col * 26 + ord(letter) - ord('A') + 1
+
+    return row, col - 1
+
+
+def encode_col(col):
+    name = ''
+    col += 1
+
+    while col > 0:
+        col, letter = divmod(col - 1, 26)
+        name = chr(letter + ord('A')) + name
 
-    return row, col
+    return name
 
 
 def encode_pos(row, col):
-    return chr(col + ord('A')) + str(row + 1)
+    return encode_col(col) + str(row + 1)
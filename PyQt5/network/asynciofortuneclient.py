@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+import asyncio
+import socket
+
+from PyQt5.QtCore import pyqtSignal, QTimer
+from PyQt5.QtGui import QIntValidator
+from PyQt5.QtWidgets import (QApplication, QComboBox, QDialog,
+        QDialogButtonBox, QGridLayout, QLabel, QLineEdit, QMessageBox,
+        QPushButton)
+from PyQt5.QtNetwork import QHostInfo, QNetworkInterface
+
+from asynciofortuneserver import AsyncioThread, readFortune
+
+
+async def fetchFortune(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        return await readFortune(reader)
+    finally:
+        writer.close()
+
+
+class Client(QDialog):
+    # These are emitted by the asyncio thread and so are queued to the GUI
+    # thread.
+    fortuneRead = pyqtSignal(str)
+    errorOccurred = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super(Client, self).__init__(parent)
+
+        self.currentFortune = ''
+
+        self.thread = AsyncioThread(self)
+        self.thread.start()
+
+        hostLabel = QLabel("&Server name:")
+        portLabel = QLabel("S&erver port:")
+
+        self.hostCombo = QComboBox()
+        self.hostCombo.setEditable(True)
+
+        name = QHostInfo.localHostName()
+        if name != '':
+            self.hostCombo.addItem(name)
+
+            domain = QHostInfo.localDomainName()
+            if domain != '':
+                self.hostCombo.addItem(name + '.' + domain)
+
+        if name != 'localhost':
+            self.hostCombo.addItem('localhost')
+
+        ipAddressesList = QNetworkInterface.allAddresses()
+
+        for ipAddress in ipAddressesList:
+            if not ipAddress.isLoopback():
+                self.hostCombo.addItem(ipAddress.toString())
+
+        for ipAddress in ipAddressesList:
+            if ipAddress.isLoopback():
+                self.hostCombo.addItem(ipAddress.toString())
+
+        self.portLineEdit = QLineEdit()
+        self.portLineEdit.setValidator(QIntValidator(1, 65535, self))
+
+        hostLabel.setBuddy(self.hostCombo)
+        portLabel.setBuddy(self.portLineEdit)
+
+        self.statusLabel = QLabel("This examples requires that you run "
+                "the Asyncio Fortune Server example as well.")
+
+        self.getFortuneButton = QPushButton("Get Fortune")
+        self.getFortuneButton.setDefault(True)
+        self.getFortuneButton.setEnabled(False)
+
+        quitButton = QPushButton("Quit")
+
+        buttonBox = QDialogButtonBox()
+        buttonBox.addButton(self.getFortuneButton, QDialogButtonBox.ActionRole)
+        buttonBox.addButton(quitButton, QDialogButtonBox.RejectRole)
+
+        self.hostCombo.editTextChanged.connect(self.enableGetFortuneButton)
+        self.portLineEdit.textChanged.connect(self.enableGetFortuneButton)
+        self.getFortuneButton.clicked.connect(self.requestNewFortune)
+        quitButton.clicked.connect(self.close)
+        self.fortuneRead.connect(self.showFortune)
+        self.errorOccurred.connect(self.displayError)
+
+        mainLayout = QGridLayout()
+        mainLayout.addWidget(hostLabel, 0, 0)
+        mainLayout.addWidget(self.hostCombo, 0, 1)
+        mainLayout.addWidget(portLabel, 1, 0)
+        mainLayout.addWidget(self.portLineEdit, 1, 1)
+        mainLayout.addWidget(self.statusLabel, 2, 0, 1, 2)
+        mainLayout.addWidget(buttonBox, 3, 0, 1, 2)
+        self.setLayout(mainLayout)
+
+        self.setWindowTitle("Asyncio Fortune Client")
+        self.portLineEdit.setFocus()
+
+    def requestNewFortune(self):
+        self.getFortuneButton.setEnabled(False)
+
+        future = self.thread.submit(fetchFortune(self.hostCombo.currentText(),
+                int(self.portLineEdit.text())))
+        future.add_done_callback(self.fortuneFetched)
+
+    def fortuneFetched(self, future):
+        # This is called in the asyncio thread.
+        try:
+            self.fortuneRead.emit(future.result())
+        except Exception as e:
+            self.errorOccurred.emit(e)
+
+    def showFortune(self, nextFortune):
+        if nextFortune == self.currentFortune:
+            QTimer.singleShot(0, self.requestNewFortune)
+            return
+
+        self.currentFortune = nextFortune
+        self.statusLabel.setText(self.currentFortune)
+        self.getFortuneButton.setEnabled(True)
+
+    def displayError(self, error):
+        if isinstance(error, asyncio.IncompleteReadError):
+            QMessageBox.information(self, "Asyncio Fortune Client",
+                    "The connection was closed before a fortune was read.")
+        elif isinstance(error, ConnectionRefusedError):
+            QMessageBox.information(self, "Asyncio Fortune Client",
+                    "The connection was refused by the peer. Make sure the "
+                    "fortune server is running, and check that the host name "
+                    "and port settings are correct.")
+        elif isinstance(error, socket.gaierror):
+            QMessageBox.information(self, "Asyncio Fortune Client",
+                    "The host was not found. Please check the host name and "
+                    "port settings.")
+        else:
+            QMessageBox.information(self, "Asyncio Fortune Client",
+                    "The following error occurred: %s." % error)
+
+        self.getFortuneButton.setEnabled(True)
+
+    def enableGetFortuneButton(self):
+        self.getFortuneButton.setEnabled(self.hostCombo.currentText() != ''
+                and self.portLineEdit.text() != '')
+
+    def done(self, result):
+        self.thread.stop()
+        super(Client, self).done(result)
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    app = QApplication(sys.argv)
+    client = Client()
+    client.show()
+    sys.exit(client.exec_())
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+import asyncio
+import random
+import socket
+import struct
+
+from PyQt5.QtCore import (QByteArray, QCommandLineOption, QCommandLineParser,
+        QDataStream, QIODevice, QThread, QTimer)
+from PyQt5.QtWidgets import (QApplication, QDialog, QHBoxLayout, QLabel,
+        QMessageBox, QPushButton, QVBoxLayout)
+from PyQt5.QtNetwork import QHostAddress, QNetworkInterface
+
+
+FORTUNES = (
+    "You've been leading a dog's life. Stay off the furniture.",
+    "You've got to think about tomorrow.",
+    "You will be surprised by a loud noise.",
+    "You will feel hungry again in another hour.",
+    "You might have mail.",
+    "You cannot kill time without injuring eternity.",
+    "Computers are not intelligent. They only think they are.")
+
+
+def encodeFortune(text):
+    # Return the block that sends a fortune, ie. its size as a quint16
+    # followed by the fortune as a QDataStream QString.
+    block = QByteArray()
+    out = QDataStream(block, QIODevice.WriteOnly)
+    out.setVersion(QDataStream.Qt_4_0)
+    out.writeUInt16(0)
+    out.writeQString(text)
+    out.device().seek(0)
+    out.writeUInt16(block.size() - 2)
+
+    return bytes(block)
+
+
+async def readFortune(reader):
+    """Read the next fortune from an asyncio stream.  An
+    asyncio.IncompleteReadError is raised if the connection is closed first.
+    """
+
+    blockSize, = struct.unpack('>H', await reader.readexactly(2))
+    block = QByteArray(await reader.readexactly(blockSize))
+
+    instr = QDataStream(block, QIODevice.ReadOnly)
+    instr.setVersion(QDataStream.Qt_4_0)
+
+    return instr.readQString()
+
+
+class AsyncioThread(QThread):
+    """Runs an asyncio event loop so that coroutines can be used alongside
+    the Qt event loop.  Coroutines are submitted from the GUI thread and the
+    asyncio thread reports back by emitting signals, which Qt queues to the
+    GUI thread.
+    """
+
+    def __init__(self, parent=None):
+        super(AsyncioThread, self).__init__(parent)
+
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+        # Cancel anything that is still running, eg. the handlers of open
+        # connections, before closing the loop.
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+
+        self.loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def submit(self, coro):
+        """Run a coroutine in the asyncio thread and return a
+        concurrent.futures.Future for its result.
+        """
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        if self.isRunning():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.wait()
+
+
+class AsyncioFortuneServer(object):
+    """Serves fortunes from an asyncio event loop, a single thread handling
+    every connection.  The keep-alive protocol is the same as that of the
+    threaded fortune server, ie. another fortune is sent for every byte the
+    client sends.
+    """
+
+    IdleTimeout = 10
+
+    # The most requests that are answered at a time.  Requests are not read
+    # again until the answers have been sent so that a client that doesn't
+    # read them can't make the server buffer without limit.
+    MaxRequests = 16
+
+    def __init__(self, keepAlive=False):
+        self.keepAlive = keepAlive
+        self.blocks = [encodeFortune(fortune) for fortune in FORTUNES]
+        self.server = None
+
+        self.activeConnections = 0
+        self.totalConnections = 0
+
+        self.thread = AsyncioThread()
+        self.thread.start()
+
+    def listen(self, port=0):
+        """Start listening on a port and return it.  An OSError is raised if
+        the server couldn't be started.
+        """
+
+        self.server = self.thread.submit(self.startServer(port)).result()
+
+        return self.server.sockets[0].getsockname()[1]
+
+    async def startServer(self, port):
+        # The backlog is as large as the system allows so that a burst of
+        # connections isn't refused.
+        return await asyncio.start_server(self.serveClient, None, port,
+                family=socket.AF_INET, backlog=socket.SOMAXCONN)
+
+    def close(self):
+        if self.server is not None:
+            self.thread.loop.call_soon_threadsafe(self.server.close)
+            self.server = None
+
+        self.thread.stop()
+
+    async def serveClient(self, reader, writer):
+        self.activeConnections += 1
+        self.totalConnections += 1
+
+        blocks = self.blocks
+
+        try:
+            writer.write(random.choice(blocks))
+
+            if self.keepAlive:
+                while True:
+                    await asyncio.wait_for(writer.drain(), self.IdleTimeout)
+
+                    requests = await asyncio.wait_for(
+                            reader.read(self.MaxRequests), self.IdleTimeout)
+                    if not requests:
+                        break
+
+                    writer.write(b''.join(random.choice(blocks)
+                            for _ in requests))
+            else:
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            self.activeConnections -= 1
+            writer.close()
+
+
+class Dialog(QDialog):
+    def __init__(self, port=0, keepAlive=False, parent=None):
+        super(Dialog, self).__init__(parent)
+
+        self.server = AsyncioFortuneServer(keepAlive)
+
+        self.statusLabel = QLabel()
+        self.statusLabel.setWordWrap(True)
+        self.connectionsLabel = QLabel()
+        quitButton = QPushButton("Quit")
+        quitButton.setAutoDefault(False)
+
+        try:
+            port = self.server.listen(port)
+        except OSError as e:
+            QMessageBox.critical(self, "Asyncio Fortune Server",
+                    "Unable to start the server: %s." % e.strerror)
+            self.close()
+            return
+
+        for ipAddress in QNetworkInterface.allAddresses():
+            if ipAddress != QHostAddress.LocalHost and ipAddress.toIPv4Address() != 0:
+                break
+        else:
+            ipAddress = QHostAddress(QHostAddress.LocalHost)
+
+        ipAddress = ipAddress.toString()
+
+        self.statusLabel.setText("The server is running on\n\nIP: %s\nport: %d\n\n"
+                "Run the Fortune Client example now." % (ipAddress, port))
+
+        # The counts are only changed by the asyncio thread and are read
+        # periodically rather than signalling every connection.
+        self.updateTimer = QTimer(self)
+        self.updateTimer.timeout.connect(self.updateConnections)
+        self.updateTimer.start(500)
+        self.updateConnections()
+
+        quitButton.clicked.connect(self.close)
+
+        buttonLayout = QHBoxLayout()
+        buttonLayout.addStretch(1)
+        buttonLayout.addWidget(quitButton)
+        buttonLayout.addStretch(1)
+
+        mainLayout = QVBoxLayout()
+        mainLayout.addWidget(self.statusLabel)
+        mainLayout.addWidget(self.connectionsLabel)
+        mainLayout.addLayout(buttonLayout)
+        self.setLayout(mainLayout)
+
+        self.setWindowTitle("Asyncio Fortune Server")
+
+    def updateConnections(self):
+        self.connectionsLabel.setText("Connections: %d open, %d in total" % (
+                self.server.activeConnections, self.server.totalConnections))
+
+    def done(self, result):
+        self.server.close()
+        super(Dialog, self).done(result)
+
+
+if __name__ == '__main__':
+
+    import sys
+
+    app = QApplication(sys.argv)
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Asyncio Fortune Server")
+    parser.addHelpOption()
+
+    portOption = QCommandLineOption(['p', 'port'],
+            "The port to listen on rather than any free port.", 'port', '0')
+    parser.addOption(portOption)
+    keepAliveOption = QCommandLineOption(['k', 'keep-alive'],
+            "Keep connections open so that a client can request more "
+            "fortunes.")
+    parser.addOption(keepAliveOption)
+    parser.process(app)
+
+    dialog = Dialog(int(parser.value(portOption)),
+            parser.isSet(keepAliveOption))
+    dialog.show()
+    sys.exit(dialog.exec_())
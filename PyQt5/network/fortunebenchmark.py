@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+
+
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+# A headless benchmark that compares the fortune servers under load.  Each
+# server is run in a separate process and an asyncio client makes many
+# connections to it at the same time, reading one or more fortunes from
+# each.  The connections per second, the latencies and the number of
+# threads and memory used by the server are written as JSON, for example:
+#
+#   python fortunebenchmark.py --connections 20000 --concurrency 10000
+#
+# The servers are fortuneserver.py (qt), threadedfortuneserver.py with a
+# thread for each connection (threaded) or a pool of threads (pool), and
+# asynciofortuneserver.py (asyncio).  Only the pool and asyncio servers
+# support more than one request for each connection.
+
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# The benchmark doesn't need a display.
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QCommandLineOption, QCommandLineParser, QThread
+from PyQt5.QtWidgets import QApplication
+
+from asynciofortuneserver import readFortune
+
+
+SERVERS = ('qt', 'threaded', 'pool', 'asyncio')
+KEEP_ALIVE_SERVERS = ('pool', 'asyncio')
+
+
+def serve(app, kind, keepAlive):
+    # Run a server in this process, having written the port it is listening
+    # on to stdout.
+    if kind == 'qt':
+        from fortuneserver import Server
+
+        server = Server()
+        port = server.tcpServer.serverPort()
+    elif kind in ('threaded', 'pool'):
+        from threadedfortuneserver import FortuneServer
+
+        numThreads = QThread.idealThreadCount() if kind == 'pool' else 0
+        server = FortuneServer(numThreads, keepAlive)
+        server.listen()
+        port = server.serverPort()
+    else:
+        from asynciofortuneserver import AsyncioFortuneServer
+
+        server = AsyncioFortuneServer(keepAlive)
+        port = server.listen()
+
+    sys.stdout.write('%d\n' % port)
+    sys.stdout.flush()
+
+    return app.exec_()
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def latencyReport(latencies):
+    # Return a summary of a list of latencies in seconds as milliseconds.
+    if not latencies:
+        return None
+
+    latencies = sorted(latencies)
+
+    return {
+        'p50': percentile(latencies, 0.5) * 1000.0,
+        'p99': percentile(latencies, 0.99) * 1000.0,
+        'max': latencies[-1] * 1000.0,
+    }
+
+
+def processStatus(pid):
+    # Return the number of threads and the resident memory in KB of a
+    # process, or None where /proc isn't available.
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            status = dict(line.split(':', 1) for line in f)
+    except (OSError, ValueError):
+        return None, None
+
+    return int(status['Threads']), int(status['VmRSS'].split()[0])
+
+
+def monitor(pid, peak, stopped):
+    # This is run in a separate thread so that it isn't delayed by the
+    # clients.
+    while not stopped.wait(0.005):
+        threads, rss = processStatus(pid)
+        if threads is None:
+            return
+
+        peak['threads'] = max(peak['threads'], threads)
+        peak['rssKB'] = max(peak['rssKB'], rss)
+
+
+async def load(port, numConnections, concurrency, numRequests, timeout,
+        pid):
+    connectLatencies = []
+    requestLatencies = []
+    counts = {'remaining': numConnections, 'errors': 0, 'timeouts': 0,
+            'fortunes': 0}
+    peak = {'threads': 0, 'rssKB': 0}
+
+    async def client():
+        while counts['remaining'] > 0:
+            counts['remaining'] -= 1
+
+            start = time.perf_counter()
+
+            try:
+                reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection('127.0.0.1', port), timeout)
+            except asyncio.TimeoutError:
+                counts['timeouts'] += 1
+                continue
+            except OSError:
+                counts['errors'] += 1
+                continue
+
+            try:
+                for i in range(numRequests):
+                    if i:
+                        start = time.perf_counter()
+                        writer.write(b'?')
+
+                    # A connection that overflowed the server's listen
+                    # backlog may appear to the client to be open but is
+                    # never accepted.
+                    await asyncio.wait_for(readFortune(reader), timeout)
+
+                    latency = time.perf_counter() - start
+                    if i:
+                        requestLatencies.append(latency)
+                    else:
+                        connectLatencies.append(latency)
+
+                    counts['fortunes'] += 1
+            except asyncio.TimeoutError:
+                counts['timeouts'] += 1
+            except (asyncio.IncompleteReadError, ConnectionError):
+                counts['errors'] += 1
+            finally:
+                writer.transport.abort()
+
+    stopped = threading.Event()
+    monitorThread = threading.Thread(target=monitor,
+            args=(pid, peak, stopped))
+    monitorThread.start()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client() for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    stopped.set()
+    monitorThread.join()
+
+    return {
+        'errors': counts['errors'],
+        'timeouts': counts['timeouts'],
+        'fortunes': counts['fortunes'],
+        'seconds': elapsed,
+        'connectionsPerSecond': numConnections / elapsed,
+        'fortunesPerSecond': counts['fortunes'] / elapsed,
+        'connectLatencyMs': latencyReport(connectLatencies),
+        'requestLatencyMs': latencyReport(requestLatencies),
+        'peakServerThreads': peak['threads'] or None,
+        'peakServerRssKB': peak['rssKB'] or None,
+    }
+
+
+def benchmark(kind, numConnections, concurrency, numRequests, timeout):
+    args = [sys.executable, os.path.abspath(__file__), '--serve', kind]
+    if numRequests > 1:
+        args.append('--keep-alive')
+
+    server = subprocess.Popen(args, stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    try:
+        port = int(server.stdout.readline())
+
+        return asyncio.run(load(port, numConnections, concurrency,
+                numRequests, timeout, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+
+    app = QApplication(sys.argv)
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Fortune Server Benchmark")
+    parser.addHelpOption()
+
+    serversOption = QCommandLineOption(['s', 'servers'],
+            "A comma separated list of the servers to benchmark from %s." %
+                    ", ".join(SERVERS),
+            'servers', ','.join(SERVERS))
+    parser.addOption(serversOption)
+    connectionsOption = QCommandLineOption(['n', 'connections'],
+            "The total number of connections.", 'connections', '20000')
+    parser.addOption(connectionsOption)
+    concurrencyOption = QCommandLineOption(['c', 'concurrency'],
+            "The number of connections open at the same time.", 'concurrency',
+            '1000')
+    parser.addOption(concurrencyOption)
+    requestsOption = QCommandLineOption(['r', 'requests'],
+            "The number of fortunes read from each connection.", 'requests',
+            '1')
+    parser.addOption(requestsOption)
+    timeoutOption = QCommandLineOption(['t', 'timeout'],
+            "The number of seconds to wait to connect or for a fortune.",
+            'timeout', '5')
+    parser.addOption(timeoutOption)
+    outputOption = QCommandLineOption(['o', 'output'],
+            "Write the JSON report to <file> rather than stdout.", 'file')
+    parser.addOption(outputOption)
+
+    # This is used to run each server in its own process.
+    serveOption = QCommandLineOption('serve', "Run a server.", 'server')
+    serveOption.setFlags(QCommandLineOption.HiddenFromHelp)
+    parser.addOption(serveOption)
+    keepAliveOption = QCommandLineOption('keep-alive',
+            "Keep connections open.")
+    keepAliveOption.setFlags(QCommandLineOption.HiddenFromHelp)
+    parser.addOption(keepAliveOption)
+    parser.process(app)
+
+    if parser.isSet(serveOption):
+        sys.exit(serve(app, parser.value(serveOption),
+                parser.isSet(keepAliveOption)))
+
+    numConnections = int(parser.value(connectionsOption))
+    concurrency = int(parser.value(concurrencyOption))
+    numRequests = int(parser.value(requestsOption))
+    timeout = float(parser.value(timeoutOption))
+
+    report = {
+        'connections': numConnections,
+        'concurrency': concurrency,
+        'requestsPerConnection': numRequests,
+        'timeout': timeout,
+        'servers': {},
+    }
+
+    for kind in parser.value(serversOption).split(','):
+        if kind not in SERVERS:
+            parser.showHelp(1)
+
+        if numRequests > 1 and kind not in KEEP_ALIVE_SERVERS:
+            report['servers'][kind] = None
+            continue
+
+        report['servers'][kind] = benchmark(kind, numConnections,
+                concurrency, numRequests, timeout)
+
+    if parser.isSet(outputOption):
+        with open(parser.value(outputOption), 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+# A headless load generator for the fortune servers.  It keeps a number of
+# connections open at the same time, each of which reads one or more
+# fortunes, and reports the connections and fortunes per second and the
+# latencies as JSON, for example:
+#
+#   python threadedfortuneserver.py --port 8000 --threads 4 --keep-alive
+#   python fortuneloadclient.py --port 8000 --requests 10
+#
+# More than one request for each connection needs a server with keep-alive.
+
+
+import json
+import struct
+import sys
+import time
+
+from PyQt5.QtCore import (QCommandLineOption, QCommandLineParser,
+        QCoreApplication, QObject)
+from PyQt5.QtNetwork import QAbstractSocket, QTcpSocket
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def latencyReport(latencies):
+    # Return a summary of a list of latencies in seconds as milliseconds.
+    if not latencies:
+        return None
+
+    return {
+        'p50': percentile(latencies, 0.5) * 1000.0,
+        'p99': percentile(latencies, 0.99) * 1000.0,
+        'max': max(latencies) * 1000.0,
+    }
+
+
+class LoadGenerator(QObject):
+    """Makes a number of connections to a fortune server, no more than a
+    given number at a time, and reads a number of fortunes from each.  The
+    first fortune is sent by the server when a client connects and each
+    further one is requested by sending a byte.
+    """
+
+    def __init__(self, host, port, numConnections, concurrency, numRequests,
+            parent=None):
+        super(LoadGenerator, self).__init__(parent)
+
+        self.host = host
+        self.port = port
+        self.numConnections = numConnections
+        self.concurrency = concurrency
+        self.numRequests = numRequests
+
+        self.started = 0
+        self.finished = 0
+        self.errors = 0
+        self.fortunes = 0
+        self.connectLatencies = []
+        self.requestLatencies = []
+
+        # The state of each open connection, ie. the data received but not
+        # yet read, the number of fortunes read and when the last one was
+        # requested.
+        self.connections = {}
+
+    def run(self):
+        self.startTime = time.perf_counter()
+
+        for i in range(min(self.concurrency, self.numConnections)):
+            self.startConnection()
+
+    def startConnection(self):
+        self.started += 1
+
+        tcpSocket = QTcpSocket(self)
+        tcpSocket.readyRead.connect(self.readFortunes)
+        tcpSocket.error.connect(self.connectionFailed)
+        self.connections[tcpSocket] = [b'', 0, time.perf_counter()]
+
+        tcpSocket.connectToHost(self.host, self.port)
+
+    def readFortunes(self):
+        tcpSocket = self.sender()
+        state = self.connections.get(tcpSocket)
+        if state is None:
+            return
+
+        data = state[0] + bytes(tcpSocket.readAll())
+
+        while len(data) >= 2:
+            blockSize = struct.unpack_from('>H', data)[0]
+            if len(data) < 2 + blockSize:
+                break
+
+            data = data[2 + blockSize:]
+
+            now = time.perf_counter()
+            if state[1] == 0:
+                self.connectLatencies.append(now - state[2])
+            else:
+                self.requestLatencies.append(now - state[2])
+
+            state[1] += 1
+            self.fortunes += 1
+
+            if state[1] == self.numRequests:
+                self.finishConnection(tcpSocket)
+                return
+
+            # Requests are made one at a time so that each latency is that of
+            # a single fortune.
+            state[2] = now
+            tcpSocket.write(b'?')
+
+        state[0] = data
+
+    def connectionFailed(self, socketError):
+        tcpSocket = self.sender()
+
+        # The server closing the connection once the last fortune has been
+        # sent isn't an error.
+        if socketError == QAbstractSocket.RemoteHostClosedError:
+            self.readFortunes()
+
+        if tcpSocket in self.connections:
+            self.errors += 1
+            self.finishConnection(tcpSocket)
+
+    def finishConnection(self, tcpSocket):
+        del self.connections[tcpSocket]
+        tcpSocket.abort()
+        tcpSocket.deleteLater()
+
+        self.finished += 1
+
+        if self.started < self.numConnections:
+            self.startConnection()
+        elif self.finished == self.numConnections:
+            self.elapsed = time.perf_counter() - self.startTime
+            QCoreApplication.instance().quit()
+
+    def report(self):
+        return {
+            'host': self.host,
+            'port': self.port,
+            'connections': self.numConnections,
+            'concurrency': self.concurrency,
+            'requestsPerConnection': self.numRequests,
+            'errors': self.errors,
+            'fortunes': self.fortunes,
+            'seconds': self.elapsed,
+            'connectionsPerSecond': self.numConnections / self.elapsed,
+            'fortunesPerSecond': self.fortunes / self.elapsed,
+            'connectLatencyMs': latencyReport(self.connectLatencies),
+            'requestLatencyMs': latencyReport(self.requestLatencies),
+        }
+
+
+if __name__ == '__main__':
+
+    app = QCoreApplication(sys.argv)
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Fortune Load Client")
+    parser.addHelpOption()
+
+    hostOption = QCommandLineOption('host', "The server's host name.", 'host',
+            'localhost')
+    parser.addOption(hostOption)
+    portOption = QCommandLineOption(['p', 'port'], "The server's port.",
+            'port')
+    parser.addOption(portOption)
+    connectionsOption = QCommandLineOption(['n', 'connections'],
+            "The total number of connections.", 'connections', '10000')
+    parser.addOption(connectionsOption)
+    concurrencyOption = QCommandLineOption(['c', 'concurrency'],
+            "The number of connections open at the same time.", 'concurrency',
+            '50')
+    parser.addOption(concurrencyOption)
+    requestsOption = QCommandLineOption(['r', 'requests'],
+            "The number of fortunes read from each connection.", 'requests',
+            '1')
+    parser.addOption(requestsOption)
+    outputOption = QCommandLineOption(['o', 'output'],
+            "Write the JSON report to <file> rather than stdout.", 'file')
+    parser.addOption(outputOption)
+    parser.process(app)
+
+    if not parser.isSet(portOption):
+        parser.showHelp(1)
+
+    generator = LoadGenerator(parser.value(hostOption),
+            int(parser.value(portOption)),
+            int(parser.value(connectionsOption)),
+            int(parser.value(concurrencyOption)),
+            int(parser.value(requestsOption)))
+    generator.run()
+    app.exec_()
+
+    report = generator.report()
+
+    if parser.isSet(outputOption):
+        with open(parser.value(outputOption), 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
@@ -45,14 +45,16 @@
 
 
 import math
+import os
+from collections import OrderedDict, deque
 
-from PyQt5.QtCore import (pyqtSignal, QBasicTimer, QObject, QPoint, QPointF,
-        QRect, QSize, QStandardPaths, Qt, QUrl)
+from PyQt5.QtCore import (pyqtSignal, QBasicTimer, QCommandLineOption,
+        QCommandLineParser, QObject, QPoint, QPointF, QRect, QRunnable, QSize,
+        QStandardPaths, Qt, QThreadPool, QUrl)
 from PyQt5.QtGui import (QColor, QDesktopServices, QImage, QPainter,
         QPainterPath, QPixmap, QRadialGradient)
 from PyQt5.QtWidgets import QAction, QApplication, QMainWindow, QWidget
-from PyQt5.QtNetwork import (QNetworkAccessManager, QNetworkDiskCache,
-        QNetworkRequest)
+from PyQt5.QtNetwork import QNetworkAccessManager, QNetworkReply, QNetworkRequest
 
 
 # how long (milliseconds) the user need to hold (after a tap on the screen)
@@ -68,6 +70,16 @@ MAX_MAGNIFIER = 229
 # tile size in pixels
 TDIM = 256
 
+# where the tiles come from
+TILE_URL = 'http://tile.openstreetmap.org/%(zoom)d/%(x)d/%(y)d.png'
+
+# number of tile requests that may be in progress at the same time
+MAX_REQUESTS = 6
+
+# maximum size of the tiles kept on disk and number of tiles kept in memory
+DISK_CACHE_SIZE = 256 * 1024 * 1024
+MEMORY_CACHE_TILES = 512
+
 
 class Point(QPoint):
     """QPoint, that is fully qualified as a dict key"""
@@ -108,18 +120,314 @@ def latitudeFromTile(ty, zoom):
     return lng
 
 
+class TileDiskCache(object):
+    """The PNG data of tiles stored as zoom/x/y.png files below a directory.
+    The least recently used tiles are removed when the total size exceeds a
+    limit.  The time a tile was last used is kept as the modification time
+    of its file so that the order survives restarts.
+    """
+
+    def __init__(self, directory, maxBytes=DISK_CACHE_SIZE):
+        self._directory = directory
+        self._maxBytes = maxBytes
+        self._numBytes = 0
+        self._entries = OrderedDict() # (zoom, x, y) to file size mapping
+
+        entries = []
+        for dirPath, _, fileNames in os.walk(directory):
+            for fileName in fileNames:
+                path = os.path.join(dirPath, fileName)
+                key = self._keyForPath(path)
+                if key is not None:
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, key, stat.st_size))
+
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._numBytes += size
+
+        self._expire()
+
+    def path(self, key):
+        return os.path.join(self._directory, '%d' % key[0], '%d' % key[1],
+                '%d.png' % key[2])
+
+    def _keyForPath(self, path):
+        parts = os.path.relpath(path, self._directory).split(os.sep)
+        if len(parts) != 3 or not parts[2].endswith('.png'):
+            return None
+
+        try:
+            return (int(parts[0]), int(parts[1]), int(parts[2][:-4]))
+        except ValueError:
+            return None
+
+    def contains(self, key):
+        return key in self._entries
+
+    def use(self, key):
+        """Mark a tile as recently used and return the name of its file or
+        None if it isn't cached.  The file itself is read by readFile().
+        """
+
+        if key not in self._entries:
+            return None
+
+        self._entries.move_to_end(key)
+
+        return self.path(key)
+
+    def insert(self, key, size):
+        """Add a tile whose file has been written by writeFile()."""
+
+        self._numBytes -= self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._numBytes += size
+        self._expire()
+
+    def remove(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._numBytes -= size
+
+    # These may be called from any thread.
+    @staticmethod
+    def readFile(path):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+
+        return data
+
+    @staticmethod
+    def writeFile(path, data):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Write to a temporary file so that a partial tile is never seen.
+            with open(path + '.part', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.part', path)
+        except (IOError, OSError):
+            return False
+
+        return True
+
+    def _expire(self):
+        while self._numBytes > self._maxBytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._numBytes -= size
+
+            try:
+                os.remove(self.path(key))
+            except OSError:
+                pass
+
+
+class TileDecoder(QRunnable):
+    """Reads (if necessary) and decodes a tile in a worker thread.  A tile that
+    has been downloaded is also written to the disk cache.
+    """
+
+    def __init__(self, loader, key, path, data=None):
+        super(TileDecoder, self).__init__()
+
+        self._loader = loader
+        self._key = key
+        self._path = path
+        self._data = data
+
+    def run(self):
+        zoom, x, y = self._key
+        img = QImage()
+        stored = 0
+
+        if self._data is None:
+            data = TileDiskCache.readFile(self._path)
+            if data is not None:
+                img.loadFromData(data)
+        elif img.loadFromData(self._data):
+            if TileDiskCache.writeFile(self._path, self._data):
+                stored = len(self._data)
+
+        # This is delivered to the loader in the GUI thread.
+        self._loader.tileDecoded.emit(zoom, x, y, img, stored)
+
+
+class TileLoader(QObject):
+    """Provides the pixmaps of tiles from a memory cache, a disk cache or the
+    tile server.  Each map asks for the tiles it needs in the order it wants
+    them and up to maxRequests tiles are downloaded at the same time using a
+    single QNetworkAccessManager.  Tiles are decoded by a pool of worker
+    threads.
+    """
+
+    tileLoaded = pyqtSignal(int, int, int)
+    tileDecoded = pyqtSignal(int, int, int, QImage, int)
+
+    def __init__(self, parent=None, urlTemplate=TILE_URL,
+            maxRequests=MAX_REQUESTS, cacheDirectory=None,
+            diskCacheSize=DISK_CACHE_SIZE, memoryCacheTiles=MEMORY_CACHE_TILES):
+        super(TileLoader, self).__init__(parent)
+
+        self.urlTemplate = urlTemplate
+        self.maxRequests = maxRequests
+        self.memoryCacheTiles = memoryCacheTiles
+
+        if cacheDirectory is None:
+            cacheDirectory = os.path.join(
+                    QStandardPaths.writableLocation(
+                            QStandardPaths.CacheLocation),
+                    'tiles')
+
+        self._diskCache = TileDiskCache(cacheDirectory, diskCacheSize)
+        self._pixmaps = OrderedDict() # (zoom, x, y) to QPixmap mapping
+        self._keepRects = {} # map to list of (zoom, QRect) mapping
+        self._queues = OrderedDict() # map to deque of (zoom, x, y) mapping
+        self._replies = {} # QNetworkReply to (zoom, x, y) mapping
+        self._loading = set()
+
+        self._decoders = QThreadPool(self)
+        self.tileDecoded.connect(self.handleTileDecoded)
+
+        self._manager = QNetworkAccessManager(self)
+        self._manager.finished.connect(self.handleNetworkData)
+
+    def pixmap(self, zoom, x, y):
+        """Return the pixmap of a tile if it is in memory or None."""
+
+        key = (zoom, x, y)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is not None:
+            self._pixmaps.move_to_end(key)
+
+        return pixmap
+
+    def request(self, owner, tiles, keepRects=()):
+        """Replace the tiles that owner is waiting for.  tiles is a sequence of
+        (zoom, x, y) tuples in the order they should be loaded.  keepRects is a
+        sequence of (zoom, QRect) tuples of the tiles that owner doesn't want
+        to be discarded from memory.
+        """
+
+        self._keepRects[owner] = list(keepRects)
+
+        queue = deque()
+        for key in tiles:
+            if key in self._pixmaps or key in self._loading:
+                continue
+
+            path = self._diskCache.use(key)
+            if path is not None:
+                self._loading.add(key)
+                self._decoders.start(TileDecoder(self, key, path))
+                continue
+
+            queue.append(key)
+
+        self._queues[owner] = queue
+        self.startRequests()
+
+    def isKept(self, key):
+        zoom, x, y = key
+        tp = QPoint(x, y)
+        for rects in self._keepRects.values():
+            for keepZoom, rect in rects:
+                if keepZoom == zoom and rect.contains(tp):
+                    return True
+
+        return False
+
+    def insert(self, key, pixmap):
+        self._pixmaps[key] = pixmap
+
+        # Discard the least recently used tiles that aren't being kept.  Only
+        # the tiles that have to be discarded and the (few) kept tiles older
+        # than them are looked at.
+        excess = len(self._pixmaps) - self.memoryCacheTiles
+        if excess > 0:
+            discard = []
+            for oldKey in self._pixmaps:
+                if len(discard) == excess:
+                    break
+                if not self.isKept(oldKey):
+                    discard.append(oldKey)
+
+            for oldKey in discard:
+                del self._pixmaps[oldKey]
+
+    def startRequests(self):
+        while len(self._replies) < self.maxRequests:
+            key = self.nextTile()
+            if key is None:
+                break
+
+            zoom, x, y = key
+            request = QNetworkRequest()
+            request.setUrl(QUrl(self.urlTemplate % {'zoom': zoom, 'x': x, 'y': y}))
+            request.setRawHeader(b'User-Agent', b'Nokia (PyQt) Graphics Dojo 1.0')
+            self._replies[self._manager.get(request)] = key
+            self._loading.add(key)
+
+    def nextTile(self):
+        # Take the tiles of each map in turn.
+        for owner in list(self._queues):
+            queue = self._queues[owner]
+            while queue:
+                key = queue.popleft()
+                if key not in self._pixmaps and key not in self._loading:
+                    self._queues.move_to_end(owner)
+                    return key
+
+        return None
+
+    # slots
+    def handleNetworkData(self, reply):
+        key = self._replies.pop(reply, None)
+        if key is not None:
+            if reply.error() == QNetworkReply.NoError:
+                data = bytes(reply.readAll())
+                self._decoders.start(TileDecoder(self, key,
+                        self._diskCache.path(key), data))
+            else:
+                self._loading.discard(key)
+
+        reply.deleteLater()
+        self.startRequests()
+
+    def handleTileDecoded(self, zoom, x, y, img, stored):
+        key = (zoom, x, y)
+        self._loading.discard(key)
+
+        if img.isNull():
+            # A tile read from disk that is missing or corrupt will be
+            # downloaded again the next time it is asked for.
+            self._diskCache.remove(key)
+            return
+
+        if stored:
+            self._diskCache.insert(key, stored)
+
+        self.insert(key, QPixmap.fromImage(img))
+        self.tileLoaded.emit(zoom, x, y)
+
+
 class SlippyMap(QObject):
 
     updated = pyqtSignal(QRect)
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, loader=None):
         super(SlippyMap, self).__init__(parent)
 
         self._offset = QPoint()
         self._tilesRect = QRect()
-        self._tilePixmaps = {} # Point(x, y) to QPixmap mapping
-        self._manager = QNetworkAccessManager()
-        self._url = QUrl()
+        self._panDelta = QPointF()
+        if loader is None:
+            loader = TileLoader(self)
+        self._loader = loader
         # public vars
         self.width = 400
         self.height = 300
@@ -130,11 +438,7 @@ class SlippyMap(QObject):
         self._emptyTile = QPixmap(TDIM, TDIM)
         self._emptyTile.fill(Qt.lightGray)
 
-        cache = QNetworkDiskCache()
-        cache.setCacheDirectory(
-            QStandardPaths.writableLocation(QStandardPaths.CacheLocation))
-        self._manager.setCache(cache)
-        self._manager.finished.connect(self.handleNetworkData)
+        self._loader.tileLoaded.connect(self.handleTileLoaded)
 
     def invalidate(self):
         if self.width <= 0 or self.height <= 0:
@@ -149,8 +453,8 @@ class SlippyMap(QObject):
         yp = int(self.height / 2 - (ty - math.floor(ty)) * TDIM)
 
         # first tile vertical and horizontal
-        xa = (xp + TDIM - 1) / TDIM
-        ya = (yp + TDIM - 1) / TDIM
+        xa = (xp + TDIM - 1) // TDIM
+        ya = (yp + TDIM - 1) // TDIM
         xs = int(tx) - xa
         ys = int(ty) - ya
 
@@ -158,14 +462,13 @@ class SlippyMap(QObject):
         self._offset = QPoint(xp - xa * TDIM, yp - ya * TDIM)
 
         # last tile vertical and horizontal
-        xe = int(tx) + (self.width - xp - 1) / TDIM
-        ye = int(ty) + (self.height - yp - 1) / TDIM
+        xe = int(tx) + (self.width - xp - 1) // TDIM
+        ye = int(ty) + (self.height - yp - 1) // TDIM
 
         # build a rect
         self._tilesRect = QRect(xs, ys, xe - xs + 1, ye - ys + 1)
 
-        if self._url.isEmpty():
-            self.download()
+        self.download()
 
         self.updated.emit(QRect(0, 0, self.width, self.height))
 
@@ -175,53 +478,63 @@ class SlippyMap(QObject):
                 tp = Point(x + self._tilesRect.left(), y + self._tilesRect.top())
                 box = self.tileRect(tp)
                 if rect.intersects(box):
-                    p.drawPixmap(box, self._tilePixmaps.get(tp, self._emptyTile))
+                    pixmap = self._loader.pixmap(self.zoom, tp.x(), tp.y())
+                    p.drawPixmap(box, pixmap or self._emptyTile)
    
     def pan(self, delta):
         dx = QPointF(delta) / float(TDIM)
+        self._panDelta = dx
         center = tileForCoordinate(self.latitude, self.longitude, self.zoom) - dx
         self.latitude = latitudeFromTile(center.y(), self.zoom)
         self.longitude = longitudeFromTile(center.x(), self.zoom)
         self.invalidate()
 
     # slots
-    def handleNetworkData(self, reply):
-        img = QImage()
-        tp = Point(reply.request().attribute(QNetworkRequest.User))
-        url = reply.url()
-        if not reply.error():
-            if img.load(reply, None):
-                self._tilePixmaps[tp] = QPixmap.fromImage(img)
-        reply.deleteLater()
-        self.updated.emit(self.tileRect(tp))
-
-        # purge unused tiles
-        bound = self._tilesRect.adjusted(-2, -2, 2, 2)
-        for tp in list(self._tilePixmaps.keys()):
-            if not bound.contains(tp):
-                del self._tilePixmaps[tp]
-        self.download()
+    def handleTileLoaded(self, zoom, x, y):
+        tp = Point(x, y)
+        if zoom == self.zoom and self._tilesRect.contains(tp):
+            self.updated.emit(self.tileRect(tp))
 
     def download(self):
-        grab = None
-        for x in range(self._tilesRect.width()):
-            for y in range(self._tilesRect.height()):
-                tp = Point(self._tilesRect.topLeft() + QPoint(x, y))
-                if tp not in self._tilePixmaps:
-                    grab = QPoint(tp)
-                    break
-
-        if grab is None:
-            self._url = QUrl()
-            return
-
-        path = 'http://tile.openstreetmap.org/%d/%d/%d.png' % (self.zoom, grab.x(), grab.y())
-        self._url = QUrl(path)
-        request = QNetworkRequest()
-        request.setUrl(self._url)
-        request.setRawHeader(b'User-Agent', b'Nokia (PyQt) Graphics Dojo 1.0')
-        request.setAttribute(QNetworkRequest.User, grab)
-        self._manager.get(request)
+        ct = tileForCoordinate(self.latitude, self.longitude, self.zoom)
+        rect = self._tilesRect
+        ring = rect.adjusted(-1, -1, 1, 1)
+
+        # the visible tiles nearest the center of the view are loaded first
+        tiles = self.tilesByDistance(self.zoom, rect, ct)
+
+        # then the ring of tiles around the view, those in the direction the
+        # map is being panned first
+        ahead = ct - self._panDelta * 4
+        tiles.extend(tile for tile in self.tilesByDistance(self.zoom, ring, ahead)
+                if not rect.contains(tile[1], tile[2]))
+
+        # then the tiles of the view at the neighbouring zoom levels
+        keepRects = [(self.zoom, rect.adjusted(-2, -2, 2, 2))]
+        if self.zoom > 0:
+            outer = QRect(QPoint(ring.left() >> 1, ring.top() >> 1),
+                    QPoint(ring.right() >> 1, ring.bottom() >> 1))
+            tiles.extend(self.tilesByDistance(self.zoom - 1, outer, ct / 2))
+            keepRects.append((self.zoom - 1, outer))
+        if self.zoom < 18:
+            inner = QRect(rect.left() << 1, rect.top() << 1,
+                    rect.width() << 1, rect.height() << 1)
+            tiles.extend(self.tilesByDistance(self.zoom + 1, inner, ct * 2))
+
+        self._loader.request(self, tiles, keepRects)
+
+    @staticmethod
+    def tilesByDistance(zoom, rect, center):
+        tiles = []
+        for x in range(rect.left(), rect.right() + 1):
+            for y in range(rect.top(), rect.bottom() + 1):
+                dx = x + 0.5 - center.x()
+                dy = y + 0.5 - center.y()
+                tiles.append((dx * dx + dy * dy, x, y))
+
+        tiles.sort()
+
+        return [(zoom, x, y) for _, x, y in tiles]
 
     def tileRect(self, tp):
         t = tp - self._tilesRect.topLeft()
@@ -232,15 +545,17 @@ class SlippyMap(QObject):
 
 
 class LightMaps(QWidget):
-    def __init__(self, parent = None):
+    def __init__(self, parent = None, loader = None):
         super(LightMaps, self).__init__(parent)
 
         self.pressed = False
         self.snapped = False
         self.zoomed = False
         self.invert = False
-        self._normalMap = SlippyMap(self)
-        self._largeMap = SlippyMap(self)
+        if loader is None:
+            loader = TileLoader(self)
+        self._normalMap = SlippyMap(self, loader)
+        self._largeMap = SlippyMap(self, loader)
         self.pressPos = QPoint()
         self.dragPos = QPoint()
         self.tapTimer = QBasicTimer()
@@ -428,10 +743,10 @@ class LightMaps(QWidget):
 
 
 class MapZoom(QMainWindow):
-    def __init__(self):
+    def __init__(self, loader=None):
         super(MapZoom, self).__init__(None)
 
-        self.map_ = LightMaps(self)
+        self.map_ = LightMaps(self, loader)
         self.setCentralWidget(self.map_)
         self.map_.setFocus()
         self.osloAction = QAction("&Oslo", self)
@@ -475,7 +790,34 @@ if __name__ == '__main__':
 
     app = QApplication(sys.argv)
     app.setApplicationName('LightMaps')
-    w = MapZoom()
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("LightMaps")
+    parser.addHelpOption()
+
+    urlOption = QCommandLineOption(['u', 'tile-url'],
+            "The URL of the tiles with %(zoom)d, %(x)d and %(y)d "
+            "placeholders.", 'url', TILE_URL)
+    parser.addOption(urlOption)
+    requestsOption = QCommandLineOption(['r', 'max-requests'],
+            "The number of tiles downloaded at the same time.", 'count',
+            str(MAX_REQUESTS))
+    parser.addOption(requestsOption)
+    cacheOption = QCommandLineOption(['c', 'cache-size'],
+            "The size of the tile cache on disk.", 'megabytes',
+            str(DISK_CACHE_SIZE // (1024 * 1024)))
+    parser.addOption(cacheOption)
+    cacheDirectoryOption = QCommandLineOption('cache-directory',
+            "The directory of the tile cache.", 'directory')
+    parser.addOption(cacheDirectoryOption)
+    parser.process(app)
+
+    loader = TileLoader(urlTemplate=parser.value(urlOption),
+            maxRequests=int(parser.value(requestsOption)),
+            cacheDirectory=parser.value(cacheDirectoryOption) or None,
+            diskCacheSize=int(parser.value(cacheOption)) * 1024 * 1024)
+
+    w = MapZoom(loader)
     w.setWindowTitle("OpenStreetMap")
     w.resize(600, 450)
     w.show()
@@ -43,23 +43,39 @@
 
 
 import random
+import time
 
-from PyQt5.QtCore import (pyqtSignal, QByteArray, QDataStream, QIODevice,
-        QThread)
+from PyQt5.QtCore import (pyqtSignal, pyqtSlot, QByteArray,
+        QCommandLineOption, QCommandLineParser, QDataStream, QIODevice,
+        QObject, QThread, QTimer)
 from PyQt5.QtWidgets import (QApplication, QDialog, QHBoxLayout, QLabel,
         QMessageBox, QPushButton, QVBoxLayout)
 from PyQt5.QtNetwork import (QHostAddress, QNetworkInterface, QTcpServer,
         QTcpSocket)
 
 
+def encodeFortune(text):
+    # Return the block that sends a fortune, ie. its size followed by the
+    # fortune itself.
+    block = QByteArray()
+    outstr = QDataStream(block, QIODevice.WriteOnly)
+    outstr.setVersion(QDataStream.Qt_4_0)
+    outstr.writeUInt16(0)
+    outstr.writeQString(text)
+    outstr.device().seek(0)
+    outstr.writeUInt16(block.size() - 2)
+
+    return block
+
+
 class FortuneThread(QThread):
     error = pyqtSignal(QTcpSocket.SocketError)
 
-    def __init__(self, socketDescriptor, fortune, parent):
+    def __init__(self, socketDescriptor, block, parent):
         super(FortuneThread, self).__init__(parent)
 
         self.socketDescriptor = socketDescriptor
-        self.text = fortune
+        self.block = block
 
     def run(self):
         tcpSocket = QTcpSocket()
@@ -67,19 +83,109 @@ class FortuneThread(QThread):
             self.error.emit(tcpSocket.error())
             return
 
-        block = QByteArray()
-        outstr = QDataStream(block, QIODevice.WriteOnly)
-        outstr.setVersion(QDataStream.Qt_4_0)
-        outstr.writeUInt16(0)
-        outstr.writeQString(self.text)
-        outstr.device().seek(0)
-        outstr.writeUInt16(block.size() - 2)
-
-        tcpSocket.write(block)
+        tcpSocket.write(self.block)
         tcpSocket.disconnectFromHost()
         tcpSocket.waitForDisconnected()
 
 
+class FortuneWorker(QObject):
+    """Serves any number of connections from the event loop of the thread
+    that it has been moved to.  With keep-alive a client is sent a fortune
+    when it connects and another one for every byte it then sends, until it
+    disconnects or has been idle for too long.  Otherwise the connection is
+    closed once the fortune has been sent.
+    """
+
+    IdleTimeout = 10
+
+    # A client is sent at most this many fortunes for each read, and no more
+    # requests are read while this many bytes are waiting to be sent to it.
+    MaxRequests = 16
+    MaxPendingBytes = 64 * 1024
+
+    connectionReceived = pyqtSignal('qint64')
+    error = pyqtSignal(QTcpSocket.SocketError)
+
+    def __init__(self, blocks, keepAlive, parent=None):
+        super(FortuneWorker, self).__init__(parent)
+
+        self.blocks = blocks
+        self.keepAlive = keepAlive
+        self.lastActive = {}
+
+        # The timer is created when the worker is first used so that it
+        # belongs to the worker's thread.
+        self.idleTimer = None
+
+        self.connectionReceived.connect(self.addConnection)
+
+    # The slots are decorated so that they are invoked in the worker's thread,
+    # rather than the thread that the worker was created in, and so that
+    # sender() is always valid.
+    @pyqtSlot('qint64')
+    def addConnection(self, socketDescriptor):
+        tcpSocket = QTcpSocket(self)
+        if not tcpSocket.setSocketDescriptor(socketDescriptor):
+            self.error.emit(tcpSocket.error())
+            tcpSocket.deleteLater()
+            return
+
+        tcpSocket.disconnected.connect(self.removeConnection)
+        tcpSocket.write(random.choice(self.blocks))
+
+        if self.keepAlive:
+            # Requests that aren't being served are left with the operating
+            # system so that a client that floods the connection is slowed
+            # down by TCP flow control.
+            tcpSocket.setReadBufferSize(self.MaxRequests)
+            tcpSocket.readyRead.connect(self.sendFortunes)
+            tcpSocket.bytesWritten.connect(self.sendFortunes)
+            self.lastActive[tcpSocket] = time.monotonic()
+
+            if self.idleTimer is None:
+                self.idleTimer = QTimer(self)
+                self.idleTimer.timeout.connect(self.closeIdleConnections)
+                self.idleTimer.start(1000)
+        else:
+            tcpSocket.disconnectFromHost()
+
+    @pyqtSlot()
+    def removeConnection(self):
+        tcpSocket = self.sender()
+        self.lastActive.pop(tcpSocket, None)
+        tcpSocket.deleteLater()
+
+    @pyqtSlot()
+    def sendFortunes(self):
+        tcpSocket = self.sender()
+        self.lastActive[tcpSocket] = time.monotonic()
+
+        # Stop reading requests while the client isn't reading the fortunes
+        # already sent.  Reading resumes when they have been written.
+        if tcpSocket.bytesToWrite() > self.MaxPendingBytes:
+            return
+
+        # Each byte received is a request for another fortune.
+        blocks = self.blocks
+        requests = len(tcpSocket.read(self.MaxRequests))
+        if requests:
+            tcpSocket.write(b''.join(random.choice(blocks)
+                    for _ in range(requests)))
+
+    @pyqtSlot()
+    def closeIdleConnections(self):
+        expired = time.monotonic() - self.IdleTimeout
+
+        for tcpSocket, lastActive in list(self.lastActive.items()):
+            if lastActive < expired:
+                # Fortunes that the client has stopped reading would stop the
+                # connection from closing.
+                if tcpSocket.bytesToWrite():
+                    tcpSocket.abort()
+                else:
+                    tcpSocket.disconnectFromHost()
+
+
 class FortuneServer(QTcpServer):
     FORTUNES = (
         "You've been leading a dog's life. Stay off the furniture.",
@@ -90,26 +196,67 @@ class FortuneServer(QTcpServer):
         "You cannot kill time without injuring eternity.",
         "Computers are not intelligent. They only think they are.")
 
+    def __init__(self, numThreads=0, keepAlive=False, parent=None):
+        super(FortuneServer, self).__init__(parent)
+
+        # The fortunes are encoded once rather than for every connection.
+        self.blocks = [bytes(encodeFortune(fortune))
+                for fortune in self.FORTUNES]
+
+        # Without any worker threads a thread is started for each connection.
+        # Otherwise connections are shared between a fixed number of threads
+        # in turn.
+        self.keepAlive = keepAlive
+        self.workers = []
+        self.threads = []
+        self.nextWorker = 0
+
+        for i in range(numThreads):
+            thread = QThread(self)
+            worker = FortuneWorker(self.blocks, keepAlive)
+            worker.moveToThread(thread)
+            thread.finished.connect(worker.deleteLater)
+            thread.start()
+
+            self.workers.append(worker)
+            self.threads.append(thread)
+
     def incomingConnection(self, socketDescriptor):
-        fortune = self.FORTUNES[random.randint(0, len(self.FORTUNES) - 1)]
+        if self.workers:
+            worker = self.workers[self.nextWorker]
+            self.nextWorker = (self.nextWorker + 1) % len(self.workers)
+            worker.connectionReceived.emit(int(socketDescriptor))
+        else:
+            thread = FortuneThread(socketDescriptor,
+                    random.choice(self.blocks), self)
+            thread.finished.connect(thread.deleteLater)
+            thread.start()
+
+    def close(self):
+        super(FortuneServer, self).close()
+
+        for thread in self.threads:
+            thread.quit()
+
+        for thread in self.threads:
+            thread.wait()
 
-        thread = FortuneThread(socketDescriptor, fortune, self)
-        thread.finished.connect(thread.deleteLater)
-        thread.start()
+        self.workers = []
+        self.threads = []
 
 
 class Dialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, port=0, numThreads=0, keepAlive=False, parent=None):
         super(Dialog, self).__init__(parent)
 
-        self.server = FortuneServer()
+        self.server = FortuneServer(numThreads, keepAlive)
 
         statusLabel = QLabel()
         statusLabel.setWordWrap(True)
         quitButton = QPushButton("Quit")
         quitButton.setAutoDefault(False)
 
-        if not self.server.listen():
+        if not self.server.listen(QHostAddress.Any, port):
             QMessageBox.critical(self, "Threaded Fortune Server",
                     "Unable to start the server: %s." % self.server.errorString())
             self.close()
@@ -123,8 +270,16 @@ class Dialog(QDialog):
 
         ipAddress = ipAddress.toString()
 
-        statusLabel.setText("The server is running on\n\nIP: %s\nport: %d\n\n"
-                "Run the Fortune Client example now." % (ipAddress, self.server.serverPort()))
+        if numThreads:
+            mode = "%d worker threads" % numThreads
+            if keepAlive:
+                mode += " with keep-alive"
+        else:
+            mode = "a thread for each connection"
+
+        statusLabel.setText("The server is running on\n\nIP: %s\nport: %d\n"
+                "using %s.\n\nRun the Fortune Client example now." % (
+                        ipAddress, self.server.serverPort(), mode))
 
         quitButton.clicked.connect(self.close)
 
@@ -140,12 +295,40 @@ class Dialog(QDialog):
 
         self.setWindowTitle("Threaded Fortune Server")
 
+    def done(self, result):
+        self.server.close()
+        super(Dialog, self).done(result)
+
 
 if __name__ == '__main__':
 
     import sys
 
     app = QApplication(sys.argv)
-    dialog = Dialog()
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Threaded Fortune Server")
+    parser.addHelpOption()
+
+    portOption = QCommandLineOption(['p', 'port'],
+            "The port to listen on rather than any free port.", 'port', '0')
+    parser.addOption(portOption)
+    threadsOption = QCommandLineOption(['t', 'threads'],
+            "Serve connections from a pool of <threads> worker threads "
+            "rather than starting a thread for each connection.", 'threads',
+            '0')
+    parser.addOption(threadsOption)
+    keepAliveOption = QCommandLineOption(['k', 'keep-alive'],
+            "Keep connections open so that a client can request more "
+            "fortunes.  This uses a pool of worker threads.")
+    parser.addOption(keepAliveOption)
+    parser.process(app)
+
+    numThreads = int(parser.value(threadsOption))
+    keepAlive = parser.isSet(keepAliveOption)
+    if keepAlive and numThreads == 0:
+        numThreads = QThread.idealThreadCount()
+
+    dialog = Dialog(int(parser.value(portOption)), numThreads, keepAlive)
     dialog.show()
     sys.exit(dialog.exec_())
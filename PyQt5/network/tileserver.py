@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+# A stand-in for a map tile server that generates a plain PNG for every
+# zoom/x/y.png tile it is asked for.  It can be used to exercise the tile
+# pipeline of the lightmaps example without a network connection, for example:
+#
+#   python tileserver.py --port 8080 --delay 100
+#   python lightmaps.py --tile-url 'http://localhost:8080/%(zoom)d/%(x)d/%(y)d.png'
+
+
+import re
+import struct
+import threading
+import time
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+
+# tile size in pixels
+TDIM = 256
+
+
+def pngChunk(chunkType, data):
+    chunk = chunkType + data
+
+    return (struct.pack('>I', len(data)) + chunk +
+            struct.pack('>I', zlib.crc32(chunk) & 0xffffffff))
+
+
+def tilePng(zoom, x, y):
+    """Return a PNG of a tile in a color derived from its coordinates with a
+    dark border so that the tile grid can be seen.
+    """
+
+    seed = (zoom * 73856093) ^ (x * 19349663) ^ (y * 83492791)
+    color = bytes(bytearray([128 + (seed & 0x7f), 128 + ((seed >> 7) & 0x7f),
+            128 + ((seed >> 14) & 0x7f)]))
+    border = b'\x40\x40\x40'
+
+    edge = b'\x00' + border * TDIM
+    inner = b'\x00' + border + color * (TDIM - 2) + border
+    raw = edge + inner * (TDIM - 2) + edge
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            pngChunk(b'IHDR', struct.pack('>IIBBBBB', TDIM, TDIM, 8, 2, 0, 0, 0)) +
+            pngChunk(b'IDAT', zlib.compress(raw)) +
+            pngChunk(b'IEND', b''))
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    tilePath = re.compile(r'^/(\d+)/(\d+)/(\d+)\.png$')
+
+    def do_GET(self):
+        match = self.tilePath.match(self.path)
+        if match is None:
+            self.send_error(404)
+            return
+
+        self.server.countRequest()
+
+        if self.server.delay:
+            time.sleep(self.server.delay / 1000.0)
+
+        data = tilePng(*[int(group) for group in match.groups()])
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class TileServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delay=0, verbose=False):
+        HTTPServer.__init__(self, address, TileRequestHandler)
+
+        self.delay = delay
+        self.verbose = verbose
+        self.numRequests = 0
+        self._lock = threading.Lock()
+
+    def countRequest(self):
+        with self._lock:
+            self.numRequests += 1
+
+    def urlTemplate(self):
+        return 'http://%s:%d/%%(zoom)d/%%(x)d/%%(y)d.png' % self.server_address[:2]
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Map tile server stand-in")
+    parser.add_argument('--port', type=int, default=8080,
+            help="the port to listen on")
+    parser.add_argument('--delay', type=int, default=0,
+            help="the time in milliseconds taken to serve each tile")
+    parser.add_argument('--verbose', action='store_true',
+            help="log every request")
+    args = parser.parse_args()
+
+    server = TileServer(('localhost', args.port), args.delay, args.verbose)
+    print("Serving tiles at %s" % server.urlTemplate())
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    print("%d tiles served" % server.numRequests)
@@ -42,7 +42,7 @@
 #############################################################################
 
 
-from PyQt5.QtCore import QFile, QRegExp, Qt
+from PyQt5.QtCore import QFile, QRegularExpression, Qt
 from PyQt5.QtGui import QFont, QSyntaxHighlighter, QTextCharFormat
 from PyQt5.QtWidgets import (QApplication, QFileDialog, QMainWindow, QMenu,
         QMessageBox, QTextEdit)
@@ -116,81 +116,102 @@ class MainWindow(QMainWindow):
 
 
 class Highlighter(QSyntaxHighlighter):
+    keywords = ("char", "class", "const", "double", "enum", "explicit",
+            "friend", "inline", "int", "long", "namespace", "operator",
+            "private", "protected", "public", "short", "signals", "signed",
+            "slots", "static", "struct", "template", "typedef", "typename",
+            "union", "unsigned", "virtual", "void", "volatile")
+
     def __init__(self, parent=None):
         super(Highlighter, self).__init__(parent)
 
+        # The expressions are compiled once rather than for every block.  A
+        # rule may also have some text that any match must contain so that
+        # the rule can be skipped for blocks that don't contain it.
         keywordFormat = QTextCharFormat()
         keywordFormat.setForeground(Qt.darkBlue)
         keywordFormat.setFontWeight(QFont.Bold)
 
-        keywordPatterns = ["\\bchar\\b", "\\bclass\\b", "\\bconst\\b",
-                "\\bdouble\\b", "\\benum\\b", "\\bexplicit\\b", "\\bfriend\\b",
-                "\\binline\\b", "\\bint\\b", "\\blong\\b", "\\bnamespace\\b",
-                "\\boperator\\b", "\\bprivate\\b", "\\bprotected\\b",
-                "\\bpublic\\b", "\\bshort\\b", "\\bsignals\\b", "\\bsigned\\b",
-                "\\bslots\\b", "\\bstatic\\b", "\\bstruct\\b",
-                "\\btemplate\\b", "\\btypedef\\b", "\\btypename\\b",
-                "\\bunion\\b", "\\bunsigned\\b", "\\bvirtual\\b", "\\bvoid\\b",
-                "\\bvolatile\\b"]
-
-        self.highlightingRules = [(QRegExp(pattern), keywordFormat)
-                for pattern in keywordPatterns]
+        # The keywords are matched by a single alternation rather than a rule
+        # each.
+        self.highlightingRules = [(self.expression(
+                "\\b(?:%s)\\b" % "|".join(self.keywords)), keywordFormat,
+                None)]
 
         classFormat = QTextCharFormat()
         classFormat.setFontWeight(QFont.Bold)
         classFormat.setForeground(Qt.darkMagenta)
-        self.highlightingRules.append((QRegExp("\\bQ[A-Za-z]+\\b"),
-                classFormat))
+        self.highlightingRules.append((self.expression("\\bQ[A-Za-z]+\\b"),
+                classFormat, "Q"))
 
         singleLineCommentFormat = QTextCharFormat()
         singleLineCommentFormat.setForeground(Qt.red)
-        self.highlightingRules.append((QRegExp("//[^\n]*"),
-                singleLineCommentFormat))
+        self.highlightingRules.append((self.expression("//[^\n]*"),
+                singleLineCommentFormat, "//"))
 
         self.multiLineCommentFormat = QTextCharFormat()
         self.multiLineCommentFormat.setForeground(Qt.red)
 
         quotationFormat = QTextCharFormat()
         quotationFormat.setForeground(Qt.darkGreen)
-        self.highlightingRules.append((QRegExp("\".*\""), quotationFormat))
+        self.highlightingRules.append((self.expression("\".*\""),
+                quotationFormat, "\""))
 
         functionFormat = QTextCharFormat()
         functionFormat.setFontItalic(True)
         functionFormat.setForeground(Qt.blue)
-        self.highlightingRules.append((QRegExp("\\b[A-Za-z0-9_]+(?=\\()"),
-                functionFormat))
+        self.highlightingRules.append((
+                self.expression("\\b[A-Za-z0-9_]+(?=\\()"), functionFormat,
+                "("))
 
-        self.commentStartExpression = QRegExp("/\\*")
-        self.commentEndExpression = QRegExp("\\*/")
+        self.commentStartExpression = self.expression("/\\*")
+        self.commentEndExpression = self.expression("\\*/")
 
-    def highlightBlock(self, text):
-        for pattern, format in self.highlightingRules:
-            expression = QRegExp(pattern)
-            index = expression.indexIn(text)
-            while index >= 0:
-                length = expression.matchedLength()
-                self.setFormat(index, length, format)
-                index = expression.indexIn(text, index + length)
+    @staticmethod
+    def expression(pattern):
+        expression = QRegularExpression(pattern)
+        expression.optimize()
 
+        return expression
+
+    def highlightBlock(self, text):
+        for expression, format, hint in self.highlightingRules:
+            if hint is not None and hint not in text:
+                continue
+
+            matches = expression.globalMatch(text)
+            while matches.hasNext():
+                match = matches.next()
+                self.setFormat(match.capturedStart(), match.capturedLength(),
+                        format)
+
+        # Only the multi-line comment state is stored in the block so that
+        # QSyntaxHighlighter only goes on to rehighlight the following blocks
+        # when an edit opens or closes a comment.
         self.setCurrentBlockState(0)
 
         startIndex = 0
         if self.previousBlockState() != 1:
-            startIndex = self.commentStartExpression.indexIn(text)
+            if "/*" not in text:
+                return
+
+            startIndex = self.commentStartExpression.match(
+                    text).capturedStart()
 
         while startIndex >= 0:
-            endIndex = self.commentEndExpression.indexIn(text, startIndex)
+            match = self.commentEndExpression.match(text, startIndex)
+            endIndex = match.capturedStart()
 
             if endIndex == -1:
                 self.setCurrentBlockState(1)
                 commentLength = len(text) - startIndex
             else:
-                commentLength = endIndex - startIndex + self.commentEndExpression.matchedLength()
+                commentLength = endIndex - startIndex + match.capturedLength()
 
             self.setFormat(startIndex, commentLength,
                     self.multiLineCommentFormat)
-            startIndex = self.commentStartExpression.indexIn(text,
-                    startIndex + commentLength);
+            startIndex = self.commentStartExpression.match(text,
+                    startIndex + commentLength).capturedStart()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+
+
+#############################################################################
+##
+## Copyright (C) 2013 Riverbank Computing Limited.
+## All rights reserved.
+##
+## This file is part of the examples of PyQt.
+##
+## $QT_BEGIN_LICENSE:BSD$
+## You may use this file under the terms of the BSD license as follows:
+##
+## "Redistribution and use in source and binary forms, with or without
+## modification, are permitted provided that the following conditions are
+## met:
+##   * Redistributions of source code must retain the above copyright
+##     notice, this list of conditions and the following disclaimer.
+##   * Redistributions in binary form must reproduce the above copyright
+##     notice, this list of conditions and the following disclaimer in
+##     the documentation and/or other materials provided with the
+##     distribution.
+##   * Neither the name of Nokia Corporation and its Subsidiary(-ies) nor
+##     the names of its contributors may be used to endorse or promote
+##     products derived from this software without specific prior written
+##     permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+## "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+## LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+## A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+## OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+## SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+## LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+## DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+## THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+## (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+## OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+## $QT_END_LICENSE$
+##
+#############################################################################
+
+
+# A headless benchmark of the syntax highlighter.  A C++ file, either
+# generated or given on the command line, is highlighted in full and then
+# edited to see how many blocks are highlighted again.  The results are
+# written as JSON so that the original highlighter, which compiled a QRegExp
+# for every rule and every block, can be compared, for example:
+#
+#   python syntaxhighlighterbenchmark.py --lines 100000 --legacy
+
+
+import json
+import os
+import random
+import sys
+import time
+
+# The benchmark doesn't need a display.
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import (QCommandLineOption, QCommandLineParser, QFile,
+        QRegExp)
+from PyQt5.QtGui import QTextCursor, QTextDocument
+from PyQt5.QtWidgets import QApplication, QPlainTextDocumentLayout
+
+from syntaxhighlighter import Highlighter
+
+
+class LegacyHighlighter(Highlighter):
+    """The highlighter as it was before its expressions were precompiled. """
+
+    def __init__(self, parent=None):
+        super(LegacyHighlighter, self).__init__(parent)
+
+        keywordFormat = self.highlightingRules[0][1]
+        self.highlightingRules = [(QRegExp("\\b%s\\b" % keyword), keywordFormat)
+                for keyword in self.keywords] + [
+                        (QRegExp(expression.pattern()), format)
+                        for expression, format, _ in self.highlightingRules[1:]]
+
+        self.commentStartExpression = QRegExp("/\\*")
+        self.commentEndExpression = QRegExp("\\*/")
+
+    def highlightBlock(self, text):
+        for pattern, format in self.highlightingRules:
+            expression = QRegExp(pattern)
+            index = expression.indexIn(text)
+            while index >= 0:
+                length = expression.matchedLength()
+                self.setFormat(index, length, format)
+                index = expression.indexIn(text, index + length)
+
+        self.setCurrentBlockState(0)
+
+        startIndex = 0
+        if self.previousBlockState() != 1:
+            startIndex = self.commentStartExpression.indexIn(text)
+
+        while startIndex >= 0:
+            endIndex = self.commentEndExpression.indexIn(text, startIndex)
+
+            if endIndex == -1:
+                self.setCurrentBlockState(1)
+                commentLength = len(text) - startIndex
+            else:
+                commentLength = endIndex - startIndex + self.commentEndExpression.matchedLength()
+
+            self.setFormat(startIndex, commentLength,
+                    self.multiLineCommentFormat)
+            startIndex = self.commentStartExpression.indexIn(text,
+                    startIndex + commentLength);
+
+
+def counting(highlighterClass):
+    # Return a subclass of a highlighter that counts the blocks it
+    # highlights.
+
+    class CountingHighlighter(highlighterClass):
+        blocks = 0
+
+        def highlightBlock(self, text):
+            self.blocks += 1
+            super(CountingHighlighter, self).highlightBlock(text)
+
+    return CountingHighlighter
+
+
+def generateSource(numLines):
+    """Return the text of a C++ file of a number of lines with the mix of
+    keywords, Qt classes, function calls, strings and comments that the
+    highlighter looks for.
+    """
+
+    names = ("width", "height", "value", "count", "index", "model", "view",
+            "parent", "item", "text")
+    classes = ("QWidget", "QString", "QPainter", "QModelIndex", "QVariant",
+            "QList")
+    types = ("int", "double", "const char *", "unsigned long", "void *")
+
+    lines = []
+    while len(lines) < numLines:
+        name = random.choice(names)
+        klass = random.choice(classes)
+        kind = random.random()
+
+        if kind < 0.05:
+            lines.extend(["/*", " * The %s of the %s." % (name, klass),
+                    " * Returns %s." % random.choice(types), " */"])
+        elif kind < 0.1:
+            lines.extend(["class %s%d : public %s" % (klass, len(lines), klass),
+                    "{", "    Q_OBJECT", "", "public:",
+                    "    explicit %s%d(QObject *parent = 0);" % (klass,
+                            len(lines)),
+                    "    virtual ~%s%d();" % (klass, len(lines)), "",
+                    "private slots:", "    void %sChanged(%s %s);" % (name,
+                            random.choice(types), name), "};", ""])
+        elif kind < 0.3:
+            lines.append("    // Update the %s of the %s." % (name, klass))
+        elif kind < 0.5:
+            lines.append("    %s %s = %s(\"%s\", %d);" % (
+                    random.choice(types), name, klass, name,
+                    random.randrange(1000)))
+        elif kind < 0.7:
+            lines.append("    static_cast<%s *>(%s)->set%s(%s + 1); /* %d */" % (
+                    klass, name, name.capitalize(), name,
+                    random.randrange(1000)))
+        elif kind < 0.85:
+            lines.append("    if (%s.isValid() && %s > 0)" % (name,
+                    random.choice(names)))
+        else:
+            lines.append("        return %s;" % name)
+
+    return "\n".join(lines[:numLines])
+
+
+def editBlock(document, highlighter, blockNumber, text, remove=False):
+    """Insert some text at the start of a block, or remove it, and return the
+    time taken and the number of blocks highlighted again.
+    """
+
+    cursor = QTextCursor(document.findBlockByNumber(blockNumber))
+    highlighter.blocks = 0
+
+    start = time.perf_counter()
+
+    if remove:
+        cursor.movePosition(QTextCursor.NextCharacter, QTextCursor.KeepAnchor,
+                len(text))
+        cursor.removeSelectedText()
+    else:
+        cursor.insertText(text)
+
+    return {'ms': (time.perf_counter() - start) * 1000.0,
+            'blocks': highlighter.blocks}
+
+
+def benchmark(source, highlighterClass, numRuns):
+    document = QTextDocument()
+    document.setPlainText(source)
+
+    # The document only reports changes to its contents once it has a layout.
+    # The plain text layout is used so that laying out the text doesn't
+    # dominate the time taken.
+    document.setDocumentLayout(QPlainTextDocumentLayout(document))
+
+    highlighter = counting(highlighterClass)(document)
+
+    # Setting the document schedules a rehighlight and the highlighter
+    # ignores any edits until it has been done.
+    QApplication.processEvents()
+
+    best = None
+    for run in range(numRuns):
+        start = time.perf_counter()
+        highlighter.rehighlight()
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    blocks = document.blockCount()
+    result = {
+        'blocks': blocks,
+        'highlightSeconds': best,
+        'blocksPerSecond': blocks / best,
+    }
+
+    # An edit that doesn't change the comment state of its block should only
+    # highlight that block.  Opening a comment should highlight the following
+    # blocks up to the end of the next comment and closing it again should
+    # do the same.
+    middle = blocks // 2
+    result['editLine'] = editBlock(document, highlighter, middle, "x")
+    result['openComment'] = editBlock(document, highlighter, middle, "/*")
+    result['closeComment'] = editBlock(document, highlighter, middle, "/*",
+            remove=True)
+
+    return result
+
+
+if __name__ == '__main__':
+
+    app = QApplication(sys.argv)
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Syntax Highlighter Benchmark")
+    parser.addHelpOption()
+    parser.addPositionalArgument('file',
+            "The C++ file to highlight rather than a generated one.",
+            "[file]")
+
+    linesOption = QCommandLineOption(['n', 'lines'],
+            "The number of lines of the generated file.", 'lines', '100000')
+    parser.addOption(linesOption)
+    runsOption = QCommandLineOption(['r', 'runs'],
+            "The number of times the file is highlighted in full, the best "
+            "time being reported.", 'runs', '3')
+    parser.addOption(runsOption)
+    legacyOption = QCommandLineOption(['l', 'legacy'],
+            "Also benchmark the original highlighter.")
+    parser.addOption(legacyOption)
+    seedOption = QCommandLineOption('seed', "The random number seed.", 'seed',
+            '1')
+    parser.addOption(seedOption)
+    outputOption = QCommandLineOption(['o', 'output'],
+            "Write the JSON report to <file> rather than stdout.", 'file')
+    parser.addOption(outputOption)
+    parser.process(app)
+
+    args = parser.positionalArguments()
+    if args:
+        inFile = QFile(args[0])
+        if not inFile.open(QFile.ReadOnly | QFile.Text):
+            parser.showHelp(1)
+
+        source = str(inFile.readAll(), encoding='utf-8', errors='replace')
+    else:
+        random.seed(int(parser.value(seedOption)))
+        source = generateSource(int(parser.value(linesOption)))
+
+    numRuns = int(parser.value(runsOption))
+
+    report = {
+        'file': args[0] if args else None,
+        'highlighter': benchmark(source, Highlighter, numRuns),
+    }
+
+    if parser.isSet(legacyOption):
+        report['legacyHighlighter'] = benchmark(source, LegacyHighlighter,
+                numRuns)
+        report['speedup'] = (report['legacyHighlighter']['highlightSeconds'] /
+                report['highlighter']['highlightSeconds'])
+
+    if parser.isSet(outputOption):
+        with open(parser.value(outputOption), 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
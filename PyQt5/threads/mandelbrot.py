@@ -42,8 +42,17 @@
 #############################################################################
 
 
-from PyQt5.QtCore import (pyqtSignal, QMutex, QMutexLocker, QPoint, QSize, Qt,
-        QThread, QWaitCondition)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PyQt5.QtCore import (pyqtSignal, QCommandLineOption, QCommandLineParser,
+        QElapsedTimer, QMutex, QMutexLocker, QPoint, QSize, Qt, QThread,
+        QWaitCondition)
 from PyQt5.QtGui import QColor, QImage, QPainter, QPixmap, qRgb
 from PyQt5.QtWidgets import QApplication, QWidget
 
@@ -56,11 +65,115 @@ ZoomInFactor = 0.8
 ZoomOutFactor = 1 / ZoomInFactor
 ScrollStep = 20
 
+TileSize = 128
+TileCacheSize = 128 * 1024 * 1024
+
+
+def escapeTimes(c0, maxIterations, limit, interrupted=None):
+    """Return the escape iteration count of every point of the complex array
+    c0.  Points that do not escape are given maxIterations.  None is returned
+    if interrupted() becomes true before all the points have been resolved.
+    """
+
+    counts = numpy.full(c0.size, maxIterations, dtype=numpy.int32)
+    index = numpy.arange(c0.size)
+    c0 = c0.ravel()
+    c = c0.copy()
+    limit2 = limit * limit
+
+    numIterations = 0
+    while numIterations < maxIterations and index.size != 0:
+        if interrupted is not None and numIterations % 64 == 0 and interrupted():
+            return None
+
+        numIterations += 1
+        c *= c
+        c += c0
+
+        escaped = (c.real * c.real + c.imag * c.imag) >= limit2
+        if escaped.any():
+            counts[index[escaped]] = numIterations
+            remaining = ~escaped
+            index = index[remaining]
+            c = c[remaining]
+            c0 = c0[remaining]
+
+    return counts
+
+
+def renderTile(scaleFactor, column, row, maxIterations, limit, colormap,
+        interrupted=None):
+    """Render the tile at the given column and row of the grid of tiles for a
+    scale and return a tuple of an array of RGB32 pixels and a flag that is
+    set if every pixel is black.  None is returned if the render was
+    interrupted.
+    """
+
+    xs = (column * TileSize + numpy.arange(TileSize)) * scaleFactor
+    ys = (row * TileSize + numpy.arange(TileSize)) * scaleFactor
+    c0 = xs[numpy.newaxis, :] + 1j * ys[:, numpy.newaxis]
+
+    counts = escapeTimes(c0, maxIterations, limit, interrupted)
+    if counts is None:
+        return None
+
+    counts = counts.reshape(c0.shape)
+    inside = counts >= maxIterations
+    pixels = colormap[counts % len(colormap)]
+    pixels[inside] = qRgb(0, 0, 0)
+
+    return pixels, bool(inside.all())
+
+
+def imageArray(image):
+    """Return a writable array that shares the pixels of an RGB32 image."""
+
+    ptr = image.bits()
+    ptr.setsize(image.byteCount())
+    return numpy.frombuffer(ptr, dtype=numpy.uint32).reshape(image.height(),
+            image.bytesPerLine() // 4)
+
+
+class TileCache(object):
+    """A least recently used cache of rendered tiles limited to a number of
+    bytes.
+    """
+
+    def __init__(self, maxBytes=TileCacheSize):
+        self.maxBytes = maxBytes
+        self.numBytes = 0
+        self.tiles = OrderedDict()
+
+    def find(self, key):
+        tile = self.tiles.pop(key, None)
+        if tile is not None:
+            self.tiles[key] = tile
+
+        return tile
+
+    def insert(self, key, tile):
+        old = self.tiles.pop(key, None)
+        if old is not None:
+            self.numBytes -= old[0].nbytes
+
+        self.tiles[key] = tile
+        self.numBytes += tile[0].nbytes
+
+        while self.numBytes > self.maxBytes and len(self.tiles) > 1:
+            _, evicted = self.tiles.popitem(last=False)
+            self.numBytes -= evicted[0].nbytes
+
+    def clear(self):
+        self.tiles.clear()
+        self.numBytes = 0
+
 
 class RenderThread(QThread):
     ColormapSize = 512
 
     renderedImage = pyqtSignal(QImage, float)
+    renderedTile = pyqtSignal(QImage, int, int, float, float, float)
+    renderedTiles = pyqtSignal(int, float)
 
     def __init__(self, parent=None):
         super(RenderThread, self).__init__(parent)
@@ -75,10 +188,19 @@ class RenderThread(QThread):
 
         self.restart = False
         self.abort = False
+        self.generation = 0
+        self.executor = None
+        self.interruptible = True
+        self.tileCache = TileCache()
 
         for i in range(RenderThread.ColormapSize):
             self.colormap.append(self.rgbFromWaveLength(380.0 + (i * 400.0 / RenderThread.ColormapSize)))
 
+        # The array engine is used whenever numpy is available.
+        self.useNumpy = numpy is not None
+        if self.useNumpy:
+            self.colormapArray = numpy.array(self.colormap, dtype=numpy.uint32)
+
     def __del__(self):
         self.mutex.lock()
         self.abort = True
@@ -87,6 +209,32 @@ class RenderThread(QThread):
 
         self.wait()
 
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def setWorkers(self, workers, useProcesses=False):
+        """Render the tiles of each pass in parallel using a pool of workers.
+        The pool is either of processes or of threads running the array engine
+        (which releases the GIL while it iterates).  It must be called before
+        the first render.
+        """
+
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+        if not self.useNumpy or workers <= 1:
+            return
+
+        if useProcesses:
+            self.executor = ProcessPoolExecutor(workers)
+        else:
+            self.executor = ThreadPoolExecutor(workers)
+
+        # Bound methods of the thread can't be sent to another process so
+        # tiles that have already started can't be interrupted.
+        self.interruptible = not useProcesses
+
     def render(self, centerX, centerY, scaleFactor, resultSize):
         locker = QMutexLocker(self.mutex)
 
@@ -94,6 +242,7 @@ class RenderThread(QThread):
         self.centerY = centerY
         self.scaleFactor = scaleFactor
         self.resultSize = resultSize
+        self.generation += 1
 
         if not self.isRunning():
             self.start(QThread.LowPriority)
@@ -120,45 +269,53 @@ class RenderThread(QThread):
             while curpass < NumPasses:
                 MaxIterations = (1 << (2 * curpass + 6)) + 32
                 Limit = 4
-                allBlack = True
 
-                for y in range(-halfHeight, halfHeight):
-                    if self.restart:
-                        break
+                if self.useNumpy:
+                    allBlack = self.renderPassArray(image, centerX, centerY,
+                            scaleFactor, curpass, NumPasses, MaxIterations,
+                            Limit)
                     if self.abort:
                         return
-
-                    ay = 1j * (centerY + (y * scaleFactor))
-
-                    for x in range(-halfWidth, halfWidth):
-                        c0 = centerX + (x * scaleFactor) + ay
-                        c = c0
-                        numIterations = 0
-
-                        while numIterations < MaxIterations:
-                            numIterations += 1
-                            c = c*c + c0
-                            if abs(c) >= Limit:
-                                break
-                            numIterations += 1
-                            c = c*c + c0
-                            if abs(c) >= Limit:
-                                break
-                            numIterations += 1
-                            c = c*c + c0
-                            if abs(c) >= Limit:
-                                break
-                            numIterations += 1
-                            c = c*c + c0
-                            if abs(c) >= Limit:
-                                break
-
-                        if numIterations < MaxIterations:
-                            image.setPixel(x + halfWidth, y + halfHeight,
-                                           self.colormap[numIterations % RenderThread.ColormapSize])
-                            allBlack = False
-                        else:
-                            image.setPixel(x + halfWidth, y + halfHeight, qRgb(0, 0, 0))
+                else:
+                    allBlack = True
+
+                    for y in range(-halfHeight, halfHeight):
+                        if self.restart:
+                            break
+                        if self.abort:
+                            return
+
+                        ay = 1j * (centerY + (y * scaleFactor))
+
+                        for x in range(-halfWidth, halfWidth):
+                            c0 = centerX + (x * scaleFactor) + ay
+                            c = c0
+                            numIterations = 0
+
+                            while numIterations < MaxIterations:
+                                numIterations += 1
+                                c = c*c + c0
+                                if abs(c) >= Limit:
+                                    break
+                                numIterations += 1
+                                c = c*c + c0
+                                if abs(c) >= Limit:
+                                    break
+                                numIterations += 1
+                                c = c*c + c0
+                                if abs(c) >= Limit:
+                                    break
+                                numIterations += 1
+                                c = c*c + c0
+                                if abs(c) >= Limit:
+                                    break
+
+                            if numIterations < MaxIterations:
+                                image.setPixel(x + halfWidth, y + halfHeight,
+                                               self.colormap[numIterations % RenderThread.ColormapSize])
+                                allBlack = False
+                            else:
+                                image.setPixel(x + halfWidth, y + halfHeight, qRgb(0, 0, 0))
 
                 if allBlack and curpass == 0:
                     curpass = 4
@@ -168,11 +325,138 @@ class RenderThread(QThread):
                     curpass += 1
 
             self.mutex.lock()
-            if not self.restart:
+            while not (self.restart or self.abort):
                 self.condition.wait(self.mutex)
             self.restart = False
             self.mutex.unlock()
 
+    def renderPassArray(self, image, centerX, centerY, scaleFactor, curpass,
+            numPasses, maxIterations, limit):
+        width = image.width() // 2 * 2
+        height = image.height() // 2 * 2
+        pixels = imageArray(image)
+        allBlack = True
+
+        # Tiles are rendered on a grid of pixels fixed for each scale so that
+        # they can be reused when the view is scrolled.  The scale is rounded
+        # so that zooming in and back out again finds the same tiles.
+        scale = float('%.12g' % scaleFactor)
+        left = int(round(centerX / scale)) - width // 2
+        top = int(round(centerY / scale)) - height // 2
+
+        missing = []
+        for row in range(top // TileSize, (top + height - 1) // TileSize + 1):
+            for column in range(left // TileSize,
+                    (left + width - 1) // TileSize + 1):
+                # A tile rendered by a later pass is at least as good.
+                for tilePass in range(numPasses - 1, curpass - 1, -1):
+                    tile = self.tileCache.find((scale, tilePass, column, row))
+                    if tile is not None:
+                        break
+                else:
+                    missing.append((column, row))
+                    continue
+
+                self.copyTile(pixels, left, top, width, height, column, row,
+                        tile[0])
+                allBlack = allBlack and tile[1]
+
+        generation = self.generation
+        interrupted = lambda: self.abort or self.generation != generation
+
+        timer = QElapsedTimer()
+        timer.start()
+        numTiles = 0
+
+        if self.executor is None:
+            results = self.renderTilesSerially(missing, scale, maxIterations,
+                    limit, interrupted)
+        else:
+            results = self.renderTilesInParallel(missing, scale,
+                    maxIterations, limit, interrupted)
+
+        for column, row, tile in results:
+            if tile is None or self.restart or self.abort:
+                break
+
+            self.tileCache.insert((scale, curpass, column, row), tile)
+            x, y, w, h = self.copyTile(pixels, left, top, width, height,
+                    column, row, tile[0])
+            allBlack = allBlack and tile[1]
+            numTiles += 1
+
+            self.renderedTile.emit(image.copy(x, y, w, h), x, y, centerX,
+                    centerY, scaleFactor)
+
+        if numTiles != 0 and numTiles == len(missing):
+            elapsed = max(timer.elapsed(), 1)
+            self.renderedTiles.emit(numTiles, numTiles * 1000.0 / elapsed)
+
+        return allBlack
+
+    @staticmethod
+    def copyTile(pixels, left, top, width, height, column, row, tilePixels):
+        """Copy the part of a tile that is visible in a view of the given
+        geometry and return the visible rectangle in view coordinates.
+        """
+
+        tileLeft = column * TileSize
+        tileTop = row * TileSize
+        x0 = max(tileLeft, left)
+        x1 = min(tileLeft + TileSize, left + width)
+        y0 = max(tileTop, top)
+        y1 = min(tileTop + TileSize, top + height)
+
+        pixels[y0 - top:y1 - top, x0 - left:x1 - left] = \
+                tilePixels[y0 - tileTop:y1 - tileTop, x0 - tileLeft:x1 - tileLeft]
+
+        return x0 - left, y0 - top, x1 - x0, y1 - y0
+
+    def renderTilesSerially(self, tiles, scale, maxIterations, limit,
+            interrupted):
+        for column, row in tiles:
+            yield column, row, renderTile(scale, column, row, maxIterations,
+                    limit, self.colormapArray, interrupted)
+
+    def renderTilesInParallel(self, tiles, scale, maxIterations, limit,
+            interrupted):
+        if not self.interruptible:
+            interrupted = None
+
+        pending = {}
+        for column, row in tiles:
+            future = self.executor.submit(renderTile, scale, column, row,
+                    maxIterations, limit, self.colormapArray, interrupted)
+            future.add_done_callback(self.tileFinished)
+            pending[future] = (column, row)
+
+        try:
+            while pending:
+                if self.restart or self.abort:
+                    break
+
+                finished = [future for future in pending if future.done()]
+                if not finished:
+                    # A finished tile or a new render request will wake us up.
+                    self.mutex.lock()
+                    if not (self.restart or self.abort or
+                            any(future.done() for future in pending)):
+                        self.condition.wait(self.mutex, 100)
+                    self.mutex.unlock()
+                    continue
+
+                for future in finished:
+                    column, row = pending.pop(future)
+                    yield column, row, future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def tileFinished(self, future):
+        self.mutex.lock()
+        self.condition.wakeOne()
+        self.mutex.unlock()
+
     def rgbFromWaveLength(self, wave):
         r = 0.0
         g = 0.0
@@ -224,6 +508,8 @@ class MandelbrotWidget(QWidget):
         self.curScale = DefaultScale
 
         self.thread.renderedImage.connect(self.updatePixmap)
+        self.thread.renderedTile.connect(self.updateTile)
+        self.thread.renderedTiles.connect(self.updateTileRate)
 
         self.setWindowTitle("Mandelbrot")
         self.setCursor(Qt.CrossCursor)
@@ -239,6 +525,22 @@ class MandelbrotWidget(QWidget):
                     "Rendering initial image, please wait...")
             return
 
+        self.drawPixmap(painter)
+
+        text = "Use mouse wheel or the '+' and '-' keys to zoom. Press and " \
+                "hold left mouse button to scroll."
+        metrics = painter.fontMetrics()
+        textWidth = metrics.width(text)
+
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 127))
+        painter.drawRect((self.width() - textWidth) / 2 - 5, 0, textWidth + 10,
+                metrics.lineSpacing() + 5)
+        painter.setPen(Qt.white)
+        painter.drawText((self.width() - textWidth) / 2,
+                metrics.leading() + metrics.ascent(), text)
+
+    def drawPixmap(self, painter):
         if self.curScale == self.pixmapScale:
             painter.drawPixmap(self.pixmapOffset, self.pixmap)
         else:
@@ -256,19 +558,6 @@ class MandelbrotWidget(QWidget):
             painter.drawPixmap(exposed, self.pixmap, exposed)
             painter.restore()
 
-        text = "Use mouse wheel or the '+' and '-' keys to zoom. Press and " \
-                "hold left mouse button to scroll."
-        metrics = painter.fontMetrics()
-        textWidth = metrics.width(text)
-
-        painter.setPen(Qt.NoPen)
-        painter.setBrush(QColor(0, 0, 0, 127))
-        painter.drawRect((self.width() - textWidth) / 2 - 5, 0, textWidth + 10,
-                metrics.lineSpacing() + 5)
-        painter.setPen(Qt.white)
-        painter.drawText((self.width() - textWidth) / 2,
-                metrics.leading() + metrics.ascent(), text)
-
     def resizeEvent(self, event):
         self.thread.render(self.centerX, self.centerY, self.curScale,
                 self.size())
@@ -323,6 +612,43 @@ class MandelbrotWidget(QWidget):
         self.pixmapScale = scaleFactor
         self.update()
 
+    def updateTile(self, tile, x, y, centerX, centerY, scaleFactor):
+        if not self.lastDragPos.isNull():
+            return
+
+        # Ignore tiles of a view that has since been scrolled, zoomed or
+        # resized.
+        if (centerX, centerY, scaleFactor) != (self.centerX, self.centerY, self.curScale):
+            return
+
+        if x + tile.width() > self.width() or y + tile.height() > self.height():
+            return
+
+        if (self.pixmap.size() != self.size() or
+                self.pixmapOffset != QPoint() or
+                self.pixmapScale != scaleFactor):
+            # Start from what is currently displayed so that the tiles are
+            # drawn over the previous (scrolled or scaled) image.
+            pixmap = QPixmap(self.size())
+            pixmap.fill(Qt.black)
+            if not self.pixmap.isNull():
+                painter = QPainter(pixmap)
+                self.drawPixmap(painter)
+                painter.end()
+
+            self.pixmap = pixmap
+            self.pixmapOffset = QPoint()
+            self.pixmapScale = scaleFactor
+
+        painter = QPainter(self.pixmap)
+        painter.drawImage(x, y, tile)
+        painter.end()
+        self.update()
+
+    def updateTileRate(self, numTiles, tilesPerSecond):
+        self.setWindowTitle("Mandelbrot - %d tiles at %.1f tiles/s" % (numTiles,
+                tilesPerSecond))
+
     def zoom(self, zoomFactor):
         self.curScale *= zoomFactor
         self.update()
@@ -342,6 +668,27 @@ if __name__ == '__main__':
     import sys
 
     app = QApplication(sys.argv)
+
+    parser = QCommandLineParser()
+    parser.setApplicationDescription("Mandelbrot Example")
+    parser.addHelpOption()
+
+    workersOption = QCommandLineOption(['w', 'workers'],
+            "Render the tiles of each pass using <count> workers.", 'count',
+            str(QThread.idealThreadCount()))
+    parser.addOption(workersOption)
+    processesOption = QCommandLineOption(['p', 'processes'],
+            "Use a pool of processes rather than threads.")
+    parser.addOption(processesOption)
+    cacheOption = QCommandLineOption(['c', 'cache-size'],
+            "Keep up to <megabytes> of rendered tiles.", 'megabytes',
+            str(TileCacheSize // (1024 * 1024)))
+    parser.addOption(cacheOption)
+    parser.process(app)
+
     widget = MandelbrotWidget()
+    widget.thread.setWorkers(int(parser.value(workersOption)),
+            parser.isSet(processesOption))
+    widget.thread.tileCache.maxBytes = int(parser.value(cacheOption)) * 1024 * 1024
     widget.show()
     sys.exit(app.exec_())
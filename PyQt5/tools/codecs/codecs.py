@@ -42,7 +42,14 @@
 #############################################################################
 
 
-from PyQt5.QtCore import QFile, QRegExp, QTextCodec, QTextStream
+import re
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt5.QtCore import (pyqtSignal, QFile, QFileInfo, QObject, QRegExp,
+        QSaveFile, Qt, QTextCodec, QThread)
+from PyQt5.QtGui import QCursor
 from PyQt5.QtWidgets import (QAction, QApplication, QComboBox, QDialog,
         QDialogButtonBox, QFileDialog, QGridLayout, QLabel, QMainWindow, QMenu,
         QMessageBox, QTextEdit)
@@ -59,7 +66,192 @@ def codec_name(codec):
     return name
 
 
+class CodecDetector(QObject):
+    """Scores how likely each candidate codec is to be the encoding of a
+    sample of a file in a pool of worker threads.  The most likely codec is
+    reported to the GUI thread by a queued signal.
+    """
+
+    # The size of the start of a sample that is scored.
+    SampleSize = 16 * 1024
+
+    detected = pyqtSignal(int, int)
+
+    # Control characters other than white space, replacement characters,
+    # unpaired surrogates and private use characters are taken as evidence of
+    # the wrong codec.  Decoders substitute them for input they can't decode.
+    invalidRegExp = re.compile(
+            r'[\x00-\x08\x0b\x0e-\x1f\x7f-\x9f'
+            r'\ufffd\ud800-\udfff\ue000-\uf8ff]')
+    nonAsciiRegExp = re.compile(r'[^\x00-\x7f]')
+    wordRegExp = re.compile(r'[^\W\d_]+')
+    spaceRegExp = re.compile(r'\s')
+
+    # The scripts that are written together.
+    scriptAliases = {'HIRAGANA': 'CJK', 'KATAKANA': 'CJK',
+            'KATAKANA-HIRAGANA': 'CJK', 'IDEOGRAPHIC': 'CJK'}
+
+    # The scripts that are written without spaces between words.
+    spacelessScripts = frozenset(['CJK', 'THAI'])
+
+    # The most frequent non-ASCII letters of the languages written with the
+    # scripts that a wrong codec most often decodes text to.  Other letters
+    # of a script are plausible but score half as much.  Kana are always
+    # frequent.
+    commonLetters = frozenset(
+            # Latin.
+            'àáâãäåæçèéêëìíîïñòóôõöøùúûüýÿßœąćčďęěğıłńňőřśşšťůűźżž'
+            # Greek.
+            'άέήίόύώαβγδεηικλμνοπρσςτυφχω'
+            # Cyrillic.
+            'абвгдеёжзийклмнопрстуфхцчшщъыьэюяєіїґў'
+            # Hebrew.
+            'אבגדהוזחטיךכלםמןנסעףפץצקרשת'
+            # Arabic.
+            'آأإابةتثجحخدذرزسشصضطظعغفقكلمنهوىيپچژکگی'
+            # Thai.
+            'กขคฆงจฉชซญฎฏฐฑฒณดตถทธนบปผฝพฟภมยรลวศษสหฬอฮะาำเแโใไๆ'
+            # Hangul.
+            '이다의는에하고을가로지기서한리사자대어도들수정게시아나인일상요보'
+            '주그해니것부있만전장제으우구소동과면비성라스원경마여문개적내국실'
+            '학화유행방없계분모생세신관연무물되를와은할합습니까던같'
+            # Hanzi and kanji, simplified and traditional.
+            '的一是不了在人有我他这个们中来上大为和国地到以说时要就出会可也你'
+            '对生能而子那得于着下自之年过发后作里用道行所然家种事成方多经么去'
+            '法学如都同现当没动面起看定天分还进好小部其些主样理心她本前开但因'
+            '只从想实日军者意无力它与长把机十民第公此已工使情明性知全三又关点'
+            '正业外将两高间由问很最重并物手应战向头文体政美相见被利什二等产或'
+            '新己制身果加西斯月话合回特代内信表化老给世位次度门任常先海通教儿'
+            '原东声提立及比员解水名真论处走义各入几口认条平系气题活尔更别打女'
+            '变四神总何电数安少报才结反受目太量再感建务做接必场件计管期市直德'
+            '資资命山金指克许统区保至队形社便空决治展马科司五基眼书非则听白却'
+            '界达光放强即像难且权思王象完设式色路记南品住告类求据程北边死张该'
+            '這個們來為國時說會對發後裡經麼學現當沒動還進樣從實軍無與長機開關'
+            '點業將兩間問應戰頭體見產話給門聲東員條題氣爾別變總電數報結義處論'
+            '認兒幾書則聽難權設記類邊張該務場計許統區隊決馬達據'
+            '気会円駅様続県伝読語図帰広転楽験')
+
+    def __init__(self, codecs, parent=None):
+        super(CodecDetector, self).__init__(parent)
+
+        # The codecs are in order of preference, which decides between codecs
+        # that score the same.  The IBM code pages are rarely used for text
+        # files so they are preferred least.
+        self.codecs = sorted(codecs,
+                key=lambda codec: codec_name(codec).startswith('IBM'))
+        self.coordinator = ThreadPoolExecutor(1)
+        self.executor = ThreadPoolExecutor(QThread.idealThreadCount())
+        self.generation = 0
+
+    def detect(self, sample):
+        """Start detecting the codec of a sample, abandoning any detection
+        that is in progress, and return the generation that identifies the
+        result.
+        """
+
+        self.generation += 1
+        self.coordinator.submit(self.detectCodec, self.generation,
+                sample[:self.SampleSize])
+
+        return self.generation
+
+    def shutdown(self):
+        self.coordinator.shutdown()
+        self.executor.shutdown()
+
+    def detectCodec(self, generation, sample):
+        if generation != self.generation:
+            return
+
+        # A byte order mark is conclusive.
+        codec = QTextCodec.codecForUtfText(sample, None)
+
+        if codec is None:
+            scores = list(self.executor.map(
+                    lambda codec: self.score(codec, sample), self.codecs))
+            best = max(range(len(scores)),
+                    key=lambda i: (scores[i], -i))
+            codec = self.codecs[best]
+
+        self.detected.emit(generation, codec.mibEnum())
+
+    @classmethod
+    def score(cls, codec, sample):
+        # The converter state holds back a character that is split by the end
+        # of the sample rather than letting it be decoded as invalid.
+        state = QTextCodec.ConverterState()
+        text = codec.toUnicode(sample, state)
+        if not text:
+            return 0.0
+
+        scripts = {}
+        weights = {}
+        symbols = 0
+        invalid = len(cls.invalidRegExp.findall(text))
+        for ch in set(cls.nonAsciiRegExp.findall(text)):
+            name = unicodedata.name(ch, 'UNKNOWN').split()[0]
+            scripts[ch] = cls.scriptAliases.get(name, name)
+            weights[ch] = 1.0 if (ch.lower() in cls.commonLetters or
+                    name in ('HIRAGANA', 'KATAKANA')) else 0.5
+
+            category = unicodedata.category(ch)
+            if category == 'Cn':
+                # Unassigned characters are as bad as decoder failures.
+                invalid += text.count(ch)
+            elif category[0] == 'S':
+                # Non-ASCII symbols are unusual in text.
+                symbols += text.count(ch)
+
+        # Letters must make plausible words.  A word must be in lower case,
+        # upper case or title case.  The non-ASCII letters of a word must all
+        # come from the same script.  If it is Latin then the word must be
+        # mostly ASCII letters as accented letters are the exception in the
+        # languages written with it, otherwise it must have no ASCII letters.
+        # Words of scripts that are written without spaces are kept apart as
+        # their text has few spaces.
+        letters = 0.0
+        spaceless = 0.0
+        unspaced = 0
+        for word in cls.wordRegExp.findall(text):
+            if not (word == word.lower() or word == word.upper() or
+                    word.istitle()):
+                continue
+
+            if word.isascii():
+                letters += len(word)
+                continue
+
+            wordScripts = set(scripts[ch] for ch in word if ch in scripts)
+            if len(wordScripts) == 1:
+                script = wordScripts.pop()
+                nonAscii = [ch for ch in word if ch in scripts]
+                weight = sum(weights[ch] for ch in nonAscii)
+                if script in cls.spacelessScripts:
+                    if len(nonAscii) == len(word):
+                        spaceless += weight
+                        unspaced += len(word)
+                elif script == 'LATIN':
+                    if 2 * len(nonAscii) <= len(word):
+                        letters += len(word) - len(nonAscii) + weight
+                elif len(nonAscii) == len(word):
+                    letters += weight
+
+        # Other text has lines, if not words, separated by white space.  This
+        # rejects, for example, ASCII text decoded as UTF-16.
+        spaces = len(cls.spaceRegExp.findall(text))
+        spacing = min(1.0, 50.0 * spaces / max(1, len(text) - unspaced))
+
+        return (spacing * (letters + spaces) + spaceless -
+                (10.0 * invalid + symbols)) / len(text)
+
+
 class MainWindow(QMainWindow):
+    # Files are read and written a chunk at a time.  Files larger than the
+    # edit size aren't loaded into the editor, instead the preview is shown
+    # and saving converts the file itself.
+    ChunkSize = 1 << 20
+    EditSize = 16 << 20
+
     def __init__(self):
         super(MainWindow, self).__init__()
 
@@ -70,6 +262,9 @@ class MainWindow(QMainWindow):
         self.codecs = []
         self.findCodecs()
 
+        self.sourceFileName = None
+        self.sourceCodec = None
+
         self.previewForm = PreviewForm(self)
         self.previewForm.setCodecList(self.codecs)
 
@@ -89,27 +284,130 @@ class MainWindow(QMainWindow):
                         "Cannot read file %s:\n%s" % (fileName, inFile.errorString()))
                 return
 
-            data = inFile.readAll()
+            self.previewForm.setFile(inFile)
+            if not self.previewForm.exec_():
+                return
+
+            codec = self.previewForm.codec()
+
+            if inFile.size() > self.EditSize:
+                self.sourceFileName = fileName
+                self.sourceCodec = codec
+                self.textEdit.setPlainText(self.previewForm.previewString())
+                self.textEdit.setReadOnly(True)
+                self.statusBar().showMessage(
+                        "Showing the start of %s, saving will convert the "
+                        "whole file" % fileName)
+                return
+
+            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+
+            inFile.seek(0)
+            decoder = codec.makeDecoder()
+            text = []
+            while not inFile.atEnd():
+                text.append(decoder.toUnicode(inFile.read(self.ChunkSize)))
 
-            self.previewForm.setEncodedData(data)
-            if self.previewForm.exec_():
-                self.textEdit.setPlainText(self.previewForm.decodedString())
+            self.sourceFileName = None
+            self.sourceCodec = None
+            self.textEdit.setPlainText(''.join(text))
+            self.textEdit.setReadOnly(False)
+            self.statusBar().clearMessage()
+
+            QApplication.restoreOverrideCursor()
 
     def save(self):
         fileName, _ = QFileDialog.getSaveFileName(self)
         if fileName:
-            outFile = QFile(fileName)
-            if not outFile.open(QFile.WriteOnly|QFile.Text):
+            # The file is only replaced once it has been written in full,
+            # which also allows a large file to be converted in place.
+            outFile = QSaveFile(fileName)
+
+            # A converted file keeps its own line endings.
+            mode = QFile.WriteOnly
+            if self.sourceFileName is None:
+                mode |= QFile.Text
+
+            if not outFile.open(mode):
                 QMessageBox.warning(self, "Codecs",
                         "Cannot write file %s:\n%s" % (fileName, outFile.errorString()))
                 return
 
             action = self.sender()
             codecName = action.data()
+            # As with QTextStream, no byte order mark is written.
+            encoder = QTextCodec.codecForName(codecName).makeEncoder(
+                    QTextCodec.IgnoreHeader)
+
+            QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
+            start = time.perf_counter()
+
+            if self.sourceFileName is None:
+                self.writeDocument(outFile, encoder)
+                error = None
+            else:
+                error = self.convertFile(outFile, encoder)
+
+            elapsed = time.perf_counter() - start
+            size = outFile.size()
+
+            if error is None and not outFile.commit():
+                error = outFile.errorString()
 
-            out = QTextStream(outFile)
-            out.setCodec(codecName)
-            out << self.textEdit.toPlainText()
+            QApplication.restoreOverrideCursor()
+
+            if error is not None:
+                outFile.cancelWriting()
+                QMessageBox.warning(self, "Codecs",
+                        "Cannot write file %s:\n%s" % (fileName, error))
+                return
+
+            # A file converted in place is now in the codec it was saved in.
+            if (self.sourceFileName is not None and
+                    QFileInfo(fileName) == QFileInfo(self.sourceFileName)):
+                self.sourceCodec = QTextCodec.codecForName(codecName)
+
+            self.statusBar().showMessage(
+                    "Wrote %.1f MB in %.1f s (%.1f MB/sec)" % (
+                            size / 1048576.0, elapsed,
+                            size / 1048576.0 / max(elapsed, 0.001)))
+
+    def writeDocument(self, outFile, encoder):
+        # Encode the text a block at a time rather than as a single string,
+        # batching the blocks to reduce the number of writes.
+        lines = []
+        size = 0
+        block = self.textEdit.document().begin()
+
+        while block.isValid():
+            lines.append(block.text())
+            size += len(lines[-1])
+            block = block.next()
+
+            if not block.isValid():
+                outFile.write(encoder.fromUnicode('\n'.join(lines)))
+            elif size >= self.ChunkSize:
+                lines.append('')
+                outFile.write(encoder.fromUnicode('\n'.join(lines)))
+                lines = []
+                size = 0
+
+    def convertFile(self, outFile, encoder):
+        # Return a description of any error.
+        inFile = QFile(self.sourceFileName)
+        if not inFile.open(QFile.ReadOnly):
+            return inFile.errorString()
+
+        decoder = self.sourceCodec.makeDecoder()
+        while not inFile.atEnd():
+            outFile.write(encoder.fromUnicode(
+                    decoder.toUnicode(inFile.read(self.ChunkSize))))
+
+        return None
+
+    def closeEvent(self, event):
+        self.previewForm.detector.shutdown()
+        super(MainWindow, self).closeEvent(event)
 
     def about(self):
         QMessageBox.about(self, "About Codecs",
@@ -117,12 +415,20 @@ class MainWindow(QMainWindow):
                 "write files using various encodings.")
 
     def aboutToShowSaveAsMenu(self):
-        currentText = self.textEdit.toPlainText()
+        # The whole of a file being converted isn't available to check so
+        # every codec is offered.  Otherwise it is enough to check that each
+        # codec can encode the different characters of the text.
+        if self.sourceFileName is None:
+            characters = ''.join(set(self.textEdit.toPlainText()))
+        else:
+            characters = None
 
         for action in self.saveAsActs:
             codecName = action.data()
             codec = QTextCodec.codecForName(codecName)
-            action.setVisible(codec and codec.canEncode(currentText))
+            action.setVisible(codec is not None and (characters is None or
+                    codec.canEncode(characters)))
+
 
     def findCodecs(self):
         codecMap = []
@@ -192,6 +498,9 @@ class MainWindow(QMainWindow):
 
 
 class PreviewForm(QDialog):
+    # Only the start of a file is decoded for the preview.
+    PreviewSize = 64 * 1024
+
     def __init__(self, parent):
         super(PreviewForm, self).__init__(parent)
 
@@ -203,9 +512,11 @@ class PreviewForm(QDialog):
         self.textEdit.setLineWrapMode(QTextEdit.NoWrap)
         self.textEdit.setReadOnly(True)
 
+        self.statusLabel = QLabel()
+
         buttonBox = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
 
-        self.encodingComboBox.activated.connect(self.updateTextEdit)
+        self.encodingComboBox.activated.connect(self.chooseCodec)
         buttonBox.accepted.connect(self.accept)
         buttonBox.rejected.connect(self.reject)
 
@@ -213,35 +524,72 @@ class PreviewForm(QDialog):
         mainLayout.addWidget(encodingLabel, 0, 0)
         mainLayout.addWidget(self.encodingComboBox, 0, 1)
         mainLayout.addWidget(self.textEdit, 1, 0, 1, 2)
-        mainLayout.addWidget(buttonBox, 2, 0, 1, 2)
+        mainLayout.addWidget(self.statusLabel, 2, 0, 1, 2)
+        mainLayout.addWidget(buttonBox, 3, 0, 1, 2)
         self.setLayout(mainLayout)
 
         self.setWindowTitle("Choose Encoding")
         self.resize(400, 300)
 
+        self.encodedData = b''
+        self.size = 0
+        self.generation = 0
+        self.codecChosen = False
+
     def setCodecList(self, codecs):
         self.encodingComboBox.clear()
         for codec in codecs:
             self.encodingComboBox.addItem(codec_name(codec), codec.mibEnum())
 
-    def setEncodedData(self, data):
-        self.encodedData = data
+        self.detector = CodecDetector(codecs, self)
+        self.detector.detected.connect(self.codecDetected)
+
+    def setFile(self, inFile):
+        # Only the start of the file is read, and it is also the sample used
+        # to detect the codec.
+        self.encodedData = bytes(inFile.read(self.PreviewSize))
+        self.size = inFile.size()
+
+        self.codecChosen = False
+        self.generation = self.detector.detect(self.encodedData)
+        self.statusLabel.setText("Detecting the encoding...")
+
         self.updateTextEdit()
 
-    def decodedString(self):
+    def codec(self):
+        mib = self.encodingComboBox.itemData(self.encodingComboBox.currentIndex())
+
+        return QTextCodec.codecForMib(mib)
+
+    def previewString(self):
         return self.decodedStr
 
-    def updateTextEdit(self):
-        mib = self.encodingComboBox.itemData(self.encodingComboBox.currentIndex())
-        codec = QTextCodec.codecForMib(mib)
+    def chooseCodec(self):
+        self.codecChosen = True
+        self.updateTextEdit()
 
-        data = QTextStream(self.encodedData)
-        data.setAutoDetectUnicode(False)
-        data.setCodec(codec)
+    def codecDetected(self, generation, mib):
+        if generation != self.generation:
+            return
 
-        self.decodedStr = data.readAll()
+        index = self.encodingComboBox.findData(mib)
+        self.statusLabel.setText("Detected encoding: %s" %
+                self.encodingComboBox.itemText(index))
+
+        # Don't override a codec chosen while detection was in progress.
+        if not self.codecChosen and index >= 0:
+            self.encodingComboBox.setCurrentIndex(index)
+            self.updateTextEdit()
+
+    def updateTextEdit(self):
+        self.decodedStr = self.codec().makeDecoder().toUnicode(
+                self.encodedData)
         self.textEdit.setPlainText(self.decodedStr)
 
+        if self.size > len(self.encodedData):
+            self.textEdit.append("\n[Showing the first %d KB of %.1f MB]" % (
+                    len(self.encodedData) // 1024, self.size / 1048576.0))
+
 
 if __name__ == '__main__':
 
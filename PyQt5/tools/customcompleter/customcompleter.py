@@ -42,7 +42,15 @@
 #############################################################################
 
 
-from PyQt5.QtCore import QFile, QStringListModel, Qt
+import hashlib
+import os
+import struct
+import time
+from array import array
+from itertools import accumulate
+
+from PyQt5.QtCore import (QAbstractListModel, QFile, QModelIndex,
+        QStandardPaths, Qt)
 from PyQt5.QtGui import QCursor, QKeySequence, QTextCursor
 from PyQt5.QtWidgets import (QAction, QApplication, QCompleter, QMainWindow,
         QMessageBox, QTextEdit)
@@ -50,6 +58,224 @@ from PyQt5.QtWidgets import (QAction, QApplication, QCompleter, QMainWindow,
 import customcompleter_rc
 
 
+class WordIndex(object):
+    """The words of a word list sorted case insensitively so that the words
+    starting with a prefix are found by a binary search.  The words and their
+    lower case keys are each stored as a single string with an array of
+    offsets, rather than as millions of separate objects, so that an index can
+    be written to and read from a cache file quickly.
+    """
+
+    CacheMagic = b'WIDX'
+    CacheVersion = 1
+    CacheHeader = struct.Struct('<4sIqqqqq')
+
+    def __init__(self, words=()):
+        words = sorted(words, key=str.lower)
+
+        self.words, self.wordOffsets = self.pack(words)
+        self.keys, self.keyOffsets = self.pack([word.lower() for word in words])
+
+    def __len__(self):
+        return len(self.wordOffsets) - 1
+
+    @staticmethod
+    def pack(strings):
+        offsets = array('q', [0])
+        offsets.extend(accumulate(map(len, strings)))
+
+        return ''.join(strings), offsets
+
+    def word(self, i):
+        return self.words[self.wordOffsets[i]:self.wordOffsets[i + 1]]
+
+    def lowerBound(self, key):
+        # Return the position of the first word whose key isn't less than a
+        # key.
+        keys = self.keys
+        offsets = self.keyOffsets
+        lo = 0
+        hi = len(offsets) - 1
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if keys[offsets[mid]:offsets[mid + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def findPrefix(self, prefix):
+        """Return the range of positions of the words starting with a prefix.
+        """
+
+        key = prefix.lower()
+
+        # Every key starting with the prefix is less than the prefix followed
+        # by the largest character.
+        return self.lowerBound(key), self.lowerBound(key + '\U0010ffff')
+
+    def matches(self, prefix, limit):
+        first, last = self.findPrefix(prefix)
+
+        return [self.word(i) for i in range(first, min(last, first + limit))]
+
+    @classmethod
+    def fromFile(cls, fileName, cacheDirectory=None):
+        """Return the index of a file of words, one per line, or None if it
+        couldn't be read.  The index of a file, rather than a resource, is
+        cached in a directory and rebuilt when the modification time or size
+        of the file changes.
+        """
+
+        try:
+            stat = os.stat(fileName)
+        except OSError:
+            stat = None
+
+        cacheName = None
+        if stat is not None and cacheDirectory:
+            cacheName = os.path.join(cacheDirectory, hashlib.sha1(
+                    os.path.abspath(fileName).encode('utf-8')).hexdigest() +
+                            '.idx')
+
+            index = cls.readCache(cacheName, stat)
+            if index is not None:
+                return index
+
+        f = QFile(fileName)
+        if not f.open(QFile.ReadOnly):
+            return None
+
+        text = str(f.readAll(), encoding='utf-8', errors='replace')
+        f.close()
+
+        index = cls([line for line in map(str.strip, text.splitlines())
+                if line])
+
+        if cacheName is not None:
+            index.writeCache(cacheName, stat)
+
+        return index
+
+    @classmethod
+    def readCache(cls, cacheName, stat):
+        try:
+            with open(cacheName, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        if len(data) < cls.CacheHeader.size:
+            return None
+
+        (magic, version, mtime, size, count, wordsSize,
+                keysSize) = cls.CacheHeader.unpack_from(data)
+
+        if (magic != cls.CacheMagic or version != cls.CacheVersion or
+                mtime != stat.st_mtime_ns or size != stat.st_size):
+            return None
+
+        offsetsSize = (count + 1) * array('q').itemsize
+        if len(data) != (cls.CacheHeader.size + 2 * offsetsSize + wordsSize +
+                keysSize):
+            return None
+
+        data = memoryview(data)[cls.CacheHeader.size:]
+
+        index = cls()
+        index.wordOffsets = array('q')
+        index.wordOffsets.frombytes(data[:offsetsSize])
+        data = data[offsetsSize:]
+        index.keyOffsets = array('q')
+        index.keyOffsets.frombytes(data[:offsetsSize])
+        data = data[offsetsSize:]
+        index.words = str(data[:wordsSize], encoding='utf-8')
+        index.keys = str(data[wordsSize:], encoding='utf-8')
+
+        return index
+
+    def writeCache(self, cacheName, stat):
+        words = self.words.encode('utf-8')
+        keys = self.keys.encode('utf-8')
+
+        try:
+            os.makedirs(os.path.dirname(cacheName), exist_ok=True)
+
+            # Write to a temporary file so that a partial index is never read.
+            with open(cacheName + '.part', 'wb') as f:
+                f.write(self.CacheHeader.pack(self.CacheMagic,
+                        self.CacheVersion, stat.st_mtime_ns, stat.st_size,
+                        len(self), len(words), len(keys)))
+                self.wordOffsets.tofile(f)
+                self.keyOffsets.tofile(f)
+                f.write(words)
+                f.write(keys)
+            os.replace(cacheName + '.part', cacheName)
+        except (IOError, OSError):
+            return False
+
+        return True
+
+
+class CompletionModel(QAbstractListModel):
+    """A model of the first words of a word index that start with a prefix.
+    Words are only taken from the index when a view asks for them.
+    """
+
+    MaxCompletions = 256
+
+    def __init__(self, index, parent=None):
+        super(CompletionModel, self).__init__(parent)
+
+        self.index = index
+        self.first = 0
+        self.count = 0
+
+    def setPrefix(self, prefix):
+        first, last = self.index.findPrefix(prefix)
+        count = min(last - first, self.MaxCompletions)
+
+        if first != self.first or count != self.count:
+            self.beginResetModel()
+            self.first = first
+            self.count = count
+            self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+
+        return self.count
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return self.index.word(self.first + index.row())
+
+        return None
+
+
+class IndexedCompleter(QCompleter):
+    """A completer that looks up its completions in a word index rather than
+    filtering every word of its model for each prefix.
+    """
+
+    def __init__(self, index, parent=None):
+        super(IndexedCompleter, self).__init__(parent)
+
+        self.setModel(CompletionModel(index, self))
+        self.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
+
+        # The model only contains the completions so it isn't filtered again.
+        self.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.popup().setUniformItemSizes(True)
+
+    def setCompletionPrefix(self, prefix):
+        self.model().setPrefix(prefix)
+        super(IndexedCompleter, self).setCompletionPrefix(prefix)
+
+
 class TextEdit(QTextEdit):
     def __init__(self, parent=None):
         super(TextEdit, self).__init__(parent)
@@ -69,7 +295,6 @@ class TextEdit(QTextEdit):
         self._completer = c
 
         c.setWidget(self)
-        c.setCompletionMode(QCompleter.PopupCompletion)
         c.setCaseSensitivity(Qt.CaseInsensitive)
         c.activated.connect(self.insertCompletion)
 
@@ -84,7 +309,8 @@ class TextEdit(QTextEdit):
         extra = len(completion) - len(self._completer.completionPrefix())
         tc.movePosition(QTextCursor.Left)
         tc.movePosition(QTextCursor.EndOfWord)
-        tc.insertText(completion[-extra:])
+        if extra > 0:
+            tc.insertText(completion[-extra:])
         self.setTextCursor(tc)
 
     def textUnderCursor(self):
@@ -135,15 +361,13 @@ class TextEdit(QTextEdit):
 
 
 class MainWindow(QMainWindow):
-    def __init__(self, parent=None):
+    def __init__(self, fileName=':/resources/wordlist.txt', parent=None):
         super(MainWindow, self).__init__(parent)
 
         self.createMenu()
 
         self.completingTextEdit = TextEdit()
-        self.completer = QCompleter(self)
-        self.completer.setModel(self.modelFromFile(':/resources/wordlist.txt'))
-        self.completer.setModelSorting(QCompleter.CaseInsensitivelySortedModel)
+        self.completer = IndexedCompleter(self.indexFromFile(fileName), self)
         self.completer.setCaseSensitivity(Qt.CaseInsensitive)
         self.completer.setWrapAround(False)
         self.completingTextEdit.setCompleter(self.completer)
@@ -168,27 +392,24 @@ class MainWindow(QMainWindow):
         helpMenu.addAction(aboutAct)
         helpMenu.addAction(aboutQtAct)
 
-    def modelFromFile(self, fileName):
-        f = QFile(fileName)
-        if not f.open(QFile.ReadOnly):
-            return QStringListModel(self.completer)
-
+    def indexFromFile(self, fileName):
         QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
 
-        words = []
-        while not f.atEnd():
-            line = f.readLine().trimmed()
-            if line.length() != 0:
-                try:
-                    line = str(line, encoding='ascii')
-                except TypeError:
-                    line = str(line)
-
-                words.append(line)
+        start = time.perf_counter()
+        index = WordIndex.fromFile(fileName, os.path.join(
+                QStandardPaths.writableLocation(QStandardPaths.CacheLocation),
+                'wordindex'))
+        elapsed = time.perf_counter() - start
 
         QApplication.restoreOverrideCursor()
 
-        return QStringListModel(words, self.completer)
+        if index is None:
+            return WordIndex()
+
+        self.statusBar().showMessage(
+                "Indexed %d words in %.0f ms" % (len(index), elapsed * 1000))
+
+        return index
 
     def about(self):
         QMessageBox.about(self, "About",
@@ -201,6 +422,7 @@ if __name__ == '__main__':
     import sys
 
     app = QApplication(sys.argv)
-    window = MainWindow()
+    # A file of words, one per line, may be given on the command line.
+    window = MainWindow(*sys.argv[1:2])
     window.show()
     sys.exit(app.exec_())
@@ -42,10 +42,14 @@
 #############################################################################
 
 
+import bisect
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from PyQt5.QtCore import (QByteArray, QDate, QDateTime, QEvent, QPoint, QRect,
-        QRegExp, QSettings, QSize, Qt, QTime, QTimer)
+from PyQt5.QtCore import (pyqtSignal, QByteArray, QDate, QDateTime, QEvent,
+        QFileSystemWatcher, QObject, QPoint, QRect, QRegExp, QSettings, QSize,
+        Qt, QTime, QTimer)
 from PyQt5.QtGui import QColor, QIcon, QRegExpValidator, QValidator
 from PyQt5.QtWidgets import (QAbstractItemView, QAction, QApplication,
         QComboBox, QDialog, QDialogButtonBox, QFileDialog, QGridLayout,
@@ -191,6 +195,10 @@ class MainWindow(QMainWindow):
 
         self.setWindowTitle("%s - Settings Editor" % niceName)
 
+    def closeEvent(self, event):
+        self.settingsTree.shutdown()
+        super(MainWindow, self).closeEvent(event)
+
 
 class LocationDialog(QDialog):
     def __init__(self, parent=None):
@@ -346,6 +354,109 @@ class LocationDialog(QDialog):
         self.locationsTable.setUpdatesEnabled(True)
 
 
+class SettingsSnapshot(object):
+    """The keys and values of a settings object at one point in time."""
+
+    def __init__(self, settings=None):
+        if settings is None:
+            self.values = {}
+        else:
+            value = settings.value
+            self.values = {key: value(key) for key in settings.allKeys()}
+
+    def difference(self, other):
+        # Return the keys that were added, removed and changed in going from
+        # this snapshot to another.
+        values = self.values
+        otherValues = other.values
+
+        added = [key for key in otherValues if key not in values]
+        removed = [key for key in values if key not in otherValues]
+        changed = [key for key, value in otherValues.items()
+                if key in values and not self.sameValue(values[key], value)]
+
+        return added, removed, changed
+
+    @staticmethod
+    def sameValue(value1, value2):
+        return type(value1) is type(value2) and value1 == value2
+
+
+class SettingsReader(QObject):
+    """Takes snapshots of settings in a background thread so that reading a
+    large file does not block the GUI.  Each snapshot is read by a separate
+    settings object for the same location and is delivered by a queued
+    signal.
+    """
+
+    snapshotRead = pyqtSignal(int, object)
+
+    def __init__(self, parent=None):
+        super(SettingsReader, self).__init__(parent)
+
+        self.executor = ThreadPoolExecutor(1)
+        self.generation = 0
+
+    def read(self, settings):
+        """Start reading a snapshot of the given settings, abandoning any read
+        that is in progress, and return the generation that identifies the
+        snapshot.
+        """
+
+        self.generation += 1
+
+        self.executor.submit(self.run, self.generation,
+                self.location(settings), settings.fallbacksEnabled())
+
+        return self.generation
+
+    def shutdown(self):
+        self.generation += 1
+        self.executor.shutdown()
+
+    def run(self, generation, location, fallbacksEnabled):
+        if generation != self.generation:
+            return
+
+        settings = QSettings(*location)
+        settings.setFallbacksEnabled(fallbacksEnabled)
+        snapshot = SettingsSnapshot(settings)
+
+        if generation == self.generation:
+            self.snapshotRead.emit(generation, snapshot)
+
+    @staticmethod
+    def location(settings):
+        # Return the arguments that create another settings object for the
+        # same location.
+        if settings.organizationName():
+            return (settings.format(), settings.scope(),
+                    settings.organizationName(), settings.applicationName())
+
+        return (settings.fileName(), settings.format())
+
+    @staticmethod
+    def fileNames(settings):
+        # Return the names of the files that the settings are read from,
+        # including any fallbacks.
+        if not settings.organizationName() or not settings.fallbacksEnabled():
+            return [settings.fileName()]
+
+        if settings.scope() == QSettings.UserScope:
+            scopes = (QSettings.UserScope, QSettings.SystemScope)
+        else:
+            scopes = (QSettings.SystemScope, )
+
+        if settings.applicationName():
+            applications = (settings.applicationName(), '')
+        else:
+            applications = ('', )
+
+        return [QSettings(settings.format(), scope,
+                        settings.organizationName(), application).fileName()
+                for scope in scopes for application in applications]
+
+
 class SettingsTree(QTreeWidget):
     def __init__(self, parent=None):
         super(SettingsTree, self).__init__(parent)
@@ -361,6 +472,28 @@ class SettingsTree(QTreeWidget):
         self.refreshTimer.setInterval(2000)
         self.autoRefresh = False
 
+        # Changes to files are watched for where possible rather than polling
+        # with the refresh timer.  The changes are checked for after a short
+        # delay as a file is often changed by several operations.
+        self.fileWatcher = QFileSystemWatcher(self)
+        self.fileNames = []
+        self.fileStamps = {}
+        self.watchTimer = QTimer(self)
+        self.watchTimer.setSingleShot(True)
+        self.watchTimer.setInterval(200)
+
+        self.reader = SettingsReader(self)
+        self.readGeneration = 0
+        self.reading = False
+        self.refreshPending = False
+        self.pendingSnapshot = None
+
+        # The current snapshot, the paths of its groups and an index of the
+        # items that display it by path.
+        self.snapshot = SettingsSnapshot()
+        self.groupPaths = set()
+        self.items = {}
+
         self.groupIcon = QIcon()
         self.groupIcon.addPixmap(self.style().standardPixmap(QStyle.SP_DirClosedIcon),
                 QIcon.Normal, QIcon.Off)
@@ -370,18 +503,31 @@ class SettingsTree(QTreeWidget):
         self.keyIcon.addPixmap(self.style().standardPixmap(QStyle.SP_FileIcon))
 
         self.refreshTimer.timeout.connect(self.maybeRefresh)
+        self.fileWatcher.fileChanged.connect(self.watchTimer.start)
+        self.fileWatcher.directoryChanged.connect(self.watchTimer.start)
+        self.watchTimer.timeout.connect(self.checkFiles)
+        self.reader.snapshotRead.connect(self.snapshotRead)
+        self.itemChanged.connect(self.updateSetting)
 
     def setSettingsObject(self, settings):
         self.settings = settings
         self.clear()
 
+        self.snapshot = SettingsSnapshot()
+        self.groupPaths = set()
+        self.items = {}
+        self.reading = False
+        self.refreshPending = False
+        self.pendingSnapshot = None
+
         if self.settings is not None:
             self.settings.setParent(self)
             self.refresh()
-            if self.autoRefresh:
-                self.refreshTimer.start()
-        else:
-            self.refreshTimer.stop()
+
+        self.updateWatching()
+
+    def shutdown(self):
+        self.reader.shutdown()
 
     def sizeHint(self):
         return QSize(800, 600)
@@ -389,17 +535,77 @@ class SettingsTree(QTreeWidget):
     def setAutoRefresh(self, autoRefresh):
         self.autoRefresh = autoRefresh
 
-        if self.settings is not None:
-            if self.autoRefresh:
-                self.maybeRefresh()
-                self.refreshTimer.start()
-            else:
-                self.refreshTimer.stop()
+        if self.settings is not None and self.autoRefresh:
+            self.maybeRefresh()
+
+        self.updateWatching()
 
     def setFallbacksEnabled(self, enabled):
         if self.settings is not None:
             self.settings.setFallbacksEnabled(enabled)
             self.refresh()
+            self.updateWatching()
+
+    def updateWatching(self):
+        self.refreshTimer.stop()
+        self.watchTimer.stop()
+
+        watched = self.fileWatcher.files() + self.fileWatcher.directories()
+        if watched:
+            self.fileWatcher.removePaths(watched)
+
+        self.fileNames = []
+        self.fileStamps = {}
+
+        if self.settings is None or not self.autoRefresh:
+            return
+
+        # Registry paths, for example, are not files and are polled instead.
+        for fileName in SettingsReader.fileNames(self.settings):
+            dirName = os.path.dirname(fileName)
+            if dirName and os.path.isdir(dirName):
+                self.fileNames.append(fileName)
+
+        if not self.fileNames:
+            self.refreshTimer.start()
+            return
+
+        # The directories are watched as well as the files so that a file that
+        # is created, or replaced by renaming another file over it (as
+        # QSettings itself does), is noticed.
+        self.fileStamps = self.currentFileStamps()
+        self.fileWatcher.addPaths(
+                sorted(set(os.path.dirname(f) for f in self.fileNames)))
+        self.watchFiles()
+
+    def watchFiles(self):
+        watched = self.fileWatcher.files()
+        missing = [f for f in self.fileNames
+                if f not in watched and os.path.isfile(f)]
+        if missing:
+            self.fileWatcher.addPaths(missing)
+
+    def currentFileStamps(self):
+        stamps = {}
+
+        for fileName in self.fileNames:
+            try:
+                st = os.stat(fileName)
+                stamps[fileName] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                stamps[fileName] = None
+
+        return stamps
+
+    def checkFiles(self):
+        # Other files in a watched directory may have changed, so only refresh
+        # if one of the settings files has.
+        self.watchFiles()
+
+        stamps = self.currentFileStamps()
+        if stamps != self.fileStamps:
+            self.fileStamps = stamps
+            self.maybeRefresh()
 
     def maybeRefresh(self):
         if self.state() != QAbstractItemView.EditingState:
@@ -409,14 +615,109 @@ class SettingsTree(QTreeWidget):
         if self.settings is None:
             return
 
-        # The signal might not be connected.
-        try:
-            self.itemChanged.disconnect(self.updateSetting)
-        except:
-            pass
+        # Only one snapshot is read at a time.  Requests made while it is
+        # being read are merged into one that is made when it has finished.
+        if self.reading:
+            self.refreshPending = True
+            return
 
-        self.settings.sync()
-        self.updateChildItems(None)
+        self.reading = True
+        self.readGeneration = self.reader.read(self.settings)
+
+    def snapshotRead(self, generation, snapshot):
+        if generation != self.readGeneration:
+            return
+
+        self.reading = False
+
+        # Don't change the items while one is being edited.
+        if self.state() == QAbstractItemView.EditingState:
+            self.pendingSnapshot = snapshot
+        else:
+            self.applySnapshot(snapshot)
+
+        if self.refreshPending:
+            self.refreshPending = False
+            self.refresh()
+
+    def closeEditor(self, editor, hint):
+        super(SettingsTree, self).closeEditor(editor, hint)
+
+        if self.pendingSnapshot is not None:
+            snapshot = self.pendingSnapshot
+            self.pendingSnapshot = None
+            self.applySnapshot(snapshot)
+
+    def applySnapshot(self, snapshot):
+        added, removed, changed = self.snapshot.difference(snapshot)
+        self.snapshot = snapshot
+
+        # A path is displayed by one item that may be a group, a key or both.
+        # Groups are placed before keys, so an item whose path becomes, or
+        # stops being, a group has to be moved.
+        groupPaths = set()
+        for key in snapshot.values:
+            path = key.rpartition('/')[0]
+            while path and path not in groupPaths:
+                groupPaths.add(path)
+                path = path.rpartition('/')[0]
+
+        oldPaths = set(self.items)
+        newPaths = groupPaths.union(snapshot.values)
+        removedPaths = oldPaths - newPaths
+        movedPaths = [path for path in oldPaths - removedPaths
+                if (path in groupPaths) != (path in self.groupPaths)]
+
+        self.itemChanged.disconnect(self.updateSetting)
+
+        # Items are taken out while the order of their siblings is that of the
+        # old snapshot.  The children of a removed item go with it.
+        for path in removedPaths:
+            if path.rpartition('/')[0] not in removedPaths:
+                self.takeItem(self.items[path])
+
+        for path in removedPaths:
+            del self.items[path]
+
+        for path in movedPaths:
+            self.takeItem(self.items[path])
+
+        self.groupPaths = groupPaths
+
+        # Items are added to items that are not in the tree immediately, but
+        # are only inserted into items that are at the end, in as few
+        # operations as possible.
+        detached = set(movedPaths)
+        pending = {}
+
+        for path in movedPaths:
+            self.addItem(path, detached, pending)
+
+        for path in sorted(newPaths - oldPaths):
+            item = QTreeWidgetItem()
+            item.setText(0, path.rpartition('/')[2])
+            item.setData(0, Qt.UserRole, path)
+            item.setFlags(item.flags() | Qt.ItemIsEditable)
+            self.items[path] = item
+            detached.add(path)
+
+            self.addItem(path, detached, pending)
+
+        for parent, items in pending.values():
+            self.insertItems(parent, items)
+
+        for key in added:
+            self.setItemValue(self.items[key], snapshot.values[key])
+
+        for key in changed:
+            self.setItemValue(self.items[key], snapshot.values[key])
+
+        for key in removed:
+            item = self.items.get(key)
+            if item is not None:
+                item.setText(1, '')
+                item.setText(2, '')
+                item.setData(2, Qt.UserRole, None)
 
         self.itemChanged.connect(self.updateSetting)
 
@@ -428,87 +729,99 @@ class SettingsTree(QTreeWidget):
         return super(SettingsTree, self).event(event)
 
     def updateSetting(self, item):
-        key = item.text(0)
-        ancestor = item.parent()
+        key = item.data(0, Qt.UserRole)
+        if key not in self.snapshot.values:
+            return
 
-        while ancestor:
-            key = ancestor.text(0) + '/' + key
-            ancestor = ancestor.parent()
+        # The delegate changes the displayed text and the value separately.
+        value = item.data(2, Qt.UserRole)
+        if SettingsSnapshot.sameValue(self.snapshot.values.get(key), value):
+            return
 
-        d = item.data(2, Qt.UserRole)
-        self.settings.setValue(key, item.data(2, Qt.UserRole))
+        self.settings.setValue(key, value)
+        self.settings.sync()
 
-        if self.autoRefresh:
-            self.refresh()
+        # Only the edited setting needs to be read back.
+        value = self.settings.value(key)
+        self.snapshot.values[key] = value
 
-    def updateChildItems(self, parent):
-        dividerIndex = 0
-
-        for group in self.settings.childGroups():
-            childIndex = self.findChild(parent, group, dividerIndex)
-            if childIndex != -1:
-                child = self.childAt(parent, childIndex)
-                child.setText(1, '')
-                child.setText(2, '')
-                child.setData(2, Qt.UserRole, None)
-                self.moveItemForward(parent, childIndex, dividerIndex)
-            else:
-                child = self.createItem(group, parent, dividerIndex)
-
-            child.setIcon(0, self.groupIcon)
-            dividerIndex += 1
-
-            self.settings.beginGroup(group)
-            self.updateChildItems(child)
-            self.settings.endGroup()
-
-        for key in self.settings.childKeys():
-            childIndex = self.findChild(parent, key, 0)
-            if childIndex == -1 or childIndex >= dividerIndex:
-                if childIndex != -1:
-                    child = self.childAt(parent, childIndex)
-                    for i in range(child.childCount()):
-                        self.deleteItem(child, i)
-                    self.moveItemForward(parent, childIndex, dividerIndex)
-                else:
-                    child = self.createItem(key, parent, dividerIndex)
-                child.setIcon(0, self.keyIcon)
-                dividerIndex += 1
-            else:
-                child = self.childAt(parent, childIndex)
+        if self.autoRefresh:
+            self.itemChanged.disconnect(self.updateSetting)
+            self.setItemValue(item, value)
+            self.itemChanged.connect(self.updateSetting)
 
-            value = self.settings.value(key)
-            if value is None:
-                child.setText(1, 'Invalid')
-            else:
-                child.setText(1, value.__class__.__name__)
-            child.setText(2, VariantDelegate.displayText(value))
-            child.setData(2, Qt.UserRole, value)
+    def setItemValue(self, item, value):
+        if value is None:
+            item.setText(1, 'Invalid')
+        else:
+            item.setText(1, value.__class__.__name__)
+        item.setText(2, VariantDelegate.displayText(value))
+        item.setData(2, Qt.UserRole, value)
 
-        while dividerIndex < self.childCount(parent):
-            self.deleteItem(parent, dividerIndex)
+    def addItem(self, path, detached, pending):
+        item = self.items[path]
 
-    def createItem(self, text, parent, index):
-        after = None
+        if path in self.groupPaths:
+            item.setIcon(0, self.groupIcon)
+        else:
+            item.setIcon(0, self.keyIcon)
 
-        if index != 0:
-            after = self.childAt(parent, index - 1)
+        parentPath = path.rpartition('/')[0]
+        parent = self.items[parentPath] if parentPath else None
 
-        if parent is not None:
-            item = QTreeWidgetItem(parent, after)
+        if parentPath in detached:
+            parent.insertChild(self.findPosition(parent, item), item)
         else:
-            item = QTreeWidgetItem(self, after)
+            pending.setdefault(parentPath, (parent, []))[1].append(item)
+
+    def insertItems(self, parent, items):
+        # The positions are all found before any item is inserted.  The items
+        # are then inserted from the last position to the first so that the
+        # earlier positions remain valid.
+        items.sort(key=self.sortKey)
+        positions = [self.findPosition(parent, item) for item in items]
+
+        end = len(items)
+        while end > 0:
+            position = positions[end - 1]
+            start = bisect.bisect_left(positions, position, 0, end)
+
+            if parent is not None:
+                parent.insertChildren(position, items[start:end])
+            else:
+                self.insertTopLevelItems(position, items[start:end])
 
-        item.setText(0, text)
-        item.setFlags(item.flags() | Qt.ItemIsEditable)
-        return item
+            end = start
+
+    def takeItem(self, item):
+        parent = item.parent()
+        position = self.findPosition(parent, item)
 
-    def deleteItem(self, parent, index):
         if parent is not None:
-            item = parent.takeChild(index)
+            parent.takeChild(position)
         else:
-            item = self.takeTopLevelItem(index)
-        del item
+            self.takeTopLevelItem(position)
+
+    def sortKey(self, item):
+        # Groups are placed before keys and both are sorted by name.
+        return (item.data(0, Qt.UserRole) not in self.groupPaths,
+                item.text(0))
+
+    def findPosition(self, parent, item):
+        # Return the position of an item among its siblings, or where it
+        # should be inserted.
+        sortKey = self.sortKey(item)
+        low = 0
+        high = self.childCount(parent)
+
+        while low < high:
+            middle = (low + high) // 2
+            if self.sortKey(self.childAt(parent, middle)) < sortKey:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
 
     def childAt(self, parent, index):
         if parent is not None:
@@ -522,16 +835,6 @@ class SettingsTree(QTreeWidget):
         else:
             return self.topLevelItemCount()
 
-    def findChild(self, parent, text, startIndex):
-        for i in range(self.childCount(parent)):
-            if self.childAt(parent, i).text(0) == text:
-                return i
-        return -1
-
-    def moveItemForward(self, parent, oldIndex, newIndex):
-        for int in range(oldIndex - newIndex):
-            self.deleteItem(parent, newIndex)
-
 
 class VariantDelegate(QItemDelegate):
     def __init__(self, parent=None):